@@ -3,13 +3,14 @@ import sys
 import pandas as pd
 import numpy as np
 from source_reference import return_sources
-from pg_connection import pg_connection, convert_cols_db
-from sqlalchemy import types as sql_types
-
-conn = pg_connection()
-
-
-def source_raw_tables():
+from pg_connection import pg_connection, convert_cols_db, transaction
+from name_normalization import add_name_key_column, update_name_keys
+from entity_cache import create_cache_table
+from logging_ipo_dates import logger
+from sqlalchemy import text, types as sql_types
+from run_context import context
+
+def source_raw_tables(conn):
     sources_dict = return_sources(source_type='all')
     source_folder = os.path.join(os.getcwd(), 'Data from Sources')
     for source, details in sources_dict.items():
@@ -27,13 +28,46 @@ def source_raw_tables():
                   })
 
 
-def entity_mapping_table():
+def entity_mapping_table(conn):
     df = pd.read_excel(os.path.join('Reference', 'Entity Mapping.xlsx'))
     df.columns = convert_cols_db(df.columns)
-    df.to_sql('entity_mapping', conn, if_exists='replace', index=False)
-
-
-def peo_pipe_table():
+    with transaction(conn):
+        df.to_sql('entity_mapping', conn, if_exists='replace', index=False)
+    create_mapping_key(conn)
+
+
+def create_mapping_key(conn):
+    """
+    Adds the name_key column and its unique index to entity_mapping if the index doesn't exist.
+    Duplicate name keys are removed first, keeping the row with the highest confidence score.
+    """
+    with transaction(conn):
+        exists = conn.execute(text("SELECT 1 FROM pg_indexes WHERE tablename = 'entity_mapping' "
+                                   "AND indexname = 'entity_mapping_name_key'")).scalar()
+    if exists:
+        return
+    with transaction(conn):
+        add_name_key_column(conn, 'entity_mapping', index=False)
+    # fills the name_key column for rows saved before it existed
+    update_name_keys(conn, 'entity_mapping')
+    with transaction(conn):
+        removed = conn.execute(text("""
+        DELETE FROM entity_mapping em
+        USING (
+            SELECT ctid, ROW_NUMBER() OVER (
+                PARTITION BY name_key ORDER BY confidencescore DESC NULLS LAST, iconum IS NULL) AS rn
+            FROM entity_mapping
+            WHERE name_key IS NOT NULL
+        ) d
+        WHERE em.ctid = d.ctid AND d.rn > 1
+        """)).rowcount
+        conn.execute(text("CREATE UNIQUE INDEX entity_mapping_name_key ON entity_mapping (name_key)"))
+        # the unique index replaces the index update_name_keys used to add
+        conn.execute(text("DROP INDEX IF EXISTS entity_mapping_name_key_idx"))
+    logger.info(f"Removed {removed} duplicate rows from entity_mapping and added the unique name_key index")
+
+
+def peo_pipe_table(conn):
     df = pd.read_excel(os.path.join('Reference', 'PEO-PIPE IPO Data.xlsx'))
     df['exchange'] = df['exchange'].str.strip()
     df['deal_status'] = df['deal_status'].str.strip()
@@ -44,16 +78,38 @@ def peo_pipe_table():
     df.drop_duplicates(subset=['iconum', 'master_deal', 'ticker'], inplace=True)
     df['ticker'] = df['ticker'].replace(['nan', 'None'], np.nan)
     df.columns = df.columns = convert_cols_db(df.columns)
-    df.to_sql('peo_pipe', conn, if_exists='replace', index=False)
-
-
-def comparison_table():
-    df = pd.read_excel(os.path.join('Results', 'IPO Monitoring.xlsx'), sheet_name='Comparison')
+    with transaction(conn):
+        df.to_sql('peo_pipe', conn, if_exists='replace', index=False)
+        add_name_key_column(conn, 'peo_pipe')
+    update_name_keys(conn, 'peo_pipe')
+
+
+def name_key_columns(conn):
+    """
+    Adds the name_key columns and indexes used to match company names to existing tables and fills them,
+    and the resolution cache the query for unmapped names joins on.
+    Tables that are replaced get their indexes back when they are replaced, this is only needed once for a database.
+    """
+    for table in ['all_ipos', 'peo_pipe']:
+        with transaction(conn):
+            add_name_key_column(conn, table)
+        update_name_keys(conn, table)
+    with transaction(conn):
+        conn.execute(text("CREATE INDEX IF NOT EXISTS all_ipos_time_added_idx ON all_ipos (time_added DESC)"))
+        create_cache_table(conn)
+    create_mapping_key(conn)
+
+
+def comparison_table(conn):
+    if context.has('Comparison'):
+        df = context.get('Comparison')
+    else:
+        df = pd.read_excel(os.path.join('Results', 'IPO Monitoring.xlsx'), sheet_name='Comparison')
     df.columns = df.columns = convert_cols_db(df.columns)
     df.to_sql('comparison', conn, if_exists='replace', index=False)
 
 
-def webscraping_results():
+def webscraping_results(conn):
     df_all = pd.read_csv(os.path.join('Logs', 'Webscraping Results.csv'))
     df_all.columns = df_all.columns = convert_cols_db(df_all.columns)
     df_all.to_sql('webscraping_results', conn, if_exists='replace', index=False)
@@ -63,15 +119,23 @@ def webscraping_results():
     df.to_sql('webscraping_results_recent', conn, if_exists='replace', index=False)
 
 
-def rpd_table():
-    df = pd.read_excel(os.path.join('Reference', 'IPO Monitoring RPDs.xlsx'))
+def rpd_table(conn):
+    if context.has('IPO Monitoring RPDs'):
+        df = context.get('IPO Monitoring RPDs')
+    else:
+        df = pd.read_excel(os.path.join('Reference', 'IPO Monitoring RPDs.xlsx'))
     df.columns = df.columns = convert_cols_db(df.columns)
     df.to_sql('rpd_ipo_monitoring', conn, if_exists='replace', index=False)
 
 
 if __name__ == '__main__':
+    conn = pg_connection()
+    try:
+        entity_mapping_table(conn)
+    except Exception as e:
+        print(e, sys.exc_info())
     try:
-        entity_mapping_table()
+        name_key_columns(conn)
     except Exception as e:
         print(e, sys.exc_info())
     finally:
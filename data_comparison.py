@@ -3,22 +3,28 @@ import sys
 import pandas as pd
 import numpy as np
 from datetime import date
+from sqlalchemy import text
 from configparser import ConfigParser
 from logging_ipo_dates import logger, error_email
-from pg_connection import pg_connection, convert_cols_db, sql_types
+from pg_connection import pg_connection, transaction, convert_cols_db, sql_types
+from name_normalization import update_name_keys, add_name_key_column
+from entity_codec import entity_ids_to_iconums
+from run_context import context
 
 pd.options.mode.chained_assignment = None
 
 
 class DataComparison:
-    def __init__(self):
+    def __init__(self, pipe_data_only: bool = False):
         self.config = ConfigParser()
         self.config.read('db_connection.ini')
         self.ref_folder = os.path.join(os.getcwd(), 'Reference')
         self.conn = pg_connection()
-        self.df_pp = self.pipe_data()
-        self.df_e = self.entity_data()
-        self.df_s = self.source_data()
+        # PEO-PIPE data is updated in its own stage when running from main.py
+        self.df_pp = context.get('PEO-PIPE') if context.has('PEO-PIPE') else self.pipe_data()
+        if not pipe_data_only:
+            self.df_e = self.entity_data()
+            self.df_s = self.source_data()
 
     def pipe_data(self):
         date_cols = ['announcement_date', 'pricing_date', 'trading_date', 'closing_date', 'last_updated_date_utc']
@@ -69,15 +75,26 @@ class DataComparison:
         # Also could have duplicates if ticker is initially NA, then later added for the same master deal
         df.drop_duplicates(subset=['iconum', 'master_deal', 'ticker'], inplace=True)
         try:
-            df.to_sql('peo_pipe', self.conn, if_exists='replace', index=False)
+            with transaction(self.conn):
+                df.to_sql('peo_pipe', self.conn, if_exists='replace', index=False)
+                # replacing the table drops its indexes, name_key and iconum are used to join it to all_ipos
+                self.conn.execute(text("CREATE INDEX IF NOT EXISTS peo_pipe_iconum_idx ON peo_pipe (iconum)"))
+                add_name_key_column(self.conn, 'peo_pipe')
+            update_name_keys(self.conn, 'peo_pipe')
         except Exception as e:
             logger.error(e, exc_info=sys.exc_info())
+        context.put('PEO-PIPE', df)
         return df
 
     def entity_data(self):
-        return pd.read_sql_table('entity_mapping', self.conn)
+        update_name_keys(self.conn, 'entity_mapping')
+        df = pd.read_sql_table('entity_mapping', self.conn)
+        # rows with an entity ID but no iconum
+        df['iconum'] = df['iconum'].fillna(entity_ids_to_iconums(df['entity_id']).astype(float))
+        return df
 
     def source_data(self):
+        update_name_keys(self.conn, 'all_ipos')
         return pd.read_sql_table('all_ipos', self.conn)
 
     def concatenate_ticker_exchange(self):
@@ -111,8 +128,10 @@ class DataComparison:
         self.df_pp.drop_duplicates(subset=['iconum', 'master_deal'], inplace=True)
 
     def merge_entity_data(self):
-        # merge data from sources with entities data
-        df_m = pd.merge(self.df_s, self.df_e[['company_name', 'entityname', 'iconum']], how='left')
+        # merge data from sources with entities data using the normalized company name
+        df_e = self.df_e.sort_values(by='confidencescore', ascending=False)
+        df_e = df_e[['name_key', 'entityname', 'iconum']].dropna(subset=['name_key']).drop_duplicates(subset='name_key')
+        df_m = pd.merge(self.df_s, df_e, how='left', on='name_key')
         # Chinese exchanges will have company name in Chinese
         # the Concordance API will rarely return an iconum for a Chinese name
         # If there is no iconum for a company on a Chinese exchange, try to compare PEO-PIPE data based on the Symbol
@@ -148,9 +167,9 @@ class DataComparison:
             | (df_outer['trading_date'].dt.date >= date.today())
         ]
         # TODO: save this data to the database
-        df_ipo.to_excel(os.path.join(self.ref_folder, 'IPO Monitoring Data.xlsx'), index=False)
+        context.put('IPO Monitoring Data', df_ipo, os.path.join(self.ref_folder, 'IPO Monitoring Data.xlsx'))
         df_wd = df_outer.loc[df_outer['status'] == 'Withdrawn']
-        df_wd.to_excel(os.path.join(self.ref_folder, 'Withdrawn IPOs.xlsx'), index=False)
+        context.put('Withdrawn IPOs', df_wd, os.path.join(self.ref_folder, 'Withdrawn IPOs.xlsx'))
 
     def compare(self):
         # no longer needed, leaving method but not calling it
@@ -172,13 +191,21 @@ class DataComparison:
                      'min_offering_price', 'max_offering_price', 'announcement_date', 'pricing_date', 'trading_date',
                      'closing_date', 'deal_status', 'last_updated_date_utc']]
         df_m.drop_duplicates(inplace=True)
-        df_m.to_sql('comparison', self.conn, if_exists='replace', index=False)
+        with transaction(self.conn):
+            df_m.to_sql('comparison', self.conn, if_exists='replace', index=False)
+        context.put('Comparison', df_m)
         return df_m
 
     def close_connection(self):
         self.conn.close()
 
 
+def update_pipe_data():
+    logger.info("Updating PEO-PIPE data")
+    dc = DataComparison(pipe_data_only=True)
+    dc.close_connection()
+
+
 def main():
     logger.info("Comparing external data with data collected internally")
     dc = DataComparison()
@@ -188,6 +215,7 @@ def main():
     except Exception as e:
         logger.error(e, exc_info=sys.exc_info())
         error_email(str(e))
+        raise
     finally:
         dc.close_connection()
 
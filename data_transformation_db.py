@@ -5,15 +5,53 @@ import numpy as np
 from datetime import date, datetime
 from logging_ipo_dates import logger, error_email
 import json
-from pg_connection import pg_connection, sql_types
+from sqlalchemy import text
+from pg_connection import pg_connection, transaction, sql_types
+from source_reconciliation import SourceReconciler
+from snapshot_archive import archive_frame
+from excel_export import save_excel
+from name_normalization import remove_asset_types, format_jpx_names, remove_parentheticals, remove_commas, name_keys, \
+    add_name_key_column
 
 pd.options.mode.chained_assignment = None
 
 
 class DataTransformation:
-    def __init__(self):
-        self.time_checked_str = datetime.utcnow().strftime('%Y-%m-%d %H:%M')
-        self.conn = pg_connection()
+    # raw sources read by each exchange method
+    # in incremental builds an exchange is only recomputed when one of its sources has changed
+    transform_sources = {
+        'us': ['NYSE', 'NYSE Withdrawn', 'Nasdaq', 'Nasdaq Priced', 'Nasdaq Withdrawn', 'IPOScoop', 'AlphaVantage'],
+        'jpx': ['JPX', 'TokyoIPO'],
+        'cn': ['Shanghai', 'CNInfo', 'East Money'],
+        'euronext': ['Euronext'],
+        'aastocks': ['AAStocks'],
+        # 'lse': ['LSE'],
+        'tmx': ['TMX'],
+        'frankfurt': ['Frankfurt'],
+        'krx': ['KRX'],
+        'asx': ['ASX'],
+        'twse': ['TWSE'],
+        'bme': ['BME'],
+        'sgx': ['SGX'],
+        'idx': ['IDX'],
+        'bm': ['BM'],
+        'nasdaqnordic': ['NasdaqNordic'],
+        'spotlight': ['SpotlightAPI'],
+        'italy': ['BIT'],
+        'ipohub': ['IPOHub']
+    }
+    # order in which data from sources covering the same exchanges is combined
+    # a source only adds IPOs that aren't already in a source from an earlier tier, see SourceReconciler
+    # AlphaVantage is compared with IPOScoop as well as the exchanges, the same as the merges it replaced
+    # the other exchange methods with more than one source join them instead (i.e. TokyoIPO adds prices to JPX rows)
+    source_precedence = {
+        'us': {'tiers': [['Nasdaq', 'NYSE'], ['IPOScoop'], ['AlphaVantage']], 'keys': ['symbol']}
+    }
+
+    def __init__(self, incremental: bool = False, conn=None, sources=None):
+        self.time_checked = datetime.utcnow()
+        self.time_checked_str = self.time_checked.strftime('%Y-%m-%d %H:%M')
+        self.conn = conn if conn is not None else pg_connection()
         self.source_folder = os.path.join(os.getcwd(), 'Data from Sources')
         self.final_cols = ['company_name', 'ticker', 'exchange', 'ipo_date', 'price', 'price_range', 'shares_offered',
                            'status', 'notes', 'time_added', 'time_removed']
@@ -22,13 +60,73 @@ class DataTransformation:
         if not os.path.exists(self.result_folder):
             os.mkdir(self.result_folder)
         self.result_file = os.path.join(self.result_folder, 'All IPOs.xlsx')
-        sources_file = os.path.join(os.getcwd(), 'sources.json')
-        if os.path.exists(sources_file):
-            with open(sources_file, 'r') as f:
-                self.sources = json.load(f)
+        if sources:
+            self.sources = sources
+        else:
+            sources_file = os.path.join(os.getcwd(), 'sources.json')
+            if os.path.exists(sources_file):
+                with open(sources_file, 'r') as f:
+                    self.sources = json.load(f)
+        self.watermark_table = 'transform_watermarks'
+        self.last_build = self.get_last_build() if incremental else None
+        # an incremental build needs a previous build to start from, otherwise everything is rebuilt
+        self.incremental = self.last_build is not None
+        self.stale_transforms = self.find_stale_transforms()
         self.src_dfs = self.all_source_files()
+        # the reads above begin a transaction (SQLAlchemy 2), ending it means to_sql commits each exchange table itself
+        self.conn.commit()
+
+    def get_last_build(self):
+        """
+        Returns the time the last complete build of all_ipos started or None if there hasn't been one.
+        """
+        try:
+            df = pd.read_sql_table(self.watermark_table, self.conn)
+        except ValueError:
+            # table does not exist yet
+            return None
+        df = df.loc[df['table_name'] == 'all_ipos']
+        if len(df) == 0 or pd.isna(df['last_build'].max()):
+            return None
+        return df['last_build'].max().to_pydatetime()
+
+    def changed_sources(self) -> set:
+        """
+        Returns the names of the sources where rows have been added or removed since the last build.
+        If the raw table can't be checked the source is treated as changed.
+        """
+        changed = set()
+        for src, v in self.sources.items():
+            query = text(f"SELECT EXISTS (SELECT 1 FROM {v['db_table_raw']} "
+                         f"WHERE time_added > :wm OR time_removed > :wm)")
+            try:
+                # each check has its own transaction, a failed check would otherwise abort the checks after it
+                with transaction(self.conn):
+                    source_changed = self.conn.execute(query, {'wm': self.last_build}).scalar()
+                if source_changed:
+                    changed.add(src)
+            except Exception as e:
+                logger.error(f"Unable to check {v['db_table_raw']} for changes - {e}")
+                changed.add(src)
+        return changed
+
+    def find_stale_transforms(self) -> set:
+        if not self.incremental:
+            return set(self.transform_sources.keys())
+        changed = self.changed_sources()
+        stale = {method for method, src_names in self.transform_sources.items() if changed.intersection(src_names)}
+        logger.info(f"Incremental build - {len(changed)} changed sources, recomputing {', '.join(sorted(stale))}")
+        return stale
+
+    def needs_update(self, method: str) -> bool:
+        return method in self.stale_transforms
 
     def all_source_files(self):
+        if self.incremental:
+            # exchange methods dedupe and merge across their full history, so every source of a stale method is read
+            src_names = {src for method in self.stale_transforms for src in self.transform_sources[method]}
+            return {src: pd.read_sql_table(v['db_table_raw'], self.conn) for src, v in self.sources.items()
+                    if src in src_names}
         return {src: pd.read_sql_table(v['db_table_raw'], self.conn) for src, v in self.sources.items()}
 
     def add_missing_cols(self, df_exch: pd.DataFrame) -> pd.DataFrame:
@@ -41,6 +139,20 @@ class DataTransformation:
         df_exch = df_exch[self.final_cols]
         self.df_all = pd.concat([self.df_all, df_exch], ignore_index=True, sort=False)
 
+    def reconcile(self, region: str, frames: dict) -> pd.DataFrame:
+        """
+        Combines the data from the sources for a region using the precedence in source_precedence.
+
+        :param region: key in source_precedence, the same as the exchange method name
+        :param frames: dict with the source name as key and the source's dataframe as the value
+        :return: combined dataframe
+        """
+        precedence = self.source_precedence[region]
+        sr = SourceReconciler(precedence['tiers'], precedence.get('keys'))
+        df = sr.combine(frames)
+        logger.info(f"{region}: {len(df)} rows kept from {sum(len(f) for f in frames.values())} source rows")
+        return df
+
     @staticmethod
     def format_date_cols(df: pd.DataFrame, date_cols: list, dayfirst=False):
         for c in date_cols:
@@ -48,6 +160,14 @@ class DataTransformation:
                 df[c] = pd.to_datetime(df[c], errors='coerce', dayfirst=dayfirst)
         return df
 
+    @staticmethod
+    def format_numeric_cols(df: pd.DataFrame, numeric_cols: list, dtype=float, errors: str = 'ignore'):
+        # columns with types declared in source_reference are already stored as numbers in the raw tables
+        for c in numeric_cols:
+            if c in df.columns and not pd.api.types.is_numeric_dtype(df[c]):
+                df[c] = df[c].str.replace(',', '').astype(dtype, errors=errors)
+        return df
+
     def us(self):
 
         def nyse():
@@ -57,8 +177,8 @@ class DataTransformation:
             df_up = self.format_date_cols(df_up, ['ipo_date', 'time_added'])
             # NYSE provides the expected pricing date, the expected listing date is one day after
             df_up['ipo_date'] = df_up['ipo_date'] + pd.offsets.DateOffset(days=1)
-            df_up['shares_offered'] = df_up['shares_offered'].str.replace(',', '').astype(int, errors='ignore')
-            df_up['deal_size'] = df_up['deal_size'].str.replace(',', '').astype(float, errors='ignore')
+            df_up = self.format_numeric_cols(df_up, ['shares_offered'], int)
+            df_up = self.format_numeric_cols(df_up, ['deal_size'], float)
             tbl = self.sources[source_name]['db_table']
             df_up.to_sql(tbl, self.conn, if_exists='replace', index=False,
                          dtype={
@@ -75,7 +195,7 @@ class DataTransformation:
             df_wd = self.format_date_cols(df_wd, ['postponement_date', 'time_added'])
             df_wd['notes'] = 'Withdrawn on ' + df_wd['postponement_date'].astype(str)
             df_wd['exchange'] = 'NYSE'
-            df_wd['shares_offered'] = df_wd['shares_offered'].str.replace(',', '').astype(int, errors='ignore')
+            df_wd = self.format_numeric_cols(df_wd, ['shares_offered'], int)
             tbl = self.sources[source_name]['db_table']
             df_wd.to_sql(tbl, self.conn, if_exists='replace', index=False,
                          dtype={
@@ -97,7 +217,7 @@ class DataTransformation:
             df_up.loc[df_up['price'].str.contains('-', na=False), 'price'] = np.nan
             df_up['price'] = df_up['price'].str.replace(' ', '')
             df_up['price'] = pd.to_numeric(df_up['price'], errors='coerce')
-            df_up['shares_offered'] = df_up['shares_offered'].str.replace(',', '').astype(int, errors='ignore')
+            df_up = self.format_numeric_cols(df_up, ['shares_offered'], int)
             tbl = self.sources[source_name]['db_table']
             df_up.to_sql(tbl, self.conn, if_exists='replace', index=False,
                          dtype={
@@ -112,7 +232,7 @@ class DataTransformation:
             assert source_name in self.src_dfs.keys(), f"No source data for {source_name}."
             df_p = self.src_dfs.get(source_name).copy()
             df_p = self.format_date_cols(df_p, ['ipo_date', 'time_added'])
-            df_p['shares_offered'] = df_p['shares_offered'].str.replace(',', '').astype(int, errors='ignore')
+            df_p = self.format_numeric_cols(df_p, ['shares_offered'], int)
             tbl = self.sources[source_name]['db_table']
             df_p.to_sql(tbl, self.conn, if_exists='replace', index=False,
                         dtype={
@@ -129,7 +249,7 @@ class DataTransformation:
             df_wd['notes'] = 'Withdrawn on ' + df_wd['cancellation_date'].astype(str)
             df_wd['status'] = 'Withdrawn'
             df_wd['exchange'] = 'Nasdaq'
-            df_wd['shares_offered'] = df_wd['shares_offered'].str.replace(',', '').astype(int, errors='ignore')
+            df_wd = self.format_numeric_cols(df_wd, ['shares_offered'], int)
             tbl = self.sources[source_name]['db_table']
             df_wd.to_sql(tbl, self.conn, if_exists='replace', index=False,
                          dtype={
@@ -158,7 +278,7 @@ class DataTransformation:
             df.loc[df['price_range_low'] == df['price_range_high'], 'price'] = df['price_range_high']
             df['price'] = pd.to_numeric(df['price'], errors='coerce')
             df['exchange'] = 'IPOScoop'
-            df['shares_offered'] = pd.to_numeric(df['shares_offered_mm'], errors='ignore')
+            df['shares_offered'] = pd.to_numeric(df['shares_offered_mm'], errors='coerce')
             df['shares_offered'] = df['shares_offered'] * 1000000
             tbl = self.sources[source_name]['db_table']
             df.to_sql(tbl, self.conn, if_exists='replace', index=False,
@@ -190,12 +310,7 @@ class DataTransformation:
             # Shares where price_range_low and price_range_high = 0 are either direct listings or splitting SPAC units
             # saving all assetTypes (including warrants, rights, ETFs) because symbology would like to have them
             # removing asset types from company name
-            asset_text = [' ETF Trust', ' ETF', ' Units', ' Unit', ' Warrants to purchase ', ' Warrants', ' Warrant', ' Rights'
-                          ' Class A Common Stock', ' Class A Ordinary Shares', ' Class A Ordinary Share',
-                          ' Subordinate Voting Shares', ' American Depository Shares', ' American Depositary Shares',
-                          ' Common Stock', ' Common Shares', ' Ordinary Shares']
-            for att in asset_text:
-                df['company_name'] = df['company_name'].str.replace(att, '', case=False, regex=False)
+            df['company_name'] = remove_asset_types(df['company_name'])
             tbl = self.sources[source_name]['db_table']
             df.to_sql(tbl, self.conn, if_exists='replace', index=False,
                       dtype={
@@ -210,27 +325,10 @@ class DataTransformation:
         df_nd = nasdaq()
         df_is = iposcoop()
         df_av = av()
-        df = pd.concat([df_nd, df_ny], ignore_index=True, sort=False)
-
-        # Add iposcoop and av only when there is not already a row from one of the exchanges
-        # company names are often different so joining on symbol after removing special characters
-        special_chars = r"(\.|'|\*)"
-        df['formatted symbol'] = df['ticker'].str.replace(special_chars, "", regex=True)
-
-        def add_only_new(data_frame: pd.DataFrame):
-            data_frame['formatted symbol'] = data_frame['ticker'].str.replace(special_chars, "", regex=True)
-            data_frame = pd.merge(data_frame, df, how='outer', on='formatted symbol', suffixes=('', '_drop'),
-                                  indicator=True)
-            data_frame = data_frame.loc[data_frame['_merge'] == 'left_only']
-            drop_cols = [c for c in data_frame.columns if '_drop' in c]
-            drop_cols.append('_merge')
-            data_frame.drop(columns=drop_cols, inplace=True)
-            return data_frame
-
-        df_is = add_only_new(df_is)
-        df = pd.concat([df, df_is], ignore_index=True, sort=False)
-        df_av = add_only_new(df_av)
-        df = pd.concat([df, df_av], ignore_index=True, sort=False)
+        # IPOScoop is only added when there is not already a row from one of the exchanges,
+        # av only when there isn't a row from the exchanges or IPOScoop
+        # company names are often different so the sources are compared on symbol after removing special characters
+        df = self.reconcile('us', {'Nasdaq': df_nd, 'NYSE': df_ny, 'IPOScoop': df_is, 'AlphaVantage': df_av})
 
         df.sort_values(by=['time_added'], ascending=False, inplace=True)
         df.drop_duplicates(subset=['company_name', 'ticker'], inplace=True)
@@ -245,9 +343,7 @@ class DataTransformation:
         df_jp = self.format_date_cols(df_jp, ['ipo_date', 'date_of_listing_approval', 'time_added'])
         df_jp['exchange'] = 'Japan Stock Exchange - ' + df_jp['market_segment']
         df_jp.loc[df_jp['company_name'].str.contains(r'\*\*', regex=True), 'notes'] = 'Technical Listing'
-        df_jp['company_name'] = df_jp['company_name'].str.replace(r',', ', ')
-        df_jp['company_name'] = df_jp['company_name'].str.replace(r'\*\*', '', regex=True)
-        df_jp['company_name'] = df_jp['company_name'].str.strip()
+        df_jp['company_name'] = format_jpx_names(df_jp['company_name'])
         tbl = self.sources[source_name]['db_table']
         df_jp.to_sql(tbl, self.conn, if_exists='replace', index=False,
                      dtype={
@@ -318,6 +414,7 @@ class DataTransformation:
             df = self.format_date_cols(df, ['ipo_date', 'release_date', 'time_added'])
             df['exchange'] = 'Shenzhen Stock Exchange'
             df['ticker'] = df['ticker'].astype(str)
+            df = self.format_numeric_cols(df, ['shares_offered'])
             df['shares_offered'] = pd.to_numeric(df['shares_offered'], errors='coerce')
             df['shares_offered'] = df['shares_offered'] * 10000
             tbl = self.sources[source_name]['db_table']
@@ -410,7 +507,7 @@ class DataTransformation:
         assert source_name in self.src_dfs.keys(), f"No source data for {source_name}."
         df = self.src_dfs.get(source_name).copy()
         df = self.format_date_cols(df, ['ipo_date', 'time_added'])
-        df['company_name'] = df['company_name'].str.replace(r'\s\(.*\)', '', regex=True)
+        df['company_name'] = remove_parentheticals(df['company_name'])
         df['exchange'] = 'London Stock Exchange ' + df['exchange'].fillna('')
         tbl = self.sources[source_name]['db_table']
         df.to_sql(tbl, self.conn, if_exists='replace', index=False,
@@ -426,6 +523,8 @@ class DataTransformation:
         assert source_name in self.src_dfs.keys(), f"No source data for {source_name}."
         df = self.src_dfs.get(source_name).copy()
         df.rename(columns={'list_symbol': 'ticker', 'effective_date': 'ipo_date', 'details': 'notes'}, inplace=True)
+        # the listings don't say which exchange, keeping it blank would collapse them with other sources' blank exchanges
+        df['exchange'] = self.sources[source_name]['exchange']
         # notes (renamed from details) can be really long, truncating to 200 characters
         df['notes'] = df['notes'].str[:200]
         latest = df.loc[(df['file'].str[:8] == df['file'].max()[:8]), 'identification'].to_list()
@@ -488,8 +587,7 @@ class DataTransformation:
         df = self.format_date_cols(df, ['ipo_date', 'time_added'])
         df['ticker'] = df['ticker'].astype(str)
         df['exchange'] = 'Korea Exchange'
-        for c in ['shares_outstanding', 'par_value', 'price']:
-            df[c] = df[c].str.replace(',', '').astype(int, errors='ignore')
+        df = self.format_numeric_cols(df, ['shares_outstanding', 'par_value', 'price'], int)
         tbl = self.sources[source_name]['db_table']
         df.to_sql(tbl, self.conn, if_exists='replace', index=False,
                   dtype={
@@ -543,8 +641,10 @@ class DataTransformation:
         assert source_name in self.src_dfs.keys(), f"No source data for {source_name}."
         df = self.src_dfs.get(source_name).copy()
         df = self.format_date_cols(df, ['ipo_date', 'time_added'])
+        df = self.format_numeric_cols(df, ['shares_offered', 'deal_size', 'volume'])
         for c in ['shares_offered', 'deal_size', 'volume']:
-            df[c] = df[c].str.replace(',', '').astype(float).astype(int)
+            # blank values stay null instead of failing the whole exchange, the columns are saved as floats
+            df[c] = pd.to_numeric(df[c], errors='coerce')
         df['price'] = df['volume'] / df['shares_offered']
         df['exchange'] = 'Bolsa de Madrid'
         df = df.loc[df['listing_type'] != 'Integration']
@@ -701,7 +801,7 @@ class DataTransformation:
 
     def formatting_all(self):
         # removing commas from company name - Concordance API will interpret those as new columns
-        self.df_all['company_name'] = self.df_all['company_name'].str.replace(',', '', regex=False)
+        self.df_all['company_name'] = remove_commas(self.df_all['company_name'])
         self.df_all = self.format_date_cols(self.df_all, ['ipo_date', 'time_added'])
         self.df_all.loc[self.df_all['ipo_date'].dt.date > date.today(), 'status'] = 'Upcoming ' + self.df_all[
             'status'].fillna('')
@@ -712,6 +812,8 @@ class DataTransformation:
         self.df_all.drop_duplicates(subset=['company_name', 'exchange'], inplace=True)
         self.df_all.sort_values(by=['ipo_date', 'time_added'], ascending=False, inplace=True)
         self.df_all.reset_index(drop=True, inplace=True)
+        # key used to match company names in entity mapping, comparison and RPDs
+        self.df_all['name_key'] = name_keys(self.df_all['company_name'])
 
     def save_all(self):
         df_all_file = self.df_all.copy()
@@ -726,53 +828,117 @@ class DataTransformation:
             'notes': 'Notes',
             'time_added': 'time_checked'
         }, inplace=True)
-        df_all_file.drop(columns=['time_removed'], inplace=True)
-        df_all_file.to_excel(self.result_file, sheet_name='All IPOs', index=False, freeze_panes=(1, 0))
-
-    def save_all_db(self):
-        self.df_all.to_sql('all_ipos', self.conn, if_exists='replace', index=False,
-                           dtype={
-                               'ipo_date': sql_types.Date,
-                               'time_added': sql_types.DateTime,
-                               'time_removed': sql_types.DateTime,
-                               'price': sql_types.Float
-                           })
+        df_all_file.drop(columns=['time_removed', 'name_key'], inplace=True, errors='ignore')
+        save_excel(df_all_file, self.result_file, sheet_name='All IPOs', freeze_panes=(1, 0))
+
+    def save_all_db(self, update_watermark: bool = True):
+        """
+        Saves the combined data to all_ipos, replacing the table in a full build or upserting the recomputed keys in
+        an incremental build.
+
+        :param update_watermark: if False the next incremental build will pick up the same changes again
+        :return: None
+        """
+        if self.incremental:
+            self.upsert_all_db()
+        else:
+            with transaction(self.conn):
+                self.df_all.to_sql('all_ipos', self.conn, if_exists='replace', index=False,
+                                   dtype={
+                                       'ipo_date': sql_types.Date,
+                                       'time_added': sql_types.DateTime,
+                                       'time_removed': sql_types.DateTime,
+                                       'price': sql_types.Float
+                                   })
+                # replacing the table drops its indexes
+                add_name_key_column(self.conn, 'all_ipos')
+                self.conn.execute(text("CREATE INDEX IF NOT EXISTS all_ipos_time_added_idx "
+                                       "ON all_ipos (time_added DESC)"))
+        archive_frame(self.df_all, 'all_ipos', self.time_checked)
+        if update_watermark:
+            self.save_watermark()
+
+    def upsert_all_db(self):
+        """
+        Replaces the rows in all_ipos for the company_name/exchange keys produced by the exchanges recomputed in this
+        build. Existing rows for those keys are combined with the new rows so that the most recently added row is
+        kept, the same as a full build. Date dependent statuses are then refreshed for the whole table.
+        """
+        key_cols = ['company_name', 'exchange']
+        df_keys = self.df_all[key_cols].drop_duplicates()
+        with transaction(self.conn):
+            df_keys.to_sql('all_ipos_changed_keys', self.conn, if_exists='replace', index=False)
+            df_existing = pd.read_sql_query("""
+            SELECT ai.*
+            FROM all_ipos ai
+            INNER JOIN all_ipos_changed_keys k
+                ON ai.company_name IS NOT DISTINCT FROM k.company_name
+                AND ai.exchange IS NOT DISTINCT FROM k.exchange
+            """, self.conn)
+            df = pd.concat([self.df_all, df_existing], ignore_index=True, sort=False)
+            df = self.format_date_cols(df, ['ipo_date', 'time_added', 'time_removed'])
+            # stable sort so that rows from this build win ties with the rows they replace
+            df.sort_values(by='time_added', ascending=False, kind='mergesort', inplace=True)
+            df.drop_duplicates(subset=key_cols, inplace=True)
+            self.conn.execute(text("""
+            DELETE FROM all_ipos ai
+            USING all_ipos_changed_keys k
+            WHERE ai.company_name IS NOT DISTINCT FROM k.company_name
+                AND ai.exchange IS NOT DISTINCT FROM k.exchange
+            """))
+            df['name_key'] = name_keys(df['company_name'])
+            df[self.final_cols + ['name_key']].to_sql('all_ipos', self.conn, if_exists='append', index=False,
+                                       dtype={
+                                           'ipo_date': sql_types.Date,
+                                           'time_added': sql_types.DateTime,
+                                           'time_removed': sql_types.DateTime,
+                                           'price': sql_types.Float
+                                       })
+            self.conn.execute(text("DROP TABLE all_ipos_changed_keys"))
+            # rows from exchanges that weren't recomputed still carry the status from the day they were built
+            self.conn.execute(text("""
+            UPDATE all_ipos SET status = 'Listing Today'
+            WHERE ipo_date = CURRENT_DATE AND status IS DISTINCT FROM 'Listing Today'
+            """))
+            self.conn.execute(text("""
+            UPDATE all_ipos SET status = NULLIF(REGEXP_REPLACE(status, '^(Upcoming|Listing Today)\\s*', ''), '')
+            WHERE ipo_date < CURRENT_DATE AND status ~ '^(Upcoming|Listing Today)'
+            """))
+        logger.info(f"Upserted {len(df)} rows for {len(df_keys)} keys in all_ipos")
+        # the Excel file should still have every IPO, not just the ones updated in this build
+        self.df_all = pd.read_sql_table('all_ipos', self.conn)
+        self.df_all.sort_values(by=['ipo_date', 'time_added'], ascending=False, inplace=True)
+        self.df_all.reset_index(drop=True, inplace=True)
+
+    def save_watermark(self):
+        df = pd.DataFrame({'table_name': ['all_ipos'], 'last_build': [self.time_checked]})
+        with transaction(self.conn):
+            df.to_sql(self.watermark_table, self.conn, if_exists='replace', index=False,
+                      dtype={'last_build': sql_types.DateTime})
 
     def close_conn(self):
         self.conn.close()
 
 
-def main():
+def main(incremental: bool = False):
     logger.info("Updating db tables and combining data")
-    dt = DataTransformation()
+    dt = DataTransformation(incremental=incremental)
+    complete = False
     try:
-        dt.us()
-        dt.jpx()
-        dt.cn()
-        dt.euronext()
-        dt.aastocks()
-        # dt.lse()
-        dt.tmx()
-        dt.frankfurt()
-        dt.krx()
-        dt.asx()
-        dt.twse()
-        dt.bme()
-        dt.sgx()
-        dt.idx()
-        dt.bm()
-        dt.nasdaqnordic()
-        dt.spotlight()
-        dt.italy()
-        dt.ipohub()
+        for method in dt.transform_sources.keys():
+            if dt.needs_update(method):
+                getattr(dt, method)()
+        complete = True
     except Exception as e:
         logger.error(e, exc_info=sys.exc_info())
         error_email(str(e))
     finally:
         dt.formatting_all()
-        dt.save_all_db()
+        dt.save_all_db(update_watermark=complete)
         dt.save_all()
         dt.close_conn()
+    if not complete:
+        raise RuntimeError("Data transformation did not complete, see the logs")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,696 @@
+import re
+import sys
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import text
+from logging_ipo_dates import logger, error_email
+from pg_connection import pg_connection, transaction, sql_types
+from name_normalization import asset_types, add_name_key_column
+
+# Alternative to data_transformation_db where the clean-up for each exchange is done with views over the raw tables.
+# all_ipos_mv is a materialized view combining the exchange views, refreshing it and copying it to all_ipos is done
+# entirely in Postgres so no data leaves the database.
+
+final_cols = ['company_name', 'ticker', 'exchange', 'ipo_date', 'price', 'price_range', 'shares_offered', 'status',
+              'notes', 'time_added', 'time_removed']
+
+
+def remove_rules_sql(expr: str, rules: list) -> str:
+    """
+    Nests a case insensitive REGEXP_REPLACE for each rule around an expression,
+    so the rules are removed one after the other the same as name_normalization.remove_asset_types.
+
+    :param expr: SQL expression for the text
+    :param rules: list of strings to remove
+    :return: SQL expression
+    """
+    for r in rules:
+        r = re.sub(r"([.^$*+?()\[\]{}|\\])", r"\\\1", r).replace("'", "''")
+        expr = f"REGEXP_REPLACE({expr}, '{r}', '', 'gi')"
+    return expr
+
+
+functions = {
+    'ipo_to_date': r"""
+    CREATE OR REPLACE FUNCTION ipo_to_date(val TEXT, fmt TEXT DEFAULT NULL) RETURNS DATE AS $$
+    BEGIN
+        IF val IS NULL OR BTRIM(val) = '' THEN
+            RETURN NULL;
+        ELSIF fmt IS NULL THEN
+            RETURN val::DATE;
+        ELSE
+            RETURN TO_DATE(val, fmt);
+        END IF;
+    EXCEPTION WHEN OTHERS THEN
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql STABLE""",
+    'ipo_to_numeric': r"""
+    CREATE OR REPLACE FUNCTION ipo_to_numeric(val TEXT) RETURNS DOUBLE PRECISION AS $$
+    BEGIN
+        RETURN NULLIF(REGEXP_REPLACE(val, '[,\s]', '', 'g'), '')::DOUBLE PRECISION;
+    EXCEPTION WHEN OTHERS THEN
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE""",
+    'ipo_symbol': r"""
+    CREATE OR REPLACE FUNCTION ipo_symbol(val TEXT) RETURNS TEXT AS $$
+        SELECT REGEXP_REPLACE(val, '[.''*]', '', 'g')
+    $$ LANGUAGE sql IMMUTABLE""",
+    # same as name_normalization.name_key
+    'ipo_name_key': r"""
+    CREATE OR REPLACE FUNCTION ipo_name_key(val TEXT) RETURNS TEXT AS $$
+        SELECT BTRIM(REGEXP_REPLACE(TRANSLATE(LOWER(val), '.,()\/', ''),
+                                    '(\slimited$|\sltd|\ssa$|\sa/s$|\sinc$)', '', 'g'))
+    $$ LANGUAGE sql IMMUTABLE"""
+}
+
+# every exchange view returns the columns in final_cols with the same types so they can be combined with UNION ALL
+# the order matters, views can only use views created before them
+exchange_views = {
+    'source_nyse_v': r"""
+    SELECT
+        company_name::TEXT
+        ,ticker::TEXT
+        ,exchange::TEXT
+        -- NYSE provides the expected pricing date, the expected listing date is one day after
+        ,ipo_to_date(ipo_date::TEXT) + 1 AS ipo_date
+        ,NULL::DOUBLE PRECISION AS price
+        ,price_range::TEXT
+        ,ipo_to_numeric(shares_offered::TEXT) AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_nyse_raw""",
+    'source_nyse_withdrawn_v': r"""
+    SELECT
+        company_name::TEXT
+        ,ticker::TEXT
+        ,'NYSE'::TEXT AS exchange
+        ,NULL::DATE AS ipo_date
+        ,NULL::DOUBLE PRECISION AS price
+        ,NULL::TEXT AS price_range
+        ,ipo_to_numeric(shares_offered::TEXT) AS shares_offered
+        ,status::TEXT
+        ,'Withdrawn on ' || ipo_to_date(postponement_date::TEXT)::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_nyse_withdrawn_raw""",
+    'source_nasdaq_v': r"""
+    SELECT
+        company_name::TEXT
+        ,ticker::TEXT
+        ,exchange::TEXT
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,CASE WHEN price::TEXT NOT LIKE '%-%' THEN ipo_to_numeric(price::TEXT) END AS price
+        ,CASE WHEN price::TEXT LIKE '%-%' THEN price::TEXT END AS price_range
+        ,ipo_to_numeric(shares_offered::TEXT) AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_nasdaq_raw""",
+    'source_nasdaq_priced_v': r"""
+    SELECT
+        company_name::TEXT
+        ,ticker::TEXT
+        ,exchange::TEXT
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,ipo_to_numeric(price::TEXT) AS price
+        ,NULL::TEXT AS price_range
+        ,ipo_to_numeric(shares_offered::TEXT) AS shares_offered
+        ,status::TEXT
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_nasdaq_priced_raw""",
+    'source_nasdaq_withdrawn_v': r"""
+    SELECT
+        company_name::TEXT
+        ,ticker::TEXT
+        ,'Nasdaq'::TEXT AS exchange
+        ,NULL::DATE AS ipo_date
+        ,NULL::DOUBLE PRECISION AS price
+        ,NULL::TEXT AS price_range
+        ,ipo_to_numeric(shares_offered::TEXT) AS shares_offered
+        ,'Withdrawn'::TEXT AS status
+        ,'Withdrawn on ' || ipo_to_date(cancellation_date::TEXT)::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_nasdaq_withdrawn_raw""",
+    'source_iposcoop_v': r"""
+    SELECT
+        company_name::TEXT
+        ,ticker::TEXT
+        ,'IPOScoop'::TEXT AS exchange
+        ,ipo_to_date(SUBSTRING(ipo_date::TEXT FROM '(\d{1,2}/\d{1,2}/\d{4})'), 'MM/DD/YYYY') AS ipo_date
+        ,CASE WHEN price_range_low::TEXT = price_range_high::TEXT THEN ipo_to_numeric(price_range_high::TEXT) END AS price
+        ,CASE WHEN price_range_low::TEXT != price_range_high::TEXT
+            THEN price_range_low::TEXT || ' - ' || price_range_high::TEXT END AS price_range
+        ,ipo_to_numeric(shares_offered_mm::TEXT) * 1000000 AS shares_offered
+        ,SUBSTRING(ipo_date::TEXT FROM '(Priced|Postponed)') AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_iposcoop_raw
+    -- dropping 'week of' dates because they're just not accurate enough
+    WHERE ipo_date::TEXT NOT LIKE '%Week of%'""",
+    'source_alphavantage_v': rf"""
+    SELECT
+        -- removing asset types from company name
+        {remove_rules_sql('company_name::TEXT', asset_types)} AS company_name
+        ,ticker::TEXT
+        -- exchange names sometimes have triple quotes around them
+        ,REPLACE(exchange::TEXT, '"', '') AS exchange
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,CASE WHEN price_range_low = price_range_high AND price_range_low != 0
+            THEN price_range_high::DOUBLE PRECISION END AS price
+        ,CASE WHEN price_range_low != price_range_high AND price_range_low != 0
+            THEN price_range_low::TEXT || ' - ' || price_range_high::TEXT END AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_alphavantage_raw""",
+    # Add iposcoop only when there is not already a row from one of the exchanges, av when there isn't one from either
+    # company names are often different so joining on symbol after removing special characters
+    'source_us_v': r"""
+    WITH exch AS (
+        SELECT * FROM source_nasdaq_v
+        UNION ALL SELECT * FROM source_nasdaq_priced_v
+        UNION ALL SELECT * FROM source_nasdaq_withdrawn_v
+        UNION ALL SELECT * FROM source_nyse_v
+        UNION ALL SELECT * FROM source_nyse_withdrawn_v
+    ), scoop AS (
+        SELECT s.* FROM source_iposcoop_v s
+        WHERE NOT EXISTS (SELECT 1 FROM exch e WHERE ipo_symbol(e.ticker) = ipo_symbol(s.ticker))
+    ), av AS (
+        SELECT a.* FROM source_alphavantage_v a
+        WHERE NOT EXISTS (
+            SELECT 1 FROM (SELECT ticker FROM exch UNION ALL SELECT ticker FROM scoop) e
+            WHERE ipo_symbol(e.ticker) = ipo_symbol(a.ticker))
+    ), combined AS (
+        SELECT * FROM exch
+        UNION ALL SELECT * FROM scoop
+        UNION ALL SELECT * FROM av
+    )
+    SELECT DISTINCT ON (company_name, ticker)
+        company_name
+        ,ticker
+        ,exchange
+        ,ipo_date
+        ,price
+        ,price_range
+        ,shares_offered
+        ,status
+        ,CASE WHEN ipo_date > CURRENT_DATE THEN 'Price expected ' || (ipo_date - 1)::TEXT ELSE notes END AS notes
+        ,time_added
+        ,time_removed
+    FROM combined
+    ORDER BY company_name, ticker, time_added DESC NULLS LAST""",
+    'source_jpx_v': r"""
+    WITH jp AS (
+        SELECT
+            BTRIM(REPLACE(REPLACE(company_name::TEXT, ',', ', '), '**', '')) AS company_name
+            ,ticker::TEXT
+            ,'Japan Stock Exchange - ' || market_segment::TEXT AS exchange
+            ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+            ,CASE WHEN company_name::TEXT LIKE '%**%' THEN 'Technical Listing' END AS notes
+            ,time_removed
+        FROM source_jpx_raw
+    ), tk AS (
+        SELECT DISTINCT ON (ticker::TEXT)
+            ticker::TEXT
+            ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+            ,ipo_to_numeric(price::TEXT) AS price
+            ,CASE WHEN price_range_expected_date IS NULL THEN price_range::TEXT END AS price_range
+            ,CASE
+                WHEN price_expected_date IS NOT NULL THEN 'Price expected ' || price_expected_date::TEXT
+                WHEN price_range_expected_date IS NOT NULL THEN 'Price Range expected ' || price_range_expected_date::TEXT
+            END AS notes
+            ,time_added
+        FROM source_tkipo_raw
+        ORDER BY ticker::TEXT, ipo_to_numeric(price::TEXT) NULLS LAST
+    )
+    SELECT DISTINCT
+        jp.company_name
+        ,jp.ticker
+        ,jp.exchange
+        ,jp.ipo_date
+        ,tk.price
+        ,tk.price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,COALESCE(tk.notes, '') || COALESCE(jp.notes, '') AS notes
+        ,tk.time_added
+        ,jp.time_removed
+    FROM jp
+    LEFT JOIN tk ON jp.ticker = tk.ticker AND jp.ipo_date IS NOT DISTINCT FROM tk.ipo_date""",
+    # Shanghai and Shenzhen (CNInfo) listings are combined with the dates from East Money
+    'source_cn_v': r"""
+    WITH sh AS (
+        SELECT
+            REGEXP_REPLACE(new_share_name::TEXT, '\d*', '', 'g') AS company_name
+            ,SUBSTRING(new_share_name::TEXT FROM '(\d*)$') AS ticker
+            ,'Shanghai Stock Exchange'::TEXT AS exchange
+            ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+            ,ipo_to_numeric(price::TEXT) AS price
+            ,NULL::DOUBLE PRECISION AS shares_offered
+            ,time_added
+            ,time_removed
+        FROM source_shanghai_raw
+    ), sz AS (
+        SELECT
+            company_name::TEXT
+            ,ticker::TEXT
+            ,'Shenzhen Stock Exchange'::TEXT AS exchange
+            ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+            ,ipo_to_numeric(price::TEXT) AS price
+            ,ipo_to_numeric(shares_offered::TEXT) * 10000 AS shares_offered
+            ,time_added
+            ,time_removed
+        FROM source_cninfo_raw
+    ), exch AS (
+        SELECT * FROM sh
+        UNION ALL SELECT * FROM sz
+    ), em_dates AS (
+        -- date is provided as mm-dd, adding current year to make the date formatted as mm-dd-yyyy
+        SELECT
+            ticker::TEXT
+            ,ipo_to_date(ipo_date::TEXT || '-' || DATE_PART('year', CURRENT_DATE)::TEXT, 'MM-DD-YYYY') AS ipo_date
+            ,time_added
+        FROM source_east_money_raw
+        WHERE ipo_date::TEXT != '-'
+    ), em AS (
+        -- at the beginning of the year, the calendar will still show IPOs from last year
+        -- if the IPO date is more than 6 months away, I subtract 1 year from the IPO date
+        SELECT DISTINCT ON (ticker)
+            ticker
+            ,CASE WHEN ipo_date > CURRENT_DATE + INTERVAL '6 months'
+                THEN (ipo_date - INTERVAL '1 year')::DATE ELSE ipo_date END AS ipo_date
+        FROM em_dates
+        ORDER BY ticker, time_added DESC NULLS LAST
+    )
+    SELECT DISTINCT ON (exch.company_name, exch.ticker)
+        exch.company_name
+        ,exch.ticker
+        ,exch.exchange
+        ,COALESCE(exch.ipo_date, em.ipo_date) AS ipo_date
+        ,exch.price
+        ,NULL::TEXT AS price_range
+        ,exch.shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,exch.time_added
+        ,exch.time_removed
+    FROM exch
+    LEFT JOIN em ON exch.ticker = em.ticker AND em.ipo_date IS NOT NULL
+    ORDER BY exch.company_name, exch.ticker, exch.time_added DESC NULLS LAST""",
+    'source_euronext_v': r"""
+    SELECT
+        company_name::TEXT
+        ,ticker::TEXT
+        ,exchange::TEXT || ' ' || location::TEXT AS exchange
+        ,ipo_to_date(ipo_date::TEXT, 'DD/MM/YYYY') AS ipo_date
+        ,NULL::DOUBLE PRECISION AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_euronext_raw""",
+    'source_aastocks_v': r"""
+    SELECT
+        company_name::TEXT
+        ,SUBSTRING(ticker::TEXT FROM '(\d*)\.HK') AS ticker
+        ,'Hong Kong Stock Exchange'::TEXT AS exchange
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,CASE WHEN price::TEXT NOT LIKE '%-%' THEN ipo_to_numeric(price::TEXT) END AS price
+        ,CASE WHEN price::TEXT LIKE '%-%' THEN price::TEXT END AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_aastocks_raw""",
+    'source_tmx_v': r"""
+    WITH latest AS (
+        SELECT DISTINCT identification
+        FROM source_tmx_raw
+        WHERE LEFT(file, 8) = (SELECT LEFT(MAX(file), 8) FROM source_tmx_raw)
+    ), tmx AS (
+        SELECT DISTINCT ON (company_name, list_symbol, effective_date, details, identification, change_type,
+                            security_description)
+            company_name::TEXT
+            ,list_symbol::TEXT AS ticker
+            ,ipo_to_date(effective_date::TEXT) AS ipo_date
+            -- notes (renamed from details) can be really long, truncating to 200 characters
+            ,LEFT(details::TEXT, 200) AS notes
+            ,change_type
+            ,security_description
+            ,time_added
+            ,CASE WHEN time_removed IS NULL AND identification NOT IN (SELECT identification FROM latest)
+                THEN LOCALTIMESTAMP ELSE time_removed END AS time_removed
+        FROM source_tmx_raw
+        ORDER BY company_name, list_symbol, effective_date, details, identification, change_type,
+                 security_description, entry_date, file, time_added
+    )
+    SELECT
+        company_name
+        ,ticker
+        ,'TSX and TSX Venture'::TEXT AS exchange
+        ,ipo_date
+        ,NULL::DOUBLE PRECISION AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,notes
+        ,time_added
+        ,time_removed
+    FROM tmx
+    WHERE
+        change_type = 'New Listing'
+        AND COALESCE(notes, '') NOT ILIKE '%transfer%'
+        AND COALESCE(company_name, '') !~ ' ETF| Fund'
+        AND COALESCE(security_description, '') !~ 'Debentures|Warrants|Rights|Common share purchase warrants'""",
+    'source_frankfurt_v': r"""
+    WITH shifted AS (
+        SELECT
+            *
+            ,CASE WHEN sub_price_and_deal_size LIKE 'First Price%' THEN NULL ELSE sub_price_and_deal_size END AS sub_price
+            ,SUBSTRING(market_segment FROM '\(([a-zA-Z\s/]*)\)') AS offer_type
+        FROM source_frankfurt_raw
+    )
+    SELECT
+        SUBSTRING(summary FROM '\)([a-zA-Z\s\d&.,-]*)Sector') AS company_name
+        ,NULL::TEXT AS ticker
+        ,'Frankfurt Stock Exchange - ' || SUBSTRING(market_segment FROM '^([a-zA-Z\s]*)\s\(') AS exchange
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,ipo_to_numeric(SUBSTRING(sub_price FROM 'Volume: €\s(\d{1,3}\.\d{1,3})')) AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,'Offer Type: ' || COALESCE(offer_type, '') AS notes
+        ,time_added
+        ,time_removed
+    FROM shifted
+    WHERE offer_type IS DISTINCT FROM 'Transfer'""",
+    'source_krx_v': r"""
+    SELECT
+        company_name::TEXT
+        ,ticker::TEXT
+        ,'Korea Exchange'::TEXT AS exchange
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,ipo_to_numeric(price::TEXT) AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_krx_raw""",
+    'source_asx_v': r"""
+    SELECT DISTINCT ON (listing_info, company_name, ipo_date, exchange)
+        company_name::TEXT
+        ,NULL::TEXT AS ticker
+        ,exchange::TEXT
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,NULL::DOUBLE PRECISION AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_asx_raw
+    ORDER BY listing_info, company_name, ipo_date, exchange, time_added""",
+    'source_twse_v': r"""
+    SELECT
+        company_name::TEXT
+        ,ticker::TEXT
+        ,'Taiwan Stock Exchange'::TEXT AS exchange
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,ipo_to_numeric(price::TEXT) AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_twse_raw""",
+    'source_bme_v': r"""
+    SELECT
+        company_name::TEXT
+        ,isin::TEXT AS ticker
+        ,'Bolsa de Madrid'::TEXT AS exchange
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,ipo_to_numeric(volume::TEXT) / NULLIF(ipo_to_numeric(shares_offered::TEXT), 0) AS price
+        ,NULL::TEXT AS price_range
+        ,ipo_to_numeric(shares_offered::TEXT) AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_bme_raw
+    WHERE listing_type IS DISTINCT FROM 'Integration'""",
+    'source_sgx_v': r"""
+    SELECT
+        company_name::TEXT
+        ,NULL::TEXT AS ticker
+        ,'Singapore Exchange - ' || COALESCE(market_segment::TEXT, '') AS exchange
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,ipo_to_numeric(SUBSTRING(price::TEXT FROM '\s([\d.]*)$')) AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_sgx_raw
+    WHERE COALESCE(company_name::TEXT, '') NOT LIKE '% ETF%'""",
+    'source_idx_v': r"""
+    SELECT
+        company_name::TEXT
+        ,ticker::TEXT
+        ,'Indonesia Stock Exchange - ' || COALESCE(market_segment::TEXT, '') AS exchange
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,NULL::DOUBLE PRECISION AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_idx_raw""",
+    'source_bm_v': r"""
+    SELECT
+        company_name::TEXT
+        ,NULL::TEXT AS ticker
+        ,'Bursa Malaysia - ' || COALESCE(market_segment::TEXT, '') AS exchange
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,ipo_to_numeric(SUBSTRING(price::TEXT FROM '(\d*\.\d*)')) AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_bm_raw""",
+    # Nasdaq Nordic comes with columns for last price and percent change in price which change every day
+    'source_nasdaqnordic_v': r"""
+    SELECT DISTINCT
+        company_name::TEXT
+        ,NULL::TEXT AS ticker
+        ,'Nasdaq Nordic'::TEXT AS exchange
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,NULL::DOUBLE PRECISION AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_nasdaqnordic_raw""",
+    'source_spotlight_v': r"""
+    SELECT
+        company_name::TEXT
+        ,NULL::TEXT AS ticker
+        ,'Spotlight'::TEXT AS exchange
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,NULL::DOUBLE PRECISION AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_spotlight_raw""",
+    'source_bit_v': r"""
+    SELECT
+        company_name::TEXT
+        ,NULL::TEXT AS ticker
+        ,'Borsa Italiana - ' || REPLACE(market_segment::TEXT, '*', 'Professional Segment') AS exchange
+        ,ipo_to_date(ipo_date::TEXT, 'DD/MM/YYYY') AS ipo_date
+        ,NULL::DOUBLE PRECISION AS price
+        ,NULL::TEXT AS price_range
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,NULL::TEXT AS status
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_bit_raw
+    WHERE COALESCE(listing_type::TEXT, '') NOT LIKE '%Transition from%'""",
+    'source_ipohub_v': r"""
+    SELECT
+        company_name::TEXT
+        ,NULL::TEXT AS ticker
+        ,exchange::TEXT
+        ,ipo_to_date(ipo_date::TEXT) AS ipo_date
+        ,price::DOUBLE PRECISION
+        ,price_range::TEXT
+        ,NULL::DOUBLE PRECISION AS shares_offered
+        ,status::TEXT
+        ,NULL::TEXT AS notes
+        ,time_added
+        ,time_removed
+    FROM source_ipohub_raw"""
+}
+
+# exchange views combined in all_ipos_mv, the views for individual US sources are only used by source_us_v
+all_ipos_views = ['source_us_v', 'source_jpx_v', 'source_cn_v', 'source_euronext_v', 'source_aastocks_v',
+                  'source_tmx_v', 'source_frankfurt_v', 'source_krx_v', 'source_asx_v', 'source_twse_v',
+                  'source_bme_v', 'source_sgx_v', 'source_idx_v', 'source_bm_v', 'source_nasdaqnordic_v',
+                  'source_spotlight_v', 'source_bit_v', 'source_ipohub_v']
+
+
+class SQLTransformation:
+    def __init__(self, conn=None):
+        self.conn = conn if conn is not None else pg_connection()
+        self.time_checked = datetime.utcnow()
+
+    def relation_exists(self, view: str) -> bool:
+        return self.conn.execute(text("SELECT to_regclass(:v) IS NOT NULL"), {'v': view}).scalar()
+
+    def create_functions(self):
+        with transaction(self.conn):
+            for func, ddl in functions.items():
+                self.conn.execute(text(ddl))
+
+    def create_views(self) -> list:
+        """
+        Drops and recreates the exchange views and all_ipos_mv.
+        If a view can't be created (i.e. the raw table doesn't exist yet) it is left out of all_ipos_mv.
+
+        :return: list of exchange views that were created
+        """
+        created = []
+        with transaction(self.conn):
+            self.conn.execute(text("DROP MATERIALIZED VIEW IF EXISTS all_ipos_mv"))
+            for view in reversed(list(exchange_views.keys())):
+                self.conn.execute(text(f"DROP VIEW IF EXISTS {view} CASCADE"))
+            for view, query in exchange_views.items():
+                try:
+                    # a savepoint for each view, an error would otherwise abort the rest of the transaction
+                    with self.conn.begin_nested():
+                        self.conn.execute(text(f"CREATE VIEW {view} AS {query}"))
+                    created.append(view)
+                except Exception as e:
+                    logger.error(f"Unable to create view {view} - {e}")
+            self.create_all_ipos_view([v for v in all_ipos_views if v in created])
+        return created
+
+    def create_all_ipos_view(self, views: list):
+        union = '\n        UNION ALL '.join([f"SELECT * FROM {v}" for v in views])
+        self.conn.execute(text(f"""
+        CREATE MATERIALIZED VIEW all_ipos_mv AS
+        WITH combined AS (
+            {union}
+        ), formatted AS (
+            SELECT
+                -- removing commas from company name - Concordance API will interpret those as new columns
+                REPLACE(company_name, ',', '') AS company_name
+                ,ticker
+                ,exchange
+                ,ipo_date
+                ,price
+                ,price_range
+                ,shares_offered
+                ,CASE
+                    WHEN ipo_date > CURRENT_DATE THEN BTRIM('Upcoming ' || COALESCE(status, ''))
+                    WHEN ipo_date = CURRENT_DATE THEN 'Listing Today'
+                    ELSE BTRIM(status)
+                END AS status
+                ,notes
+                ,time_added
+                ,time_removed
+            FROM combined
+        )
+        SELECT DISTINCT ON (company_name, exchange) *, ipo_name_key(company_name) AS name_key
+        FROM formatted
+        ORDER BY company_name, exchange, time_added DESC NULLS LAST
+        """))
+        # a unique index is required to refresh the materialized view concurrently
+        self.conn.execute(text("CREATE UNIQUE INDEX all_ipos_mv_key ON all_ipos_mv (company_name, exchange)"))
+
+    def refresh(self):
+        """
+        Refreshes all_ipos_mv without blocking reads of the materialized view.
+        """
+        with transaction(self.conn):
+            self.conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY all_ipos_mv"))
+
+    def publish(self):
+        """
+        Copies all_ipos_mv into the all_ipos table inside the database.
+        all_ipos stays a table so that the pandas transformation and incremental builds can still write to it.
+        """
+        cols = ', '.join(final_cols + ['name_key'])
+        # the SQL build is a full build, an incremental build can continue from here
+        df = pd.DataFrame({'table_name': ['all_ipos'], 'last_build': [self.time_checked]})
+        with transaction(self.conn):
+            if self.relation_exists('all_ipos'):
+                self.conn.execute(text("DELETE FROM all_ipos"))
+                self.conn.execute(text(f"INSERT INTO all_ipos ({cols}) SELECT {cols} FROM all_ipos_mv"))
+            else:
+                self.conn.execute(text(f"CREATE TABLE all_ipos AS SELECT {cols} FROM all_ipos_mv"))
+                add_name_key_column(self.conn, 'all_ipos')
+                self.conn.execute(text("CREATE INDEX IF NOT EXISTS all_ipos_time_added_idx "
+                                       "ON all_ipos (time_added DESC)"))
+            df.to_sql('transform_watermarks', self.conn, if_exists='replace', index=False,
+                      dtype={'last_build': sql_types.DateTime})
+        count = self.conn.execute(text("SELECT COUNT(*) FROM all_ipos")).scalar()
+        logger.info(f"{count} rows in all_ipos from all_ipos_mv")
+
+    def close_conn(self):
+        self.conn.close()
+
+
+def main(setup: bool = False):
+    """
+    Refreshes all_ipos using the SQL views instead of data_transformation_db.
+
+    :param setup: if True the functions and views are (re)created, needed after the view definitions change
+    :return: None
+    """
+    logger.info("Refreshing SQL views and combining data")
+    st = SQLTransformation()
+    try:
+        if setup or not st.relation_exists('all_ipos_mv'):
+            st.create_functions()
+            st.create_views()
+        else:
+            st.refresh()
+        st.publish()
+    except Exception as e:
+        logger.error(e, exc_info=sys.exc_info())
+        error_email(str(e))
+        raise
+    finally:
+        st.close_conn()
+
+
+if __name__ == '__main__':
+    main(setup=True)
@@ -2,13 +2,7 @@ import os
 import sys
 from datetime import date
 import configparser
-import win32com.client as win32
 from logging_ipo_dates import logger, error_email
-import pandas as pd
-
-config = configparser.ConfigParser()
-config.read('email_settings.ini')
-today_date = date.today().strftime('%Y-%m-%d')
 
 
 def email_report(attach_file=None, addtl_message: str = ''):
@@ -19,11 +13,14 @@ def email_report(attach_file=None, addtl_message: str = ''):
     :param addtl_message: optional string that can be added to body of email
     :return: None
     """
+    import win32com.client as win32
+    config = configparser.ConfigParser()
+    config.read('email_settings.ini')
     outlook = win32.Dispatch('outlook.application')
     mail = outlook.CreateItem(0)
     mail.To = config.get('Email', 'To')
     mail.Sender = config.get('Email', 'Sender')
-    mail.Subject = f"{config.get('Email', 'Subject')} {today_date}"
+    mail.Subject = f"{config.get('Email', 'Subject')} {date.today().strftime('%Y-%m-%d')}"
     mail.HTMLBody = config.get('Email', 'Body') + addtl_message + config.get('Email', 'Signature')
     if isinstance(attach_file, str) and os.path.exists(attach_file):
         mail.Attachments.Add(attach_file)
@@ -42,7 +39,12 @@ def main(file_attachment: str, addtl_message: str = ''):
         error_email(str(e))
 
 
-if __name__ == '__main__':
+def send_report():
+    import pandas as pd
     file = os.path.join(os.getcwd(), 'Results', 'IPO Monitoring.xlsx')
     df_summary = pd.read_excel(file, sheet_name='Summary')
     main(file_attachment=file, addtl_message=df_summary.to_html(na_rep="", index=False, justify="left"))
+
+
+if __name__ == '__main__':
+    send_report()
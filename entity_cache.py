@@ -0,0 +1,94 @@
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import text, types as sql_types
+from name_normalization import name_keys
+from pg_connection import transaction
+
+# Keeps the result of every name sent to the Concordance API, keyed by name key, ticker and exchange.
+# A name is only sent again once its next_check has passed. Mapped names are rechecked after positive_ttl_days.
+# Unmapped names (including matches with low confidence) are rechecked after negative_ttl_days, doubling each time
+# the name is still unmapped up to max_negative_ttl_days, so names Concordance keeps rejecting are sent less often.
+
+cache_table = 'entity_resolution_cache'
+positive_ttl_days = 180
+negative_ttl_days = 1
+max_negative_ttl_days = 60
+key_cols = ['name_key', 'ticker', 'exchange']
+
+
+def cache_keys(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the cache key columns for a data frame with company_name, ticker and exchange columns.
+    Missing tickers and exchanges are stored as empty strings so they can be part of the primary key.
+    """
+    return pd.DataFrame({
+        'name_key': name_keys(df['company_name']).fillna(''),
+        'ticker': df['ticker'].fillna('').astype(str),
+        'exchange': df['exchange'].fillna('').astype(str)
+    }, index=df.index)
+
+
+def create_cache_table(conn):
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS {cache_table} (
+        name_key TEXT NOT NULL,
+        ticker TEXT NOT NULL,
+        exchange TEXT NOT NULL,
+        company_name TEXT,
+        mapstatus TEXT,
+        entity_id TEXT,
+        iconum BIGINT,
+        entityname TEXT,
+        confidencescore FLOAT,
+        similarityscore FLOAT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_checked TIMESTAMP,
+        next_check TIMESTAMP,
+        PRIMARY KEY (name_key, ticker, exchange)
+    )"""))
+
+
+def update_cache(conn, df: pd.DataFrame, now: datetime = None):
+    """
+    Adds the decisions from the Concordance API to the cache or updates the decisions already in the cache.
+
+    :param conn: database connection
+    :param df: decisions with company_name, ticker, exchange, mapstatus, entity_id, iconum, entityname,
+        confidencescore and similarityscore columns
+    :param now: optional time of the check, defaults to now (UTC)
+    :return: None
+    """
+    if len(df) == 0:
+        return
+    now = now or datetime.utcnow()
+    value_cols = ['company_name', 'mapstatus', 'entity_id', 'iconum', 'entityname', 'confidencescore',
+                  'similarityscore']
+    df_c = pd.concat((cache_keys(df), df.reindex(columns=value_cols)), axis=1)
+    df_c['mapstatus'] = df_c['mapstatus'].fillna('UNMAPPED').str.upper()
+    df_c.drop_duplicates(subset=key_cols, inplace=True)
+    with transaction(conn):
+        create_cache_table(conn)
+        df_c.to_sql(f"{cache_table}_new", conn, if_exists='replace', index=False,
+                    dtype={'iconum': sql_types.BIGINT})
+        conn.execute(text(f"""
+        INSERT INTO {cache_table} AS c ({', '.join(key_cols + value_cols)}, attempts, last_checked, next_check)
+        SELECT {', '.join(key_cols + value_cols)}, 1, :now,
+            CASE WHEN mapstatus = 'MAPPED' THEN :now + :positive_days * INTERVAL '1 day'
+            ELSE :now + :negative_days * INTERVAL '1 day' END
+        FROM {cache_table}_new
+        ON CONFLICT (name_key, ticker, exchange) DO UPDATE SET
+            company_name = EXCLUDED.company_name,
+            mapstatus = EXCLUDED.mapstatus,
+            entity_id = EXCLUDED.entity_id,
+            iconum = EXCLUDED.iconum,
+            entityname = EXCLUDED.entityname,
+            confidencescore = EXCLUDED.confidencescore,
+            similarityscore = EXCLUDED.similarityscore,
+            attempts = CASE WHEN EXCLUDED.mapstatus = 'MAPPED' THEN 1 ELSE c.attempts + 1 END,
+            last_checked = EXCLUDED.last_checked,
+            next_check = CASE WHEN EXCLUDED.mapstatus = 'MAPPED' THEN EXCLUDED.next_check
+                ELSE EXCLUDED.last_checked
+                    + LEAST(:negative_days * POWER(2, c.attempts), :max_negative_days) * INTERVAL '1 day' END
+        """), {'now': now, 'positive_days': positive_ttl_days, 'negative_days': negative_ttl_days,
+               'max_negative_days': max_negative_ttl_days})
+        conn.execute(text(f"DROP TABLE {cache_table}_new"))
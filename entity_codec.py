@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+# Converts between iconums and FactSet entity IDs for whole columns at once.
+# An entity ID is the iconum written as 6 base 31 digits (using the characters below) followed by '-E',
+# i.e. iconum 0 is 000000-E. The digits are calculated with NumPy arrays instead of a loop for each value.
+
+chars = "0123456789BCDFGHJKLMNPQRSTVWXYZ"
+base = len(chars)
+num_digits = 6
+suffix = '-E'
+max_iconum = base ** num_digits - 1
+powers = base ** np.arange(num_digits - 1, -1, -1, dtype=np.int64)
+char_codes = np.frombuffer(chars.encode('ascii'), dtype=np.uint8)
+# value of each ASCII character as a base 31 digit, -1 for characters that aren't used in entity IDs
+digit_values = np.full(256, -1, dtype=np.int64)
+digit_values[char_codes] = np.arange(base)
+
+
+def encode_iconums(iconums: np.ndarray) -> np.ndarray:
+    """
+    Converts an array of iconums (integers from 0 to max_iconum) to an array of entity IDs.
+    """
+    iconums = np.asarray(iconums, dtype=np.int64)
+    digits = (iconums[:, None] // powers) % base
+    codes = np.empty((len(iconums), num_digits + len(suffix)), dtype=np.uint8)
+    codes[:, :num_digits] = char_codes[digits]
+    codes[:, num_digits:] = np.frombuffer(suffix.encode('ascii'), dtype=np.uint8)
+    # each row of ASCII codes is read as one string
+    return codes.view(f'S{codes.shape[1]}').ravel().astype(f'U{codes.shape[1]}')
+
+
+def decode_entity_ids(entity_ids: np.ndarray) -> np.ndarray:
+    """
+    Converts an array of entity IDs to an array of iconums, -1 for entity IDs that aren't valid.
+    Only the first 6 characters are used, the same as entity_id_to_iconum in entity_mapping.
+    """
+    ids = np.asarray(entity_ids, dtype=f'U{num_digits}')
+    codes = ids.view(np.uint32).reshape(len(ids), num_digits)
+    values = digit_values[np.minimum(codes, 255)]
+    values[codes > 255] = -1
+    iconums = values @ powers
+    iconums[(values < 0).any(axis=1)] = -1
+    return iconums
+
+
+def iconums_to_entity_ids(iconums) -> pd.Series:
+    """
+    Converts a column of iconums to entity IDs. Missing or out of range iconums are returned as null.
+
+    :param iconums: series or list of iconums
+    :return: series of entity IDs with the same index as the series given
+    """
+    s = pd.Series(iconums)
+    values = pd.to_numeric(s, errors='coerce')
+    valid = values.notna() & (values >= 0) & (values <= max_iconum) & (values % 1 == 0)
+    result = pd.Series(None, index=s.index, dtype=object)
+    if valid.any():
+        result[valid] = encode_iconums(values[valid].to_numpy(dtype=np.int64))
+    return result
+
+
+def entity_ids_to_iconums(entity_ids) -> pd.Series:
+    """
+    Converts a column of entity IDs to iconums. Missing or invalid entity IDs are returned as NA.
+
+    :param entity_ids: series or list of entity IDs
+    :return: series of iconums (Int64) with the same index as the series given
+    """
+    s = pd.Series(entity_ids, dtype=object)
+    valid = s.notna()
+    result = pd.Series(pd.NA, index=s.index, dtype='Int64')
+    if valid.any():
+        # IDs shorter than 6 characters are padded with 0, which isn't a valid digit
+        iconums = pd.Series(decode_entity_ids(s[valid].to_numpy(dtype=f'U{num_digits}')), index=s[valid].index)
+        result[valid] = iconums.where(iconums >= 0).astype('Int64')
+    return result
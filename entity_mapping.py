@@ -3,18 +3,226 @@ import sys
 import pandas as pd
 import numpy as np
 import json
-from datetime import datetime
-from time import sleep
+import gzip
+import random
+import threading
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from time import sleep, monotonic
 import requests
+from sqlalchemy import text
 from configparser import ConfigParser
-from pg_connection import pg_connection
-from logging_ipo_dates import logger, error_email, log_folder
+from pg_connection import pg_connection, transaction
+from logging_ipo_dates import logger, error_email
+from name_normalization import name_keys
+from entity_cache import cache_table, update_cache
+from entity_codec import entity_ids_to_iconums
+from name_matching import NameMatcher, load_known_names, match_threshold
 
 pd.options.mode.chained_assignment = None
 
+# main only polls the Concordance tasks for a short time so the stages after entity mapping don't wait for them.
+# Tasks that haven't finished are kept in the pending tasks table and their decisions are picked up on the next run.
+pending_table = 'concordance_pending_tasks'
+# how long main polls the tasks before leaving them for the next run
+first_wait_seconds = 30
+# how long entity_mapping_api polls before leaving the tasks for the next run
+max_poll_seconds = 900
+# pending tasks older than this are given up on
+pending_task_days = 3
+# number of decisions requested in each page from the entity-decisions endpoint
+decisions_page_size = 1000
+decision_types = {'similarityScore': float, 'confidenceScore': float, 'rowIndex': 'Int64'}
+# large requests (i.e. when rechecking every unmapped name) are split into tasks of at most max_task_size names,
+# which are submitted and polled at the same time
+max_task_size = 5000
+max_concurrent_tasks = 4
+# minimum time between submitting tasks, and the wait when the API responds with too many requests
+submit_interval_seconds = 2
+rate_limit_wait_seconds = 30
+submit_attempts = 3
+# the request file, the response to the submission and the decisions for each task are kept (gzip compressed)
+# in the tasks table for task_retention_days instead of as files
+tasks_table = 'concordance_tasks'
+task_retention_days = 30
+# the Concordance API, can be pointed at testing/concordance_stub.py for tests and benchmarks
+api_url = 'https://api.factset.com/content/factset-concordance/v2'
+# entity_mapping has one row for each name key, the decision with the highest confidence score is kept
+mapping_cols = ['company_name', 'ticker', 'exchange', 'entityname', 'iconum', 'entity_id', 'mapstatus',
+                'similarityscore', 'confidencescore', 'countryname', 'entitytypedescription', 'name_key']
+
+
+def create_pending_table(conn):
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS {pending_table} (
+        task_id TEXT PRIMARY KEY,
+        task_name TEXT,
+        status TEXT,
+        submitted TIMESTAMP,
+        last_checked TIMESTAMP
+    )"""))
+    # number of decisions already saved, so a task that was partly downloaded continues from there
+    conn.execute(text(f"ALTER TABLE {pending_table} ADD COLUMN IF NOT EXISTS decisions_offset INTEGER DEFAULT 0"))
+    # size of the task and the processDuration and decisionRate reported by the API once it finishes
+    conn.execute(text(f"ALTER TABLE {pending_table} ADD COLUMN IF NOT EXISTS num_names INTEGER, "
+                      f"ADD COLUMN IF NOT EXISTS process_duration FLOAT, ADD COLUMN IF NOT EXISTS decision_rate FLOAT"))
+
+
+def split_tasks(df: pd.DataFrame, max_size: int = max_task_size) -> list:
+    """
+    Splits the names to be checked into tasks of about the same size with at most max_size names each.
+
+    :param df: names to be checked
+    :param max_size: maximum number of names in a task
+    :return: list of data frames, one for each task
+    """
+    num_tasks = max(-(-len(df) // max_size), 1)
+    return [df.iloc[i::num_tasks] for i in range(num_tasks)] if num_tasks > 1 else [df]
+
+
+def number_or_none(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def update_task_stats(task_id: str, task: dict):
+    conn = pg_connection()
+    try:
+        with transaction(conn):
+            conn.execute(text(f"UPDATE {pending_table} SET process_duration = :duration, decision_rate = :rate "
+                              f"WHERE task_id = :task_id"),
+                         {'task_id': str(task_id), 'duration': number_or_none(task.get('processDuration')),
+                          'rate': number_or_none(task.get('decisionRate'))})
+    finally:
+        conn.close()
+
+
+def pending_task_offset(task_id: str) -> int:
+    conn = pg_connection()
+    try:
+        with transaction(conn):
+            create_pending_table(conn)
+            offset = conn.execute(text(f"SELECT decisions_offset FROM {pending_table} WHERE task_id = :task_id"),
+                                  {'task_id': str(task_id)}).scalar()
+    finally:
+        conn.close()
+    return int(offset or 0)
+
+
+def update_task_offset(task_id: str, offset: int):
+    conn = pg_connection()
+    try:
+        with transaction(conn):
+            conn.execute(text(f"UPDATE {pending_table} SET decisions_offset = :offset, last_checked = :now "
+                              f"WHERE task_id = :task_id"),
+                         {'task_id': str(task_id), 'offset': offset, 'now': datetime.utcnow()})
+    finally:
+        conn.close()
+
+
+def create_tasks_table(conn):
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS {tasks_table} (
+        task_id TEXT PRIMARY KEY,
+        task_name TEXT,
+        submitted TIMESTAMP,
+        num_names INTEGER,
+        request BYTEA,
+        response BYTEA,
+        decisions BYTEA[] DEFAULT '{{}}'
+    )"""))
+
+
+def save_task_payload(task_id: str, task_name: str, num_names: int, request: bytes, response: str):
+    """
+    Saves the request file and the API's response for a task, and deletes tasks older than task_retention_days.
+    """
+    conn = pg_connection()
+    try:
+        now = datetime.utcnow()
+        with transaction(conn):
+            create_tasks_table(conn)
+            conn.execute(text(f"""
+            INSERT INTO {tasks_table} (task_id, task_name, submitted, num_names, request, response)
+            VALUES (:task_id, :task_name, :now, :num_names, :request, :response)
+            ON CONFLICT (task_id) DO NOTHING
+            """), {'task_id': str(task_id), 'task_name': task_name, 'now': now, 'num_names': num_names,
+                    'request': gzip.compress(request), 'response': gzip.compress(response.encode('utf8'))})
+            conn.execute(text(f"DELETE FROM {tasks_table} WHERE submitted < :oldest"),
+                         {'oldest': now - timedelta(days=task_retention_days)})
+    finally:
+        conn.close()
+
+
+def save_decisions_payload(task_id: str, df: pd.DataFrame):
+    # each page of decisions is added to the task's decisions as gzip compressed json
+    conn = pg_connection()
+    try:
+        with transaction(conn):
+            create_tasks_table(conn)
+            conn.execute(text(f"UPDATE {tasks_table} SET decisions = ARRAY_APPEND(decisions, :page) "
+                              f"WHERE task_id = :task_id"),
+                         {'task_id': str(task_id),
+                          'page': gzip.compress(df.to_json(orient='records').encode('utf8'))})
+    finally:
+        conn.close()
+
+
+def update_pending_task(task_id: str, status: str, task_name: str = None, num_names: int = None):
+    conn = pg_connection()
+    try:
+        with transaction(conn):
+            create_pending_table(conn)
+            conn.execute(text(f"""
+            INSERT INTO {pending_table} (task_id, task_name, status, submitted, last_checked, num_names)
+            VALUES (:task_id, :task_name, :status, :now, :now, :num_names)
+            ON CONFLICT (task_id) DO UPDATE SET status = EXCLUDED.status, last_checked = EXCLUDED.last_checked
+            """), {'task_id': str(task_id), 'task_name': task_name, 'status': status, 'now': datetime.utcnow(),
+                    'num_names': num_names})
+    finally:
+        conn.close()
+
+
+def save_entity_mapping(conn, df: pd.DataFrame):
+    """
+    Adds decisions to entity_mapping. If a name key is already in the table it is only replaced by a decision with
+    a higher confidence score. The unique index on name_key is added by create_db_tables.create_mapping_key.
+
+    :param conn: database connection
+    :param df: decisions with the mapping_cols columns
+    :return: None
+    """
+    df = df.reindex(columns=mapping_cols).dropna(subset=['name_key'])
+    df = df.sort_values(by='confidencescore', ascending=False).drop_duplicates(subset='name_key')
+    if len(df) == 0:
+        return
+    cols = ', '.join(mapping_cols)
+    with transaction(conn):
+        df.to_sql('entity_mapping_new', conn, if_exists='replace', index=False)
+        conn.execute(text(f"""
+        INSERT INTO entity_mapping AS em ({cols})
+        SELECT {cols} FROM entity_mapping_new
+        ON CONFLICT (name_key) DO UPDATE SET
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in mapping_cols if c != 'name_key')}
+        WHERE em.confidencescore IS NULL OR EXCLUDED.confidencescore > em.confidencescore
+        """))
+        conn.execute(text("DROP TABLE entity_mapping_new"))
+
 
 class EntityMatchBulk:
-    def __init__(self):
+    def __init__(self, local_match_threshold: float = match_threshold, url: str = api_url,
+                 authorization: tuple = None):
+        """
+        :param local_match_threshold: lowest score for a name to be matched to a known name instead of being sent
+            to the Concordance API, None to send every name to the API
+        :param url: base URL of the Concordance API
+        :param authorization: optional tuple of username-serial and API key, read from api_key.ini if not given
+        """
+        self.local_match_threshold = local_match_threshold
+        self.url = url.rstrip('/')
         self.config = ConfigParser()
         self.config.read('api_key.ini')
         self.ref_folder = os.path.join(os.getcwd(), 'Reference')
@@ -22,118 +230,336 @@ class EntityMatchBulk:
             os.mkdir(self.ref_folder)
         self.entity_mapping_file = os.path.join(self.ref_folder, 'Entity Mapping.xlsx')
         self.file_name = f'upcoming_IPO_entity_mapping_{datetime.utcnow().strftime("%Y-%m-%d %H%M")}'
-        self.file = os.path.join(self.ref_folder, 'Entity Mapping Requests', self.file_name + '.csv')
-        self.authorization = (self.config.get('FDSAPI', 'USERNAME-SERIAL'), self.config.get('FDSAPI', 'API-Key'))
+        # names to be sent to the Concordance API, set by create_csv
+        self.df_request = pd.DataFrame(columns=['client_id', 'company_name', 'ticker', 'exchange'])
+        self.authorization = authorization or (self.config.get('FDSAPI', 'USERNAME-SERIAL'),
+                                               self.config.get('FDSAPI', 'API-Key'))
         self.headers = {'Content-Type': 'application/json', 'Accept': 'application/json;charset=utf-8'}
+        # tasks are submitted from several threads, the lock keeps them submit_interval_seconds apart
+        self.submit_lock = threading.Lock()
+        self.last_submit = 0
+        # decisions from different tasks are downloaded at the same time but saved one page at a time
+        self.save_lock = threading.Lock()
+
+    def create_csv(self, recheck_all: bool = False) -> pd.DataFrame:
+        """
+        Gets the company names that need to be checked with the Concordance API, the request csv is created from them
+        in memory when the tasks are submitted.
+        Names are unmapped if their name key has no iconum in entity_mapping and are only checked if their entry in
+        the resolution cache has expired (or they aren't in the cache yet).
 
-    def create_csv(self, recheck_all: bool = False):
+        :param recheck_all: if False only names that aren't in entity_mapping at all are checked
+        :return: data frame with the client_id, company_name, ticker and exchange columns (also kept in df_request)
+        """
         conn = pg_connection('ipo_monitoring')
-        query = """
-        SELECT 
-            ai.company_name, ai.ticker ,ai.exchange, em.iconum, em.entity_id, em.mapStatus
-        FROM 
-            all_ipos ai
-            LEFT JOIN entity_mapping em ON ai.company_name = em.company_name  
-        WHERE 
-            ai.company_name IS NOT NULL 
-            AND em.iconum IS NULL
-            --AND ipo_date >= CURRENT_DATE
-        ORDER BY ai.time_added DESC
-        """
-        df = pd.read_sql_query(query, conn)
-        if recheck_all:
-            # checking company names that don't have an iconum
-            df = df.loc[df['iconum'].isna()]
-        else:
-            # only checking company names that don't have an iconum and haven't been checked yet
-            df = df.loc[df['iconum'].isna() & df['mapStatus'].isna()]
-        df = df.drop_duplicates()
-        logger.info(f"{len(df)} unmapped entities")
+        query = f"""
+        SELECT company_name, ticker, exchange
+        FROM (
+            SELECT DISTINCT ON (ai.company_name, ai.ticker, ai.exchange)
+                ai.company_name, ai.ticker, ai.exchange, ai.time_added
+            FROM
+                all_ipos ai
+                LEFT JOIN entity_mapping em ON ai.name_key = em.name_key
+                LEFT JOIN {cache_table} c ON c.name_key = COALESCE(ai.name_key, '')
+                    AND c.ticker = COALESCE(ai.ticker::TEXT, '') AND c.exchange = COALESCE(ai.exchange, '')
+            WHERE
+                ai.company_name IS NOT NULL
+                AND em.iconum IS NULL
+                {'' if recheck_all else 'AND em.mapstatus IS NULL'}
+                -- names checked recently (or mapped before) are only sent again once their cache entry expires
+                AND (c.next_check IS NULL OR c.next_check <= :now)
+            ORDER BY ai.company_name, ai.ticker, ai.exchange, ai.time_added DESC
+        ) u
+        ORDER BY time_added DESC
+        """
+        df = pd.read_sql_query(text(query), conn, params={'now': datetime.utcnow()})
+        logger.info(f"{len(df)} unmapped entities due to be checked")
         # making unique client_id by concatenating company name, ticker and exchange separated by underscores
         df['client_id'] = df['company_name'].fillna('') + '_' + df['ticker'].fillna('').astype(str) + '_' + df['exchange'].fillna('')
-        df.set_index('client_id', inplace=True)
-        # save that dataframe to a csv encoded as utf8
-        if len(df) >= 1:
-            df.to_csv(self.file, index_label='client_id', encoding='utf-8-sig')
+        if self.local_match_threshold is not None and len(df) > 0:
+            df = self.match_locally(conn, df)
+        conn.close()
+        self.df_request = df[['client_id', 'company_name', 'ticker', 'exchange']].reset_index(drop=True)
+        return self.df_request
+
+    def match_locally(self, conn, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Matches names to names that already have an iconum and saves the matches the same way as decisions from the
+        Concordance API, with the match score as the confidence and similarity scores.
+
+        :param conn: database connection
+        :param df: names to be checked with company_name and client_id columns
+        :return: the names that weren't matched, to be sent to the Concordance API
+        """
+        matcher = NameMatcher(load_known_names(conn), threshold=self.local_match_threshold)
+        df_match = matcher.match(df['company_name'])
+        logger.info(f"{len(df_match)} of {len(df)} entities matched to known names, "
+                    f"{len(df) - len(df_match)} will be sent to the Concordance API")
+        if len(df_match) > 0:
+            df_decisions = pd.DataFrame({
+                'clientId': df.loc[df_match.index, 'client_id'],
+                'clientName': df.loc[df_match.index, 'company_name'],
+                'entityName': df_match['entityname'],
+                'entityId': df_match['entity_id'],
+                'mapStatus': 'MAPPED',
+                'similarityScore': df_match['score'],
+                'confidenceScore': df_match['score'],
+                'nameMatchString': df_match['matched_name'],
+                'taskId': 'local'
+            }).reset_index(drop=True)
+            self.formatting_and_saving(df_decisions)
+        return df.drop(index=df_match.index)
+
+    def submit_tasks(self) -> list:
+        """
+        Splits the names from create_csv into tasks of at most max_task_size names and submits them to the Concordance
+        API, up to max_concurrent_tasks at a time.
+
+        :return: list of task IDs
+        """
+        df = self.df_request
+        if len(df) == 0:
+            logger.info("No entities to send to the Concordance API")
+            return []
+        tasks = split_tasks(df, max_task_size)
+        if len(tasks) > 1:
+            logger.info(f"Splitting {len(df)} entities into {len(tasks)} Concordance tasks")
+
+        def submit(task: tuple):
+            i, df_task = task
+            task_name = self.file_name if len(tasks) == 1 else f"{self.file_name}_{i + 1}"
+            # the csv is only created in memory, encoded as utf8 with a BOM
+            buffer = StringIO()
+            df_task.to_csv(buffer, index=False)
+            data = buffer.getvalue().encode('utf-8-sig')
+            return self.submit_task(data, task_name, len(df_task))
+
+        with ThreadPoolExecutor(max_workers=max_concurrent_tasks) as executor:
+            eids = list(executor.map(submit, enumerate(tasks)))
+        return [eid for eid in eids if eid is not None]
+
+    def wait_to_submit(self):
+        with self.submit_lock:
+            wait_time = self.last_submit + submit_interval_seconds - monotonic()
+            if wait_time > 0:
+                sleep(wait_time)
+            self.last_submit = monotonic()
+
+    def submit_task(self, data: bytes, task_name: str, num_names: int = None):
+        """
+        Submits one task to the Concordance API. If the API responds with too many requests,
+        the task is submitted again after the time given in the Retry-After header.
+
+        :param data: csv file with the client_id and company_name columns
+        :param task_name: name of the task
+        :param num_names: number of names in the task
+        :return: the task ID or None if the API didn't return one
+        """
+        # create request with concordance API
+        entity_task_endpoint = f'{self.url}/entity-task'
+        entity_task_request = {
+            'universeId': str(708),
+            'taskName': task_name,
+            'clientIdColumn': 'client_id',
+            'nameColumn': 'company_name',
+            'includeEntityType': ['PUB', 'PVT', 'HOL', 'SUB']
+        }
+        for attempt in range(submit_attempts):
+            self.wait_to_submit()
+            file_data = {'inputFile': (task_name + '.csv', data, 'text/csv')}
+            entity_task_response = requests.post(url=entity_task_endpoint, data=entity_task_request,
+                                                 auth=self.authorization, files=file_data,
+                                                 headers={'media-type': 'multipart/form-data'})
+            if entity_task_response.status_code != 429 or attempt == submit_attempts - 1:
+                break
+            wait_time = number_or_none(entity_task_response.headers.get('Retry-After')) or rate_limit_wait_seconds
+            logger.info(f"Concordance API rate limit reached, submitting {task_name} again in {wait_time} seconds")
+            sleep(wait_time)
+        assert entity_task_response.ok, f"{entity_task_response.status_code} - {entity_task_response.text}"
+        if entity_task_response.text is None or entity_task_response.text == '':
+            return None
+        entity_task_data = json.loads(entity_task_response.text)
+        eid = entity_task_data['data']['taskId']
+        task_name = entity_task_data['data']['taskName']  # will be task_name provided in entity task request
+        logger.info(f"Entity mapping request submitted - task ID {eid} - task name {task_name}")
+        update_pending_task(eid, 'PENDING', task_name, num_names)
+        # the request and response are kept to look into errors, i.e.
+        # Bad Request - Number of elements in the header doesn't match the total number of columns
+        try:
+            save_task_payload(eid, task_name, num_names, data, entity_task_response.text)
+        except Exception as e:
+            logger.error(e, exc_info=sys.exc_info())
+        return eid
 
     def entity_mapping_api(self):
-        if os.path.exists(self.file):
-            # create request with concordance API
-            entity_task_endpoint = 'https://api.factset.com/content/factset-concordance/v2/entity-task'
-            entity_task_request = {
-                'universeId': str(708),
-                'taskName': self.file_name,
-                'clientIdColumn': 'client_id',
-                'nameColumn': 'company_name',
-                'includeEntityType': ['PUB', 'PVT', 'HOL', 'SUB']
-            }
-            with open(self.file, 'rb') as f:
-                file_data = {'inputFile': (self.file_name + '.csv', f, 'text/csv')}
-                entity_task_response = requests.post(url=entity_task_endpoint, data=entity_task_request,
-                                                     auth=self.authorization, files=file_data,
-                                                     headers={'media-type': 'multipart/form-data'})
-            assert entity_task_response.ok, f"{entity_task_response.status_code} - {entity_task_response.text}"
-            # temporarily saving entity task response to look into errors
-            # getting Bad Request - Number of elements in the header doesn't match the total number of columns
-            with open(os.path.join(log_folder, 'Concordance API Responses', f"API response for {self.file_name}.txt"), 'w', encoding='utf8') as f:
-                json.dump(entity_task_response.text, f, ensure_ascii=False)
-            if entity_task_response.text is not None and entity_task_response.text != '':
-                entity_task_data = json.loads(entity_task_response.text)
-                eid = entity_task_data['data']['taskId']
-                task_name = entity_task_data['data']['taskName']  # will be file_name provided in entity task request
-                logger.info(f"Entity mapping request submitted - task ID {eid} - task name {task_name}")
-                task_status = self.get_task_status(eid)
-                logger.info(f"Task {eid} status - {task_status}")
-                if task_status == 'SUCCESS':
-                    df_result = self.get_entity_decisions(eid)
-                    self.formatting_and_saving(df_result)
-        else:
-            logger.info(f"File not found - {self.file}")
+        # submits the tasks and waits for the decisions
+        eids = self.submit_tasks()
+        if len(eids) > 0:
+            self.process_tasks(eids)
+
+    def process_tasks(self, eids: list, max_wait: int = max_poll_seconds):
+        """
+        Waits for each task and saves its decisions, up to max_concurrent_tasks tasks at a time.
+        The decisions from every task are added to entity_mapping, which keeps the best decision for each name.
+        """
+        with ThreadPoolExecutor(max_workers=max_concurrent_tasks) as executor:
+            list(executor.map(lambda eid: self.process_task(eid, max_wait=max_wait), eids))
 
-    def get_task_status(self, eid, recheck_count: int = 0, max_recheck=12, wait_time=10):
+    def process_task(self, eid, max_wait: int = max_poll_seconds):
+        """
+        Waits for a task to finish and saves the decisions. If the task hasn't finished it stays in the pending tasks
+        table so the decisions can be saved on the next run.
+        """
+        try:
+            task_status = self.wait_for_task(eid, max_wait=max_wait)
+            logger.info(f"Task {eid} status - {task_status}")
+            if task_status == 'SUCCESS':
+                self.save_decisions(eid)
+            else:
+                update_pending_task(eid, task_status)
+        except Exception as e:
+            logger.error(f"ERROR for Concordance task {eid}")
+            logger.error(e, exc_info=sys.exc_info())
+            error_email(str(e))
+
+    def save_decisions(self, eid):
+        """
+        Saves the decisions for a task one page at a time, starting after the decisions that were already saved.
+        """
+        offset = pending_task_offset(eid)
+        update_pending_task(eid, 'SAVING')
+        for df_page in self.iter_entity_decisions(eid, offset=offset):
+            with self.save_lock:
+                try:
+                    save_decisions_payload(eid, df_page)
+                except Exception as e:
+                    logger.error(e, exc_info=sys.exc_info())
+                self.formatting_and_saving(df_page)
+            offset += len(df_page)
+            update_task_offset(eid, offset)
+        update_pending_task(eid, 'SAVED')
+
+    def get_task_status(self, eid) -> dict:
         # get the status of the request
-        entity_task_status_endpoint = 'https://api.factset.com/content/factset-concordance/v2/entity-task-status'
+        entity_task_status_endpoint = f'{self.url}/entity-task-status'
         status_parameters = {
             'taskId': str(eid)
         }
         entity_task_status_response = requests.get(url=entity_task_status_endpoint, params=status_parameters,
                                                    auth=self.authorization, headers=self.headers, verify=False)
+        assert entity_task_status_response.ok, \
+            f"{entity_task_status_response.status_code} - {entity_task_status_response.text}"
         entity_task_status_data = json.loads(entity_task_status_response.text)
-        task_status = entity_task_status_data['data'][0]['status']
-        if task_status in ['PENDING', 'IN_PROGRESS'] and recheck_count < max_recheck:
-            recheck_count += 1
+        return entity_task_status_data['data'][0]
+
+    def wait_for_task(self, eid, max_wait: int = max_poll_seconds, base_wait: float = 2, max_interval: float = 60) -> str:
+        """
+        Polls the status of a task until it finishes or max_wait seconds have passed. The wait between checks doubles
+        each time (up to max_interval) with random jitter so tasks submitted together aren't checked at the same time.
+
+        :return: the last status of the task, PENDING or IN_PROGRESS if it didn't finish in time
+        """
+        deadline = datetime.utcnow() + timedelta(seconds=max_wait)
+        attempt = 0
+        while True:
+            try:
+                task = self.get_task_status(eid)
+            except (AssertionError, ValueError, requests.exceptions.RequestException) as e:
+                # a status check that fails is treated the same as a task that is still in progress
+                logger.warning(f"Status check for task {eid} failed - {e}")
+                task = {'status': 'PENDING'}
+            task_status = task['status']
+            if task_status == 'FAILURE':
+                logger.info(f"Task failed with reason {task.get('errorTitle')}")
+                return task_status
+            if task_status not in ['PENDING', 'IN_PROGRESS']:
+                logger.info(f"Duration for Concordance task {eid} {task.get('processDuration', 0)}")
+                logger.info(f"Decision Rate for Concordance task {eid} {round(task.get('decisionRate', 0), 2)}")
+                update_task_stats(eid, task)
+                return task_status
+            wait_time = min(base_wait * 2 ** attempt, max_interval) * random.uniform(0.5, 1.5)
+            if datetime.utcnow() + timedelta(seconds=wait_time) > deadline:
+                return task_status
             sleep(wait_time)
-            return self.get_task_status(eid, recheck_count)
-        elif task_status == 'FAILURE':
-            logger.info(f"Task failed with reason {entity_task_status_data['data'][0]['errorTitle']}")
-        else:
-            logger.info(f"Duration for Concordance API {entity_task_status_data['data'][0].get('processDuration', 0)}")
-            logger.info(f"Decision Rate for Concordance API {round(entity_task_status_data['data'][0].get('decisionRate', 0), 2)}")
-            return task_status
+            attempt += 1
+
+    def check_pending_tasks(self):
+        """
+        Saves the decisions for tasks from previous runs that have finished since.
+        """
+        conn = pg_connection()
+        try:
+            with transaction(conn):
+                create_pending_table(conn)
+                df = pd.read_sql_query(f"SELECT * FROM {pending_table} "
+                                       f"WHERE status IN ('PENDING', 'IN_PROGRESS', 'SUCCESS', 'SAVING')", conn)
+        finally:
+            conn.close()
+        for row in df.itertuples():
+            try:
+                task_status = self.get_task_status(row.task_id)['status']
+                if task_status == 'SUCCESS':
+                    logger.info(f"Saving decisions for task {row.task_id} from a previous run")
+                    self.save_decisions(row.task_id)
+                elif task_status in ['PENDING', 'IN_PROGRESS'] and \
+                        row.submitted < datetime.utcnow() - timedelta(days=pending_task_days):
+                    update_pending_task(row.task_id, 'EXPIRED')
+                else:
+                    update_pending_task(row.task_id, task_status)
+            except Exception as e:
+                logger.error(f"ERROR for Concordance task {row.task_id}")
+                logger.error(e, exc_info=sys.exc_info())
+
+    def iter_entity_decisions(self, eid, offset: int = 0, limit: int = decisions_page_size):
+        """
+        Gets the entity mappings returned from the API one page at a time.
+
+        :param eid: task ID
+        :param offset: number of decisions to skip, i.e. decisions already saved
+        :param limit: number of decisions in each page
+        :return: generator of data frames with the decisions in each page
+        """
+        entity_decisions_endpoint = f'{self.url}/entity-decisions'
+        while True:
+            decisions_parameters = {
+                'taskId': str(eid),
+                'offset': offset,
+                'limit': limit
+            }
+            entity_decisions_response = requests.get(url=entity_decisions_endpoint, params=decisions_parameters,
+                                                     auth=self.authorization, headers=self.headers, verify=False)
+            assert entity_decisions_response.ok, \
+                f"{entity_decisions_response.status_code} - {entity_decisions_response.text}"
+            entity_decisions_data = json.loads(entity_decisions_response.text)
+            page = entity_decisions_data.get('data', [])
+            if len(page) == 0:
+                return
+            df = pd.json_normalize(page)
+            for col, dtype in decision_types.items():
+                if col in df.columns:
+                    df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+            yield df
+            offset += len(page)
+            total = entity_decisions_data.get('meta', {}).get('pagination', {}).get('total')
+            if len(page) < limit or (total is not None and offset >= total):
+                return
 
     def get_entity_decisions(self, eid):
-        # get the entity mappings returned from the API
-        # seems that the default limit for number of results returned is 100 so increasing to 1000
-        entity_decisions_endpoint = 'https://api.factset.com/content/factset-concordance/v2/entity-decisions'
-        decisions_parameters = {
-            'taskId': str(eid),
-            'limit': 1000
-        }
-        entity_decisions_response = requests.get(url=entity_decisions_endpoint, params=decisions_parameters,
-                                                 auth=self.authorization, headers=self.headers, verify=False)
-        entity_decisions_data = json.loads(entity_decisions_response.text)
-        return pd.json_normalize(entity_decisions_data['data'])
-        
+        # all of the decisions for a task in one data frame
+        pages = list(self.iter_entity_decisions(eid))
+        return pd.concat(pages, ignore_index=True) if len(pages) > 0 else pd.DataFrame()
+
     def formatting_and_saving(self, df: pd.DataFrame):
         # save results from Concordance API
         # breaking out the client_id back into company name, ticker and exchange columns
         df[['company_name', 'ticker', 'exchange']] = df['clientId'].str.split('_', n=2, expand=True)
         df.replace('', np.nan, inplace=True)
+        self.cache_decisions(df)
         # only adding mapped entities to the database
         df = df.loc[df['mapStatus'].str.upper() == 'MAPPED']
         if len(df) > 0:
             df.sort_values(by=['confidenceScore', 'similarityScore'], ascending=False, inplace=True)
-            df['iconum'] = df['entityId'].map(self.entity_id_to_iconum, na_action='ignore')
+            df['iconum'] = entity_ids_to_iconums(df['entityId'])
             # rows with confidence below .75 should be not be considered matches
             df.loc[df['confidenceScore'] <= .75, 'mapStatus'] = 'UNMAPPED'
             df.loc[df['confidenceScore'] <= .75, ['entityName', 'iconum', 'entityId', 'similarityScore',
@@ -144,25 +570,38 @@ class EntityMatchBulk:
                     'nameMatchString', 'taskId', 'rowIndex', 'clientId', 'company_name', 'ticker',
                     'exchange']
             df = df[[col for col in cols if col in df.columns]]
-            # TODO: do I really need to save the mapping results?
-            df.to_csv(os.path.join(self.ref_folder, 'Entity Mapping Requests', self.file_name + '_results.csv'),
-                      index=False, encoding='utf-8-sig')
             df.rename(columns={'entityName': 'entityname', 'entityId': 'entity_id', 'mapStatus': 'mapstatus',
                                'similarityScore': 'similarityscore', 'confidenceScore': 'confidencescore',
                                'countryName': 'countryname', 'entityTypeDescription': 'entitytypedescription',
                                'entityTypeCode': 'entitytypecode'}, inplace=True)
-            final_cols = ['company_name', 'ticker', 'exchange', 'entityname', 'iconum', 'entity_id', 'mapstatus',
-                          'similarityscore', 'confidencescore', 'countryname', 'entitytypedescription']
-            df = df[final_cols]
-            df.drop_duplicates(subset=['company_name'], inplace=True)
+            df['name_key'] = name_keys(df['company_name'])
             conn = pg_connection()
             try:
-                df.to_sql('entity_mapping', conn, if_exists='append', index=False)
+                save_entity_mapping(conn, df)
             except Exception as e:
                 logger.error(e, exc_info=sys.exc_info())
             finally:
                 conn.close()
 
+    def cache_decisions(self, df: pd.DataFrame):
+        # every decision is cached, including unmapped names, so they aren't sent again until the cache entry expires
+        df_c = df.rename(columns={'entityName': 'entityname', 'entityId': 'entity_id', 'mapStatus': 'mapstatus',
+                                  'similarityScore': 'similarityscore', 'confidenceScore': 'confidencescore'})
+        df_c = df_c.reindex(columns=['company_name', 'ticker', 'exchange', 'entityname', 'entity_id', 'mapstatus',
+                                     'similarityscore', 'confidencescore'])
+        df_c['iconum'] = entity_ids_to_iconums(df_c['entity_id'])
+        # same threshold as formatting_and_saving, low confidence matches are treated as unmapped
+        low_confidence = df_c['confidencescore'].fillna(0) <= .75
+        df_c.loc[low_confidence, 'mapstatus'] = 'UNMAPPED'
+        df_c.loc[low_confidence, ['entityname', 'entity_id', 'iconum']] = np.nan
+        conn = pg_connection()
+        try:
+            update_cache(conn, df_c)
+        except Exception as e:
+            logger.error(e, exc_info=sys.exc_info())
+        finally:
+            conn.close()
+
     @staticmethod
     def iconum_to_entity_id(iconum: int):
         chars = "0123456789BCDFGHJKLMNPQRSTVWXYZ"
@@ -191,11 +630,17 @@ def main():
     logger.info("Checking Cordance API for entity IDs")
     em = EntityMatchBulk()
     try:
+        em.check_pending_tasks()
         em.create_csv(recheck_all=True)
-        em.entity_mapping_api()
+        eids = em.submit_tasks()
+        if len(eids) > 0:
+            # the next stages only wait for the tasks for a short time, check_pending_tasks saves the decisions
+            # of the tasks that haven't finished on the next run
+            em.process_tasks(eids, max_wait=first_wait_seconds)
     except Exception as e:
         logger.error(e, exc_info=sys.exc_info())
         error_email(str(e))
+        raise
 
 
 if __name__ == '__main__':
@@ -0,0 +1,104 @@
+import os
+import hashlib
+from datetime import datetime, date
+from typing import Optional, Tuple
+import numpy as np
+import pandas as pd
+from logging_ipo_dates import logger
+try:
+    import xlsxwriter
+except ImportError:
+    # pandas' to_excel (with openpyxl) is used instead, which keeps the whole workbook in memory
+    xlsxwriter = None
+
+# Excel files are written one row at a time with xlsxwriter in constant memory mode instead of DataFrame.to_excel,
+# which builds the whole workbook in memory first.
+# A hash of the data is saved next to each workbook so a workbook is only written again when the data changes.
+
+
+def frame_digest(df: pd.DataFrame, sheet_name: str = '') -> str:
+    md5 = hashlib.md5()
+    md5.update(sheet_name.encode())
+    md5.update('|'.join(str(c) for c in df.columns).encode())
+    try:
+        md5.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    except TypeError:
+        # columns with unhashable values like lists or dicts
+        md5.update(df.to_csv(index=False).encode())
+    return md5.hexdigest()
+
+
+def digest_file(file: str) -> str:
+    return file + '.md5'
+
+
+def is_unchanged(file: str, digest: str) -> bool:
+    if not os.path.exists(file) or not os.path.exists(digest_file(file)):
+        return False
+    with open(digest_file(file), 'r') as f:
+        return f.read().strip() == digest
+
+
+def write_cell(ws, row: int, col: int, value, formats: dict):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or value is pd.NaT or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return
+    if isinstance(value, pd.Timestamp):
+        value = value.to_pydatetime()
+    if isinstance(value, datetime):
+        ws.write_datetime(row, col, value.replace(tzinfo=None), formats['datetime'])
+    elif isinstance(value, date):
+        ws.write_datetime(row, col, value, formats['date'])
+    elif isinstance(value, bool):
+        ws.write_boolean(row, col, value)
+    elif isinstance(value, (int, float)):
+        if np.isinf(value):
+            ws.write_string(row, col, str(value))
+        else:
+            ws.write_number(row, col, value)
+    else:
+        ws.write_string(row, col, str(value))
+
+
+def write_workbook(df: pd.DataFrame, file: str, sheet_name: str, freeze_panes: Optional[Tuple[int, int]] = None):
+    wb = xlsxwriter.Workbook(file, {'constant_memory': True})
+    formats = {
+        'header': wb.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}),
+        'date': wb.add_format({'num_format': 'yyyy-mm-dd'}),
+        'datetime': wb.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    }
+    ws = wb.add_worksheet(sheet_name[:31])
+    if freeze_panes:
+        ws.freeze_panes(*freeze_panes)
+    # in constant memory mode rows have to be written in order
+    ws.write_row(0, 0, [str(c) for c in df.columns], formats['header'])
+    for r, values in enumerate(df.itertuples(index=False, name=None), start=1):
+        for c, value in enumerate(values):
+            write_cell(ws, r, c, value, formats)
+    wb.close()
+
+
+def save_excel(df: pd.DataFrame, file: str, sheet_name: str = 'Sheet1', freeze_panes: Optional[Tuple[int, int]] = None,
+               skip_unchanged: bool = True) -> bool:
+    """
+    Saves a data frame to an Excel file without index, the same as to_excel(file, index=False).
+
+    :param df: data frame to save
+    :param file: Excel file
+    :param sheet_name: name of the sheet, Excel allows 31 characters
+    :param freeze_panes: optional (row, column) to freeze, i.e. (1, 0) to freeze the header
+    :param skip_unchanged: if True the file isn't written when the data is the same as the last time it was saved
+    :return: True if the file was written
+    """
+    digest = frame_digest(df, sheet_name)
+    if skip_unchanged and is_unchanged(file, digest):
+        logger.info(f"{os.path.basename(file)} is unchanged")
+        return False
+    if xlsxwriter is None:
+        df.to_excel(file, sheet_name=sheet_name[:31], index=False, freeze_panes=freeze_panes)
+    else:
+        write_workbook(df, file, sheet_name, freeze_panes)
+    with open(digest_file(file), 'w') as f:
+        f.write(digest)
+    return True
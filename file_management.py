@@ -1,8 +1,12 @@
 import os
 import sys
+import shutil
 from datetime import datetime, timedelta
 from logging_ipo_dates import logger
 
+# run date partitions in the Parquet archive (see snapshot_archive) are kept for this many days
+archive_retention_days = 365
+
 
 def delete_old_files(folder: str, num_days: int = 30, test: bool = False) -> list:
     """
@@ -33,12 +37,49 @@ def delete_old_files(folder: str, num_days: int = 30, test: bool = False) -> lis
     return files_deleted
 
 
+def delete_old_partitions(folder: str, key: str = 'run_date', num_days: int = 365, test: bool = False) -> list:
+    """
+    Deletes date partitions older than the number of days given as a parameter,
+    i.e. the run_date=2021-05-14 folders in the Parquet archive. The date is taken from the folder name.
+
+    :param folder: folder location partitions will be deleted from, including any sub folders
+    :param key: partition key, the folder names are key=yyyy-mm-dd
+    :param num_days: int specifying the number of days before a partition is deleted
+    :param test: if function is being tested, it will only print the folder names rather than deleting them
+    :return: list of folders that were deleted
+    """
+    old_date = (datetime.utcnow() - timedelta(days=num_days)).date().isoformat()
+    prefix = f"{key}="
+    folders_deleted = []
+    for root, dirs, files in os.walk(folder):
+        partitions = [d for d in dirs if d.startswith(prefix)]
+        # ISO formatted dates can be compared as strings
+        for d in [d for d in partitions if d[len(prefix):] < old_date]:
+            if test:
+                print(os.path.join(root, d))
+            else:
+                shutil.rmtree(os.path.join(root, d))
+            folders_deleted.append(os.path.join(os.path.basename(root), d))
+        # not looking inside the partitions
+        dirs[:] = [d for d in dirs if d not in partitions]
+    if len(folders_deleted) > 0:
+        if test:
+            print(f"Deleted {', '.join(folders_deleted)}")
+        else:
+            logger.info(f"Deleted {', '.join(folders_deleted)}")
+    return folders_deleted
+
+
 def main():
     try:
+        # new Concordance requests and responses are kept in the concordance_tasks table (see entity_mapping),
+        # the files saved before that are still deleted after 30 days
         for folder in [os.path.join(os.getcwd(), 'Reference', 'Entity Mapping Requests'),
                        os.path.join(os.getcwd(), 'Logs', 'Screenshots'),
                        os.path.join(os.getcwd(), 'Logs', 'Concordance API Responses')]:
             delete_old_files(folder)
+        delete_old_files(os.path.join(os.getcwd(), 'Logs', 'Checkpoints'), num_days=7)
+        delete_old_partitions(os.path.join(os.getcwd(), 'Archive'), num_days=archive_retention_days)
     except Exception as e:
         logger.error(e, exc_info=sys.exc_info())
 
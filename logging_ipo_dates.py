@@ -2,27 +2,33 @@ import os
 import logging
 from datetime import date, timedelta
 import configparser
-import pandas as pd
-import win32com.client as win32
-from pg_connection import pg_connection, convert_cols_db
 
+# pandas, win32com and the db connection are imported in the functions that use them so importing the logger is fast
 
 log_file = 'IPO Monitoring Logs.txt'
 log_folder = os.path.join(os.getcwd(), 'Logs')
 screenshot_folder = os.path.join(log_folder, 'Screenshots')
 prev_log_folder = os.path.join(log_folder, 'Previous Logs')
-today_date = date.today().isoformat()
 
-for folder in [log_folder, screenshot_folder]:
-    if not os.path.exists(folder):
-        os.mkdir(folder)
 
-if date.today().day == 1:
-    prev_log_file = os.path.join(prev_log_folder, f"IPO Monitoring Logs {(date.today() - timedelta(days=1)).isoformat()}.txt")
-    if not os.path.exists(prev_log_file):
-        os.rename(src=os.path.join(log_folder, log_file), dst=prev_log_file)
-
-handler = logging.FileHandler(os.path.join(log_folder, log_file), mode='a+', encoding='UTF-8')
+class LogFileHandler(logging.FileHandler):
+    """
+    Opens the log file when the first message is logged instead of on import, so importing the logger doesn't
+    create the Logs folder. On the first day of the month last month's log is moved to Previous Logs.
+    """
+    def _open(self):
+        for folder in [log_folder, screenshot_folder]:
+            os.makedirs(folder, exist_ok=True)
+        if date.today().day == 1 and os.path.exists(self.baseFilename):
+            prev_log_file = os.path.join(prev_log_folder,
+                                         f"IPO Monitoring Logs {(date.today() - timedelta(days=1)).isoformat()}.txt")
+            if not os.path.exists(prev_log_file):
+                os.makedirs(prev_log_folder, exist_ok=True)
+                os.rename(src=self.baseFilename, dst=prev_log_file)
+        return super()._open()
+
+
+handler = LogFileHandler(os.path.join(log_folder, log_file), mode='a+', encoding='UTF-8', delay=True)
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 handler.setFormatter(formatter)
 logger = logging.getLogger()
@@ -37,19 +43,22 @@ def error_email(error_message: str = ''):
     :param error_message: optional string that will be added to body of email
     :return: None
     """
+    import win32com.client as win32
     config = configparser.ConfigParser()
     config.read('email_settings.ini')
     outlook = win32.Dispatch('outlook.application')
     mail = outlook.CreateItem(0)
     mail.To = config.get('Email', 'ErrorTo')
     mail.Sender = config.get('Email', 'Sender')
-    mail.Subject = f"ERROR: {config.get('Email', 'Subject')} {today_date}"
+    mail.Subject = f"ERROR: {config.get('Email', 'Subject')} {date.today().isoformat()}"
     mail.HTMLBody = config.get('Email', 'ErrorBody') + error_message + config.get('Email', 'Signature')
     mail.Attachments.Add(os.path.join(log_folder, log_file))
     mail.Send()
 
 
 def consolidate_webscraping_results(num_recent: int = 30):
+    import pandas as pd
+    from pg_connection import pg_connection, convert_cols_db
     df = pd.read_csv(os.path.join(log_folder, 'Webscraping Results.csv'))
     df.sort_values(by=['time_checked'], ascending=False, inplace=True)
 
@@ -1,54 +1,50 @@
+import json
+import argparse
 from logging_ipo_dates import logger
-import source_reference
-import website_scraping
-import data_transformation_db
-import entity_mapping
-import data_comparison
-import file_management
-import workflow
-import rpd_creation
-
-logger.info('-' * 100)
-
-try:
-    source_reference.main()
-except Exception as e:
-    print(e)
-
-try:
-    website_scraping.main()
-except Exception as e:
-    print(e)
-
-try:
-    data_transformation_db.main()
-except Exception as e:
-    print(e)
-
-try:
-    entity_mapping.main()
-except Exception as e:
-    print(e)
-
-try:
-    data_comparison.main()
-except Exception as e:
-    print(e)
-
-try:
-    workflow.main()
-except Exception as e:
-    print(e)
-
-try:
-    rpd_creation.main()
-except Exception as e:
-    print(e)
-
-try:
-    file_management.main()
-except Exception as e:
-    print(e)
-
-logger.info('-' * 100)
+from pipeline import Stage, Pipeline
 
+# stage modules are imported by the pipeline when each stage runs
+
+
+def raw_table_inputs() -> list:
+    # read when the stage starts so it uses the sources.json created by source_reference in the same run
+    with open('sources.json', 'r') as f:
+        sources = json.load(f)
+    raw_tables = sorted({details['db_table_raw'] for details in sources.values() if details.get('db_table_raw')})
+    return ['file:sources.json', 'date'] + [f"table:{tbl}" for tbl in raw_tables]
+
+
+def pipeline_stages(wd=None) -> list:
+    """
+    Returns the stages of IPO monitoring.
+
+    :param wd: optional WebDriver kept open between runs, used by scheduler_daemon
+    :return: list of stages for Pipeline
+    """
+    return [
+        Stage('source_reference', 'source_reference.main', inputs=['file:source_reference.py', 'file:sources.json']),
+        Stage('website_scraping', 'website_scraping.main', depends_on=['source_reference'], kwargs={'wd': wd}),
+        Stage('peo_pipe', 'data_comparison.update_pipe_data', outputs=['PEO-PIPE']),
+        Stage('data_transformation', 'data_transformation_db.main', depends_on=['website_scraping'],
+              inputs=raw_table_inputs),
+        # no inputs, tasks left pending by the previous run are saved even if all_ipos hasn't changed
+        Stage('entity_mapping', 'entity_mapping.main', depends_on=['data_transformation']),
+        Stage('data_comparison', 'data_comparison.main', depends_on=['entity_mapping', 'peo_pipe'],
+              outputs=['IPO Monitoring Data', 'Withdrawn IPOs', 'Comparison']),
+        Stage('workflow', 'workflow.main', depends_on=['data_comparison']),
+        Stage('rpd_creation', 'rpd_creation.main', depends_on=['data_comparison'], outputs=['IPO Monitoring RPDs']),
+        Stage('file_management', 'file_management.main')
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs each stage of IPO monitoring')
+    parser.add_argument('--resume', action='store_true',
+                        help='only run the stages that failed in the last run and the stages that depend on them')
+    args = parser.parse_args()
+
+    logger.info('-' * 100)
+
+    Pipeline(pipeline_stages()).run(resume=args.resume)
+
+    logger.info('-' * 100)
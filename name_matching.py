@@ -0,0 +1,139 @@
+import re
+from collections import defaultdict
+import pandas as pd
+from sqlalchemy import inspect, text
+from name_normalization import name_keys, remove_asset_types
+from entity_codec import iconums_to_entity_ids
+
+# Matches company names to names that already have an iconum (in entity_mapping or PEO-PIPE) so they don't need to
+# be sent to the Concordance API. Names are compared using the trigrams (3 character pieces) of their name keys.
+# An inverted index from each trigram to the known names that contain it means a name is only compared with the
+# known names it shares trigrams with. The score is the Dice coefficient of the two sets of trigrams,
+# 1 when the name keys are the same (i.e. Ltd vs Limited or a name with the asset type added by AlphaVantage).
+
+# matches with a score below this are sent to the Concordance API,
+# it must be above the .75 confidence score that formatting_and_saving treats as unmapped
+match_threshold = 0.9
+ngram_size = 3
+# trigrams in more known names than this (i.e. "ing" or "co ") are too common to be useful for finding candidates
+max_postings = 2000
+# numbers and roman numerals tell apart companies with otherwise the same name, i.e. SPACs like Acme Acquisition Corp II
+# only well-formed roman numerals of at least 2 letters are numbers, so words like "i" or "vix" aren't
+number_pattern = re.compile(r'\b(?:\d+|(?=[ivxlc]{2,}\b)m*(?:c[md]|d?c{0,3})(?:x[cl]|l?x{0,3})(?:i[xv]|v?i{0,3}))(?!\w)')
+
+
+def match_keys(s: pd.Series) -> pd.Series:
+    # AlphaVantage names have the asset class added, i.e. Acme Corp Class A Common Stock
+    keys = name_keys(remove_asset_types(s))
+    return keys.where(keys != '')
+
+
+def ngrams(key: str) -> set:
+    # names are padded so the first and last letters are part of as many trigrams as the rest
+    padded = f" {key} "
+    return {padded[i:i + ngram_size] for i in range(max(len(padded) - ngram_size + 1, 1))}
+
+
+def numbers(key: str) -> frozenset:
+    return frozenset(number_pattern.findall(key))
+
+
+def load_known_names(conn) -> pd.DataFrame:
+    """
+    Returns every company name with an iconum in entity_mapping and PEO-PIPE.
+    The entity names returned by the Concordance API are included as known names as well.
+
+    :param conn: database connection
+    :return: data frame with company_name, entityname, iconum and entity_id columns
+    """
+    frames = []
+    if inspect(conn).has_table('entity_mapping'):
+        df_em = pd.read_sql_query(text("""
+        SELECT company_name, entityname, iconum, entity_id
+        FROM entity_mapping
+        WHERE iconum IS NOT NULL
+        ORDER BY confidencescore DESC NULLS LAST
+        """), conn)
+        frames.extend([df_em, df_em.assign(company_name=df_em['entityname'])])
+    if inspect(conn).has_table('peo_pipe'):
+        df_pp = pd.read_sql_query(text("""
+        SELECT DISTINCT company_name, company_name AS entityname, iconum
+        FROM peo_pipe
+        WHERE iconum IS NOT NULL AND company_name IS NOT NULL
+        """), conn)
+        df_pp['entity_id'] = iconums_to_entity_ids(df_pp['iconum'])
+        frames.append(df_pp)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=['company_name', 'entityname', 'iconum', 'entity_id'])
+    return pd.concat(frames, ignore_index=True)
+
+
+class NameMatcher:
+    def __init__(self, df_known: pd.DataFrame, threshold: float = match_threshold):
+        """
+        :param df_known: data frame with company_name, entityname, iconum and entity_id columns,
+            when a name key appears more than once the first row is used
+        :param threshold: lowest score that counts as a match
+        """
+        self.threshold = threshold
+        df_known = df_known.dropna(subset=['company_name', 'iconum'])
+        df_known = df_known.assign(match_key=match_keys(df_known['company_name'])).dropna(subset=['match_key'])
+        self.df_known = df_known.drop_duplicates(subset='match_key').reset_index(drop=True)
+        self.keys = dict(zip(self.df_known['match_key'], self.df_known.index))
+        self.grams = [ngrams(k) for k in self.df_known['match_key']]
+        self.numbers = [numbers(k) for k in self.df_known['match_key']]
+        self.index = defaultdict(list)
+        for i, grams in enumerate(self.grams):
+            for gram in grams:
+                self.index[gram].append(i)
+
+    def best_match(self, key: str):
+        """
+        Finds the known name most similar to a name key.
+
+        :param key: match key of the name
+        :return: tuple of the row in df_known and the score, (None, 0) if nothing scores above the threshold
+        """
+        if key in self.keys:
+            return self.keys[key], 1.0
+        grams = ngrams(key)
+        key_numbers = numbers(key)
+        # a Dice score of at least the threshold is only possible if the number of trigrams is close enough
+        min_len = len(grams) * self.threshold / (2 - self.threshold)
+        max_len = len(grams) * (2 - self.threshold) / self.threshold
+        candidates = set()
+        for gram in grams:
+            postings = self.index.get(gram, [])
+            if len(postings) <= max_postings:
+                candidates.update(postings)
+        best, best_score = None, 0
+        for i in candidates:
+            if not min_len <= len(self.grams[i]) <= max_len or self.numbers[i] != key_numbers:
+                continue
+            score = 2 * len(grams & self.grams[i]) / (len(grams) + len(self.grams[i]))
+            if score > best_score:
+                best, best_score = i, score
+        if best_score < self.threshold:
+            return None, 0
+        return best, best_score
+
+    def match(self, names: pd.Series) -> pd.DataFrame:
+        """
+        Matches a column of company names to the known names.
+
+        :param names: series of company names
+        :return: data frame with the same index as names for the names that matched, with the matched_name,
+            entityname, iconum, entity_id and score columns
+        """
+        matches = {}
+        for idx, key in match_keys(names).dropna().items():
+            i, score = self.best_match(key)
+            if i is not None:
+                matches[idx] = (i, score)
+        if len(matches) == 0:
+            return pd.DataFrame(columns=['matched_name', 'entityname', 'iconum', 'entity_id', 'score'])
+        rows = [i for i, _ in matches.values()]
+        df = self.df_known.loc[rows, ['company_name', 'entityname', 'iconum', 'entity_id']]
+        df = df.rename(columns={'company_name': 'matched_name'}).set_index(pd.Index(list(matches.keys())))
+        df['score'] = [round(score, 4) for _, score in matches.values()]
+        return df
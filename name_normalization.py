@@ -0,0 +1,127 @@
+import re
+import pandas as pd
+from sqlalchemy import text
+from pg_connection import transaction
+
+# Company name clean-up used by the transformation, entity mapping, comparison and RPD stages.
+# The rules are compiled once and only applied to the unique names in a column,
+# the results are then mapped back onto the full column.
+
+# AlphaVantage adds the asset type to the company name
+# they are removed one after the other in this order, i.e. ' ETF Trust' is removed before ' ETF'
+asset_types = [' ETF Trust', ' ETF', ' Units', ' Unit', ' Warrants to purchase ', ' Warrants', ' Warrant', ' Rights',
+               ' Class A Common Stock', ' Class A Ordinary Shares', ' Class A Ordinary Share',
+               ' Subordinate Voting Shares', ' American Depository Shares', ' American Depositary Shares',
+               ' Common Stock', ' Common Shares', ' Ordinary Shares']
+# characters and legal suffixes removed when creating the key used to match company names
+# the suffixes are removed in a single pass, the same as the formatted company name in rpd_creation used to be
+key_punctuation = '.,()\\/'
+key_suffixes = [r'\slimited$', r'\sltd', r'\ssa$', r'\sa/s$', r'\sinc$']
+
+
+def compile_rules(rules: list, ignore_case: bool = False) -> re.Pattern:
+    """
+    Compiles a list of regular expressions into one pattern that matches any of them.
+
+    :param rules: list of regular expressions
+    :param ignore_case: bool for matching regardless of case
+    :return: compiled pattern
+    """
+    return re.compile('|'.join(f"(?:{r})" for r in rules), re.IGNORECASE if ignore_case else 0)
+
+
+asset_type_patterns = [re.compile(re.escape(a), re.IGNORECASE) for a in asset_types]
+# JPX separates words with commas without a space and marks technical listings with **
+jpx_pattern = re.compile(r',|\*\*')
+jpx_replacements = {',': ', ', '**': ''}
+parenthetical_pattern = re.compile(r'\s\(.*\)')
+key_suffix_pattern = compile_rules(key_suffixes, ignore_case=True)
+key_translation = str.maketrans('', '', key_punctuation)
+
+
+def map_unique(s: pd.Series, func) -> pd.Series:
+    """
+    Applies a function to the unique strings in a series and maps the results back to every row.
+    Values that aren't strings become NaN, the same as the pandas str methods.
+
+    :param s: pandas series of names
+    :param func: function that takes and returns a string
+    :return: pandas series
+    """
+    mapping = {v: func(v) for v in s.dropna().unique() if isinstance(v, str)}
+    return s.map(mapping)
+
+
+def remove_asset_type(name: str) -> str:
+    for pattern in asset_type_patterns:
+        name = pattern.sub('', name)
+    return name
+
+
+def remove_asset_types(s: pd.Series) -> pd.Series:
+    return map_unique(s, remove_asset_type)
+
+
+def format_jpx_names(s: pd.Series) -> pd.Series:
+    return map_unique(s, lambda v: jpx_pattern.sub(lambda m: jpx_replacements[m.group(0)], v).strip())
+
+
+def remove_parentheticals(s: pd.Series) -> pd.Series:
+    return map_unique(s, lambda v: parenthetical_pattern.sub('', v))
+
+
+def remove_commas(s: pd.Series) -> pd.Series:
+    return map_unique(s, lambda v: v.replace(',', ''))
+
+
+def name_key(name: str) -> str:
+    """
+    Returns the key used to match company names from different sources,
+    lowercase without punctuation or legal suffixes (i.e. Limited, Ltd, SA, Inc).
+    """
+    return key_suffix_pattern.sub('', name.lower().translate(key_translation)).strip()
+
+
+def name_keys(s: pd.Series) -> pd.Series:
+    return map_unique(s, name_key)
+
+
+def add_name_key_column(conn, table: str, index: bool = True):
+    """
+    Adds the name_key column filled by update_name_keys and its index. This takes a lock on the whole table,
+    so it is only run when the table is created or replaced (i.e. create_db_tables, a full build of all_ipos).
+    Run it inside a transaction.
+
+    :param conn: database connection
+    :param table: table with company names
+    :param index: if False the column isn't indexed (i.e. entity_mapping has a unique index on name_key)
+    :return: None
+    """
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS name_key TEXT"))
+    if index:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {table}_name_key_idx ON {table} (name_key)"))
+
+
+def update_name_keys(conn, table: str, name_col: str = 'company_name'):
+    """
+    Caches the name key in the database by filling the name_key column for rows that don't have one yet.
+    The column is added by add_name_key_column.
+
+    :param conn: database connection
+    :param table: table with company names
+    :param name_col: column with the company names
+    :return: None
+    """
+    with transaction(conn):
+        df = pd.read_sql_query(f"SELECT DISTINCT {name_col} FROM {table} "
+                               f"WHERE name_key IS NULL AND {name_col} IS NOT NULL", conn)
+        if len(df) == 0:
+            return
+        df['name_key'] = name_keys(df[name_col])
+        df.to_sql(f"{table}_name_keys", conn, if_exists='replace', index=False)
+        conn.execute(text(f"""
+        UPDATE {table} t SET name_key = k.name_key
+        FROM {table}_name_keys k
+        WHERE t.{name_col} = k.{name_col} AND t.name_key IS NULL
+        """))
+        conn.execute(text(f"DROP TABLE {table}_name_keys"))
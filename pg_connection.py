@@ -1,7 +1,9 @@
 import os
 import re
 import configparser
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
 from typing import Union
 from pandas.core.indexes.base import Index
 from sqlalchemy import types as sql_types
@@ -13,13 +15,174 @@ def convert_cols_db(col_list: Union[list, Index]) -> list:
     return [rc.sub('', col).lower().replace(' ', '_') for col in col_list]
 
 
+# engines are kept for each database so connections are taken from the engine's pool instead of opening a new
+# connection every time, which matters when the stages run repeatedly in the same process (scheduler_daemon.py)
+engines = {}
+
+
+def pg_engine(database: str = 'ipo_monitoring'):
+    if database not in engines.keys():
+        parent_folder = os.path.dirname(os.getcwd())
+        pg_config = configparser.ConfigParser()
+        pg_config.read(os.path.join(parent_folder, 'postgres_db.ini'))
+        un = pg_config.get(database, 'user')
+        pw = pg_config.get(database, 'password')
+        host = pg_config.get(database, 'host')
+        db = pg_config.get(database, 'database')
+        # pre ping replaces connections the server closed while they were in the pool
+        engines[database] = create_engine(f"postgresql+psycopg2://{un}:{pw}@{host}:5432/{db}", pool_pre_ping=True)
+    return engines[database]
+
+
 def pg_connection(database: str = 'ipo_monitoring'):
-    parent_folder = os.path.dirname(os.getcwd())
-    pg_config = configparser.ConfigParser()
-    pg_config.read(os.path.join(parent_folder, 'postgres_db.ini'))
-    un = pg_config.get(database, 'user')
-    pw = pg_config.get(database, 'password')
-    host = pg_config.get(database, 'host')
-    db = pg_config.get(database, 'database')
-    engine = create_engine(f"postgresql+psycopg2://{un}:{pw}@{host}:5432/{db}")
-    return engine.connect()
+    return pg_engine(database).connect()
+
+
+@contextmanager
+def transaction(conn):
+    """
+    Commits everything executed inside the block, or rolls it back if there is an error.
+    With SQLAlchemy 2 the first statement on a connection (even a read) begins a transaction, so conn.begin() can't
+    be used once the connection has been used. In that case the transaction that is already open is committed.
+
+    :param conn: database connection
+    """
+    if not conn.in_transaction():
+        with conn.begin():
+            yield conn
+        return
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def dependent_views(conn, table: str) -> list:
+    """
+    Returns the views and materialized views that use a table, directly or through other views.
+    Views come after the views they use, so they can be recreated in order and dropped in reverse order.
+
+    :param conn: database connection
+    :param table: name of the table
+    :return: list of dictionaries with the name, kind ('v' or 'm'), definition and indexes of each view
+    """
+    df = pd.read_sql_query(text("""
+    WITH RECURSIVE deps AS (
+        SELECT r.ev_class AS view_oid, 1 AS depth
+        FROM pg_depend d
+        INNER JOIN pg_rewrite r ON r.oid = d.objid
+        WHERE d.classid = CAST('pg_rewrite' AS regclass) AND d.refobjid = CAST(:table AS regclass)
+            AND r.ev_class <> d.refobjid
+        UNION
+        SELECT r.ev_class, deps.depth + 1
+        FROM deps
+        INNER JOIN pg_depend d ON d.refobjid = deps.view_oid
+        INNER JOIN pg_rewrite r ON r.oid = d.objid
+        WHERE d.classid = CAST('pg_rewrite' AS regclass) AND r.ev_class <> d.refobjid
+    )
+    SELECT c.relname AS name, c.relkind AS kind, pg_get_viewdef(c.oid) AS definition, MAX(deps.depth) AS depth
+    FROM deps
+    INNER JOIN pg_class c ON c.oid = deps.view_oid
+    GROUP BY c.oid, c.relname, c.relkind
+    ORDER BY depth
+    """), conn, params={'table': table})
+    views = df[['name', 'kind', 'definition']].to_dict('records')
+    for view in views:
+        view['indexes'] = [] if view['kind'] != 'm' else conn.execute(
+            text("SELECT indexdef FROM pg_indexes WHERE tablename = :name"), {'name': view['name']}).scalars().all()
+    return views
+
+
+def replace_table_contents(df, table: str, conn, dtype: dict = None):
+    """
+    Replaces the rows in an existing table without dropping it, so views that depend on the table are kept.
+    Columns in the data frame that aren't in the table yet are added as text columns (or the type given in dtype).
+    Existing columns are changed to the type given in dtype if they have a different type, the views that depend on
+    the table are dropped and recreated around the change because Postgres can't change columns used by a view.
+    If the table doesn't exist it is created with to_sql.
+
+    :param df: data frame with the new contents of the table
+    :param table: name of the table
+    :param conn: database connection
+    :param dtype: optional dictionary of column names and sqlalchemy types, same as to_sql
+    :return: None
+    """
+    dtype = dtype or {}
+    if not inspect(conn).has_table(table):
+        with transaction(conn):
+            df.to_sql(table, conn, if_exists='replace', index=False, dtype=dtype)
+        return
+    existing_cols = {c['name']: c['type'] for c in inspect(conn).get_columns(table)}
+    col_types = {}
+    for col in df.columns:
+        col_type = dtype.get(col, sql_types.Text)
+        col_types[col] = col_type() if isinstance(col_type, type) else col_type
+    # i.e. a column stored as text before a type was declared for it, the rows are replaced below
+    changed_cols = [col for col in df.columns if col in existing_cols.keys() and col in dtype.keys()
+                    and existing_cols[col]._type_affinity is not col_types[col]._type_affinity]
+    with transaction(conn):
+        # the rows are replaced, deleting them first means the casts below can't fail on values that aren't numbers
+        conn.execute(text(f'DELETE FROM {table}'))
+        views = []
+        if changed_cols:
+            # only a change to a column's type needs the views to be dropped, adding a column doesn't
+            if conn.dialect.name == 'postgresql':
+                views = dependent_views(conn, table)
+            for view in reversed(views):
+                conn.execute(text(f"DROP {'MATERIALIZED VIEW' if view['kind'] == 'm' else 'VIEW'} {view['name']}"))
+            for col in changed_cols:
+                col_type = col_types[col].compile(dialect=conn.dialect)
+                conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN "{col}" TYPE {col_type} '
+                                  f'USING "{col}"::{col_type}'))
+        for col in [c for c in df.columns if c not in existing_cols.keys()]:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN "{col}" {col_types[col].compile(dialect=conn.dialect)}'))
+        df.to_sql(table, conn, if_exists='append', index=False, dtype=dtype)
+        for view in views:
+            kind = 'MATERIALIZED VIEW' if view['kind'] == 'm' else 'VIEW'
+            # the definitions are run as they are, text() would treat a colon in a string literal as a parameter
+            conn.exec_driver_sql(f"CREATE {kind} {view['name']} AS {view['definition'].rstrip().rstrip(';')}")
+            for index in view['indexes']:
+                conn.exec_driver_sql(index)
+
+
+# types that can be declared for source columns in source_reference, stored natively rather than as text
+column_type_mapping = {
+    'int': sql_types.BigInteger,
+    'float': sql_types.Float,
+    'date': sql_types.Date,
+    'str': sql_types.Text
+}
+
+
+def apply_column_types(df, column_types: dict):
+    """
+    Converts the columns of a data frame to the types declared for the source.
+    Numbers can have commas as thousands separators and dollar signs, values that can't be converted are set to null.
+
+    :param df: data frame from the source
+    :param column_types: dictionary of column names and types in column_type_mapping
+    :return: data frame with converted columns
+    """
+    for col, col_type in column_types.items():
+        if col not in df.columns:
+            continue
+        if col_type in ('int', 'float'):
+            if not pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col].astype(str).str.replace(r'[,\s\$]', '', regex=True), errors='coerce')
+            if col_type == 'int' and (df[col].dropna() % 1 == 0).all():
+                df[col] = df[col].astype('Int64')
+        elif col_type == 'date':
+            if not pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = pd.to_datetime(df[col], errors='coerce')
+        elif col_type == 'str':
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def column_sql_types(column_types: dict) -> dict:
+    """
+    Returns the sqlalchemy types for declared column types, used as dtype for to_sql.
+    """
+    return {col: column_type_mapping[col_type] for col, col_type in column_types.items()}
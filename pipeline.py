@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import hashlib
+from datetime import datetime, date
+from time import perf_counter
+from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Optional, Union, TYPE_CHECKING
+from logging_ipo_dates import logger, log_folder
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Runs the stages in main.py in dependency order, stages that don't depend on each other run at the same time.
+# A stage with declared inputs is skipped when its inputs are the same as the last time it ran successfully.
+# Inputs are given as 'table:<table name>', 'file:<path>' or 'date' (so a stage runs at least once a day).
+# Table inputs are raw tables, they are checked with their row count and latest time_added and time_removed.
+# Stages without inputs get their data from outside sources (websites, APIs, termcond) so they always run.
+# A stage's function can be given as 'module.function', the module is only imported when the stage runs so starting a
+# run (or a run where most stages are skipped) doesn't import pandas, selenium etc. for every stage up front.
+# Each run has a run ID and the status of each stage and the data frames a stage puts in the run context (its outputs)
+# are saved in Logs/Checkpoints/<run ID> when the stage finishes. Resuming a run only runs the stages that failed or
+# didn't finish and the stages that depend on them, the other stages' outputs are loaded from the checkpoint.
+
+checkpoint_folder = os.path.join(log_folder, 'Checkpoints')
+
+
+class Stage:
+    def __init__(self, name: str, func: Union[Callable, str], depends_on: list = None,
+                 inputs: Optional[Union[list, Callable]] = None, outputs: list = None, kwargs: dict = None):
+        """
+        :param name: name of the stage
+        :param func: function that runs the stage or its name, i.e. 'website_scraping.main'
+        :param depends_on: names of stages that have to finish before this stage starts
+        :param inputs: list of inputs or a function returning the list, None if the stage should always run
+        :param outputs: names of the data frames the stage puts in the run context, saved in the checkpoint
+        :param kwargs: keyword arguments passed to the function
+        """
+        self.name = name
+        self.func = func
+        self.depends_on = depends_on or []
+        self.inputs = inputs
+        self.outputs = outputs or []
+        self.kwargs = kwargs or {}
+
+    def run(self):
+        func = self.func
+        if isinstance(func, str):
+            module, _, func_name = func.rpartition('.')
+            func = getattr(import_module(module), func_name)
+        return func(**self.kwargs)
+
+    def input_list(self) -> Optional[list]:
+        return self.inputs() if callable(self.inputs) else self.inputs
+
+
+def table_fingerprint(conn, table: str) -> Optional[str]:
+    """
+    Returns a fingerprint of a raw table without reading its contents. Rows are only added (time_added) or marked as
+    removed (time_removed) when a source is scraped, the row count catches rows deleted i.e. by remove_db_dupes.
+    """
+    from sqlalchemy import text
+    query = f"SELECT COUNT(*), MAX(time_added), MAX(time_removed) FROM {table}"
+    try:
+        return '|'.join(str(v) for v in conn.execute(text(query)).one())
+    except Exception as e:
+        logger.warning(f"Unable to get fingerprint for {table} - {e}")
+        return None
+
+
+def file_fingerprint(file: str) -> Optional[str]:
+    if not os.path.exists(file):
+        return None
+    md5 = hashlib.md5()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def fingerprint(inputs: list) -> Optional[str]:
+    """
+    Returns a fingerprint for all of the inputs or None if one of the inputs can't be checked.
+    """
+    values = []
+    conn = None
+    try:
+        for i in inputs:
+            kind, _, name = i.partition(':')
+            if kind == 'table':
+                from pg_connection import pg_connection
+                conn = conn or pg_connection()
+                value = table_fingerprint(conn, name)
+            elif kind == 'file':
+                value = file_fingerprint(name)
+            elif kind == 'date':
+                value = date.today().isoformat()
+            else:
+                raise ValueError(f"{i} is not a valid input, use table:, file: or date")
+            if value is None:
+                return None
+            values.append(f"{i}={value}")
+    finally:
+        if conn is not None:
+            conn.close()
+    return hashlib.md5('|'.join(values).encode()).hexdigest()
+
+
+def latest_run_id(folder: str = checkpoint_folder) -> Optional[str]:
+    if not os.path.exists(folder):
+        return None
+    run_ids = sorted(r for r in os.listdir(folder) if os.path.exists(os.path.join(folder, r, 'run.json')))
+    return run_ids[-1] if len(run_ids) > 0 else None
+
+
+class Pipeline:
+    def __init__(self, stages: list, max_workers: int = 4, state_file: str = None, timings_file: str = None,
+                 checkpoints: str = checkpoint_folder):
+        self.stages = {s.name: s for s in stages}
+        for s in stages:
+            missing = [d for d in s.depends_on if d not in self.stages.keys()]
+            assert len(missing) == 0, f"{s.name} depends on unknown stages {', '.join(missing)}"
+        self.max_workers = max_workers
+        self.state_file = state_file or os.path.join(log_folder, 'pipeline_state.json')
+        self.timings_file = timings_file or os.path.join(log_folder, 'Pipeline Timings.csv')
+        self.checkpoints = checkpoints
+        self.state = self.load_state()
+        self.time_started = datetime.utcnow()
+        self.run_id = self.time_started.strftime('%Y%m%dT%H%M%S')
+        self.run_folder = os.path.join(self.checkpoints, self.run_id)
+        self.resumed_from = None
+        self.results = {}
+
+    def load_state(self) -> dict:
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def save_state(self):
+        with open(self.state_file, 'w') as f:
+            json.dump(self.state, f, indent=2)
+
+    def downstream(self, names: set) -> set:
+        """
+        Returns the stages given and all of the stages that depend on them directly or indirectly.
+        """
+        names = set(names)
+        added = True
+        while added:
+            dependents = {s.name for s in self.stages.values() if set(s.depends_on) & names}
+            added = len(dependents - names) > 0
+            names |= dependents
+        return names
+
+    def checkpoint(self, result: dict):
+        """
+        Saves the outputs of a stage that finished and the status of every stage that has finished in this run.
+        """
+        from run_context import context
+        stage = self.stages[result['stage']]
+        stage_folder = os.path.join(self.run_folder, stage.name)
+        os.makedirs(stage_folder, exist_ok=True)
+        if result['status'] in ('success', 'skipped', 'restored'):
+            for name in stage.outputs:
+                df = context.get(name)
+                if df is not None:
+                    df.to_pickle(os.path.join(stage_folder, f"{name}.pkl"))
+        with open(os.path.join(self.run_folder, 'run.json'), 'w') as f:
+            json.dump({'run_id': self.run_id, 'resumed_from': self.resumed_from,
+                       'stages': {k: v['status'] for k, v in self.results.items()}}, f, indent=2)
+
+    def restore(self, run_id: str) -> set:
+        """
+        Loads the outputs of the stages that finished in a previous run into the run context.
+
+        :param run_id: ID of the run to resume
+        :return: names of the stages that don't need to run again
+        """
+        import pandas as pd
+        from run_context import context
+        with open(os.path.join(self.checkpoints, run_id, 'run.json'), 'r') as f:
+            previous = json.load(f).get('stages', {})
+        not_finished = {s for s in self.stages.keys() if previous.get(s) not in ('success', 'skipped', 'restored')}
+        finished = set(self.stages.keys()) - self.downstream(not_finished)
+        for name in finished:
+            stage_folder = os.path.join(self.checkpoints, run_id, name)
+            for output in self.stages[name].outputs:
+                file = os.path.join(stage_folder, f"{output}.pkl")
+                if os.path.exists(file):
+                    context.put(output, pd.read_pickle(file))
+        return finished
+
+    def run_stage(self, stage: Stage) -> dict:
+        start = perf_counter()
+        result = {'stage': stage.name, 'time_started': datetime.utcnow().isoformat(), 'status': 'success',
+                  'error': None}
+        fp = None
+        try:
+            inputs = stage.input_list()
+            if inputs is not None:
+                fp = fingerprint(inputs)
+                if fp is not None and fp == self.state.get(stage.name, {}).get('fingerprint'):
+                    result['status'] = 'skipped'
+            if result['status'] != 'skipped':
+                stage.run()
+        except Exception as e:
+            logger.error(f"Stage {stage.name} failed")
+            logger.error(e, exc_info=sys.exc_info())
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        result['seconds'] = round(perf_counter() - start, 2)
+        if result['status'] == 'success':
+            # fingerprint from before the stage ran, if the inputs changed while it ran it will run again next time
+            self.state[stage.name] = {'fingerprint': fp, 'last_success': result['time_started']}
+        logger.info(f"Stage {stage.name} {result['status']} in {result['seconds']} seconds")
+        return result
+
+    def run(self, resume: bool = False) -> 'pd.DataFrame':
+        """
+        Runs every stage once its dependencies have finished. A failed stage doesn't stop the stages after it,
+        the same as running each stage in its own try and except block.
+
+        :param resume: if True only the stages that failed in the last run and the stages after them are run
+        :return: data frame with the status and time taken for each stage
+        """
+        pending = dict(self.stages)
+        running = {}
+        if resume:
+            self.resumed_from = latest_run_id(self.checkpoints)
+            if self.resumed_from is None:
+                logger.info("No previous run to resume, running all stages")
+            else:
+                finished = self.restore(self.resumed_from)
+                logger.info(f"Resuming run {self.resumed_from}, {len(finished)} of {len(self.stages)} stages restored")
+                for name in finished:
+                    self.results[name] = {'stage': name, 'time_started': datetime.utcnow().isoformat(),
+                                          'status': 'restored', 'error': None, 'seconds': 0}
+                    self.checkpoint(self.results[name])
+                    del pending[name]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                ready = [s for s in pending.values() if all(d in self.results.keys() for d in s.depends_on)]
+                for s in ready:
+                    running[executor.submit(self.run_stage, s)] = s.name
+                    del pending[s.name]
+                if not running:
+                    raise RuntimeError(f"Unable to run {', '.join(pending.keys())}, check dependencies for cycles")
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    self.results[running.pop(future)] = result
+                    self.checkpoint(result)
+        self.save_state()
+        return self.save_timings()
+
+    def save_timings(self) -> 'pd.DataFrame':
+        import pandas as pd
+        df = pd.DataFrame(list(self.results.values()))
+        df.insert(0, 'run_started', self.time_started.isoformat())
+        df.insert(0, 'run_id', self.run_id)
+        df.to_csv(self.timings_file, mode='a', header=not os.path.exists(self.timings_file), index=False,
+                  encoding='utf-8-sig')
+        return df
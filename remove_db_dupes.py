@@ -1,15 +1,13 @@
 import os
 import pandas as pd
 import json
-from pg_connection import pg_connection, sql_types
+from pg_connection import pg_connection, sql_types, replace_table_contents
 
 sources_file = os.path.join(os.getcwd(), 'sources.json')
 if os.path.exists(sources_file):
     with open(sources_file, 'r') as f:
         sources = json.load(f)
 
-conn = pg_connection()
-
 tables_with_dupes = {
     'source_asx_raw': {
         'time_added': sql_types.DateTime,
@@ -37,13 +35,18 @@ tables_with_dupes = {
     }
 }
 
-for tbl, dt in tables_with_dupes.items():
-    df = pd.read_sql_table(tbl, conn)
-    len_original = len(df)
-    df.drop_duplicates(inplace=True)
-    len_new = len(df)
-    if len_new != len_original:
-        print(f"{tbl} - {len_original - len_new} duplicate rows, {len_new} rows remain")
-        df.to_sql(tbl, conn, if_exists='replace', index=False, dtype=dt)
+def main():
+    conn = pg_connection()
+    for tbl, dt in tables_with_dupes.items():
+        df = pd.read_sql_table(tbl, conn)
+        len_original = len(df)
+        df.drop_duplicates(inplace=True)
+        len_new = len(df)
+        if len_new != len_original:
+            print(f"{tbl} - {len_original - len_new} duplicate rows, {len_new} rows remain")
+            replace_table_contents(df, tbl, conn, dtype=dt)
+    conn.close()
+
 
-conn.close()
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,8 @@ from time import sleep
 from collections import defaultdict
 from pg_connection import pg_connection, convert_cols_db, sql_types
 from logging_ipo_dates import logger, error_email
+from name_normalization import name_keys
+from run_context import context, coerce_types
 
 pd.options.mode.chained_assignment = None
 
@@ -25,24 +27,29 @@ class RPDCreation:
         self.session = self.create_session()
         self.headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
         self.base_url = 'https://rpd-api.factset.com/'
-        self.df_ipo = self.return_formatted_df_from_file(self.source_file)
-        self.df_wd = self.return_formatted_df_from_file(self.wd_file)
+        self.df_ipo = self.return_formatted_df_from_file(self.source_file, 'IPO Monitoring Data')
+        self.df_wd = self.return_formatted_df_from_file(self.wd_file, 'Withdrawn IPOs')
         self.df_rpd = self.rpd_data_frame()
         self.df = self.create_main_data_frame()
         self.rpd_cols = ['iconum', 'cusip', 'Company Name', 'ticker', 'exchange', 'IPO Date', 'Price', 'Price Range', 'status', 'notes', 'Last Checked', 'IPO Deal ID']
 
     @staticmethod
-    def return_formatted_df_from_file(file: str):
+    def return_formatted_df_from_file(file: str, context_name: str = None):
         """
         Takes a file as input, creates a data frame from that file, does some clean-up and formatting.
         Used to create a data frame from IPO and withdrawn IPO files created in data_comparison.
+        If data_comparison ran in the same process the data frame is taken from the run context instead of the file.
         Data from sources takes precedence over internal data since it should be more up-to-date.
 
         :param file: os path of the file that will be turned into a dataframe
+        :param context_name: name of the data frame in the run context
         :return:
         """
-        df = pd.read_excel(file, dtype={'iconum': str, 'ticker': str},
-                           parse_dates=['ipo_date', 'time_added', 'time_removed', 'trading_date', 'last_updated_date_utc'])
+        date_cols = ['ipo_date', 'time_added', 'time_removed', 'trading_date', 'last_updated_date_utc']
+        if context_name and context.has(context_name):
+            df = coerce_types(context.get(context_name), str_cols=['iconum', 'ticker'], date_cols=date_cols)
+        else:
+            df = pd.read_excel(file, dtype={'iconum': str, 'ticker': str}, parse_dates=date_cols)
         df.rename(columns={'company_name_external': 'Company Name', 'price_external': 'Price', 'ipo_date': 'IPO Date',
                            'client_deal_id': 'IPO Deal ID', 'time_added': 'Last Checked', 'price_range': 'Price Range',
                            'exchange_external': 'exchange'
@@ -53,10 +60,7 @@ class RPDCreation:
             df[col].fillna(df[fill_val], inplace=True)
         df = df[['iconum', 'cusip', 'Company Name', 'ticker', 'exchange', 'IPO Date', 'Price', 'Price Range',
                  'status', 'notes', 'Last Checked', 'IPO Deal ID']]
-        df['formatted company name'] = df['Company Name'].str.lower()
-        df['formatted company name'] = df['formatted company name'].str.replace(r"([\.\,\(\)\\\/])", "", regex=True)
-        df['formatted company name'] = df['formatted company name'].str.replace(r"(\slimited$|\sltd|\ssa$|\sa/s$|\sinc$)", "", regex=True, case=False)
-        df['formatted company name'] = df['formatted company name'].str.strip()
+        df['formatted company name'] = name_keys(df['Company Name'])
         return df
 
     def create_session(self) -> requests.Session:
@@ -372,7 +376,7 @@ class RPDCreation:
                            'RPD Link',
                            'RPD Creation Date',
                            'RPD Status']]
-        self.df.to_excel(self.result_file, index=False)
+        context.put('IPO Monitoring RPDs', self.df, self.result_file)
         conn = pg_connection()
         try:
             self.df.columns = convert_cols_db(self.df.columns)
@@ -429,6 +433,7 @@ def main():
     except Exception as e:
         logger.error(e, exc_info=sys.exc_info())
         error_email(str(e))
+        raise
 
 
 if __name__ == '__main__':
@@ -0,0 +1,65 @@
+import threading
+from typing import Optional
+import pandas as pd
+from excel_export import save_excel
+
+# Data frames passed between stages that run in the same process (i.e. from main.py).
+# A stage puts the frames it creates in the context and the next stage gets them from there instead of reading the
+# file the first stage saved. Saving the frames to Excel is kept as an optional sink for people using the files
+# and for stages that run on their own, which read the files when the frame isn't in the context.
+# There is one context for the process, so only one pipeline run can use it at a time. A process that starts runs
+# from more than one thread (i.e. scheduler_daemon) holds run_lock for the whole run, including clearing the context.
+
+
+class RunContext:
+    def __init__(self, export_files: bool = True):
+        self.export_files = export_files
+        self.frames = {}
+
+    def put(self, name: str, df: pd.DataFrame, file: Optional[str] = None, **excel_kwargs):
+        """
+        Adds a data frame to the context and saves it to a file if a file is given and export_files is True.
+
+        :param name: name other stages use to get the data frame
+        :param df: data frame
+        :param file: optional Excel file
+        :param excel_kwargs: sheet_name and freeze_panes passed to save_excel
+        :return: None
+        """
+        # copies are kept and returned so one stage can't change the data another stage gets
+        self.frames[name] = df.copy()
+        if file and self.export_files:
+            save_excel(df, file, **excel_kwargs)
+
+    def get(self, name: str) -> Optional[pd.DataFrame]:
+        df = self.frames.get(name)
+        return df.copy() if df is not None else None
+
+    def has(self, name: str) -> bool:
+        return name in self.frames.keys()
+
+    def clear(self):
+        self.frames = {}
+
+
+def str_col(s: pd.Series) -> pd.Series:
+    """
+    Converts a column to strings the same way read_excel(dtype=str) does, i.e. 12345.0 becomes '12345'.
+    Null values stay null.
+    """
+    return s.map(lambda v: str(int(v)) if isinstance(v, float) and v.is_integer() else str(v), na_action='ignore')
+
+
+def coerce_types(df: pd.DataFrame, str_cols: list = None, date_cols: list = None) -> pd.DataFrame:
+    """
+    Gives a data frame from the context the same types it would have if it was read from the Excel file.
+    """
+    for c in [col for col in str_cols or [] if col in df.columns]:
+        df[c] = str_col(df[c])
+    for c in [col for col in date_cols or [] if col in df.columns]:
+        df[c] = pd.to_datetime(df[c], errors='coerce')
+    return df
+
+
+context = RunContext()
+run_lock = threading.Lock()
@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from logging_ipo_dates import logger, consolidate_webscraping_results
+from pipeline import Pipeline
+from run_context import context, run_lock
+import website_scraping
+import email_report
+from main import pipeline_stages
+
+# Runs IPO monitoring in one long running process instead of starting main.py from a batch file for each run.
+# Imports, the db connection pools (pg_connection.engines), the browser and config are kept between runs.
+# Each event in the schedule has a lock so a run is skipped if the previous run of the same event hasn't finished,
+# different events (i.e. the email report while the websites are being scraped) can run at the same time.
+# Pipeline runs also hold run_context.run_lock, so two runs never share the run context.
+
+schedule_file = os.path.join(os.getcwd(), 'resources', 'schedule.csv')
+time_zones = {
+    'London': 'Europe/London',
+    'New York': 'America/New_York',
+    'Hong Kong': 'Asia/Hong_Kong'
+}
+
+
+def read_schedule(location: str = 'London', file: str = schedule_file) -> pd.DataFrame:
+    """
+    Reads the schedule and returns the event and time of each run for the location given.
+
+    :param location: column in the schedule, London, New York or Hong Kong
+    :param file: schedule csv file
+    :return: data frame with event and run_time columns
+    """
+    df = pd.read_csv(file, dtype=str, encoding='utf-8-sig')
+    df = df[['Event', location]].rename(columns={'Event': 'event', location: 'run_time'})
+    df['run_time'] = pd.to_datetime(df['run_time'], format='%H:%M').dt.time
+    return df.drop_duplicates().reset_index(drop=True)
+
+
+def next_run(run_time, tz: ZoneInfo, now: datetime) -> datetime:
+    run = datetime.combine(now.date(), run_time, tzinfo=tz)
+    if run <= now:
+        run = datetime.combine(now.date() + timedelta(days=1), run_time, tzinfo=tz)
+    return run
+
+
+class SchedulerDaemon:
+    def __init__(self, location: str = 'London', headless: bool = True, max_workers: int = 2):
+        self.tz = ZoneInfo(time_zones[location])
+        self.schedule = read_schedule(location)
+        self.headless = headless
+        self.wd = None
+        self.locks = {e: threading.Lock() for e in self.schedule['event'].unique()}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.events = {
+            'website scraping and RPD creation': self.run_pipeline,
+            'email report to PEO-PIPE': email_report.send_report
+        }
+
+    def driver(self) -> website_scraping.WebDriver:
+        # the browser is opened on the first run and kept open, if it has crashed a new one is opened
+        try:
+            if self.wd is not None:
+                _ = self.wd.driver.current_url
+        except Exception as e:
+            logger.warning(f"Browser is not responding, opening a new one - {e}")
+            self.wd = None
+        if self.wd is None:
+            self.wd = website_scraping.WebDriver(headless=self.headless)
+        return self.wd
+
+    def run_pipeline(self):
+        # the run context is shared by the process, a second run waits instead of clearing the frames of this one
+        with run_lock:
+            logger.info('-' * 100)
+            # frames from the previous run aren't reused, i.e. PEO-PIPE data is pulled again
+            context.clear()
+            Pipeline(pipeline_stages(wd=self.driver())).run()
+            consolidate_webscraping_results()
+            logger.info('-' * 100)
+
+    def run_event(self, event: str):
+        lock = self.locks[event]
+        if not lock.acquire(blocking=False):
+            logger.warning(f"Skipping {event}, the previous run hasn't finished")
+            return
+        try:
+            logger.info(f"Starting {event}")
+            self.events[event]()
+        except Exception as e:
+            logger.error(f"ERROR for {event}")
+            logger.error(e, exc_info=sys.exc_info())
+        finally:
+            lock.release()
+
+    def upcoming(self) -> list:
+        now = datetime.now(self.tz)
+        runs = [(next_run(r.run_time, self.tz, now), r.event) for r in self.schedule.itertuples()]
+        return sorted(runs)
+
+    def run_forever(self, check_seconds: int = 60):
+        logger.info(f"Scheduler started, {len(self.schedule)} scheduled runs each day")
+        try:
+            while True:
+                runs = self.upcoming()
+                run_at = runs[0][0]
+                wait_seconds = (run_at - datetime.now(self.tz)).total_seconds()
+                # sleeps in short steps so changes to the system clock or daylight saving time don't delay a run
+                if wait_seconds > check_seconds:
+                    time.sleep(check_seconds)
+                    continue
+                time.sleep(max(wait_seconds, 0))
+                for event in [e for t, e in runs if t == run_at]:
+                    self.executor.submit(self.run_event, event)
+                # next_run only returns times after now, so the same runs aren't started twice
+                time.sleep(1)
+        finally:
+            self.executor.shutdown(wait=True)
+            if self.wd is not None:
+                self.wd.close_down()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs IPO monitoring on the schedule in resources/schedule.csv')
+    parser.add_argument('--location', default='London', choices=list(time_zones.keys()),
+                        help='column of the schedule with the local times of the runs')
+    parser.add_argument('--run-now', action='store_true', help='run the pipeline once before waiting for the schedule')
+    args = parser.parse_args()
+
+    sd = SchedulerDaemon(location=args.location)
+    if args.run_now:
+        sd.run_event('website scraping and RPD creation')
+    sd.run_forever()
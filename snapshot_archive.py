@@ -0,0 +1,96 @@
+import os
+import sys
+from datetime import datetime, date
+from typing import Optional, Union
+import pandas as pd
+from logging_ipo_dates import logger
+
+# Parquet archive of the data from each run, kept outside the database so history can be queried without it.
+# Files are saved in hive style partitions, one folder per source (raw table name or all_ipos) and run date
+# i.e. Archive/source=source_nyse_raw/run_date=2021-05-14/20210514T1530.parquet
+archive_folder = os.path.join(os.getcwd(), 'Archive')
+
+
+def partition_folder(source: str, run_date: Union[date, str], folder: str = archive_folder) -> str:
+    run_date = run_date.isoformat() if isinstance(run_date, date) else run_date
+    return os.path.join(folder, f"source={source}", f"run_date={run_date}")
+
+
+def archive_frame(df: pd.DataFrame, source: str, time_checked: datetime = None, folder: str = archive_folder):
+    """
+    Saves a data frame to the archive. Errors saving the file are logged rather than raised,
+    but pyarrow not being installed is raised so a missing archive doesn't go unnoticed.
+    Partitions older than file_management.archive_retention_days are deleted by file_management.
+
+    :param df: data frame to save
+    :param source: raw table name or all_ipos
+    :param time_checked: time of the run, used for the run date partition and the file name
+    :param folder: archive folder
+    :return: None
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError("pyarrow is needed for the Parquet archive, install the packages in requirements.txt") from e
+    time_checked = time_checked or datetime.utcnow()
+    try:
+        df = df.copy()
+        # Parquet columns need one type, columns with i.e. numbers and text are saved as text
+        for c in df.columns[df.dtypes == object]:
+            df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+        partition = partition_folder(source, time_checked.date(), folder)
+        os.makedirs(partition, exist_ok=True)
+        df.to_parquet(os.path.join(partition, time_checked.strftime('%Y%m%dT%H%M%S') + '.parquet'), index=False)
+    except Exception as e:
+        logger.warning(f"Unable to archive {source} - {e}")
+        logger.debug(e, exc_info=sys.exc_info())
+
+
+def partition_values(path: str, key: str) -> list:
+    prefix = f"{key}="
+    if not os.path.exists(path):
+        return []
+    return sorted([d[len(prefix):] for d in os.listdir(path) if d.startswith(prefix)])
+
+
+def read_archive(sources: Optional[list] = None, start_date: Union[date, str] = None, end_date: Union[date, str] = None,
+                 columns: Optional[list] = None, folder: str = archive_folder) -> pd.DataFrame:
+    """
+    Reads data from the archive. Only the partitions for the sources and dates requested are read
+    and only the columns requested are loaded from each file.
+
+    :param sources: list of sources (raw table names or all_ipos), all sources if None
+    :param start_date: first run date to include
+    :param end_date: last run date to include
+    :param columns: list of columns, all columns if None
+    :param folder: archive folder
+    :return: data frame with source and run_date columns added
+    """
+    import pyarrow.parquet as pq
+    start_date = start_date.isoformat() if isinstance(start_date, date) else start_date
+    end_date = end_date.isoformat() if isinstance(end_date, date) else end_date
+    frames = []
+    for source in partition_values(folder, 'source'):
+        if sources is not None and source not in sources:
+            continue
+        source_folder = os.path.join(folder, f"source={source}")
+        for run_date in partition_values(source_folder, 'run_date'):
+            # run dates are ISO formatted so they can be compared as strings
+            if (start_date and run_date < start_date) or (end_date and run_date > end_date):
+                continue
+            partition = partition_folder(source, run_date, folder)
+            for f in sorted(os.listdir(partition)):
+                file = os.path.join(partition, f)
+                file_cols = None
+                if columns is not None:
+                    file_cols = [c for c in columns if c in pq.read_schema(file).names]
+                    if len(file_cols) == 0:
+                        # the source doesn't have any of the columns, reading it would only add empty rows
+                        continue
+                df = pd.read_parquet(file, columns=file_cols)
+                df['source'] = source
+                df['run_date'] = run_date
+                frames.append(df)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=(columns or []) + ['source', 'run_date'])
+    return pd.concat(frames, ignore_index=True, sort=False)
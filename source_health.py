@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+import numpy as np
+import pandas as pd
+import requests
+from sqlalchemy import types as sql_types
+from pg_connection import transaction
+from logging_ipo_dates import logger, log_folder
+
+# Tracks whether each source is working while the sources are being scraped.
+# Errors that are usually temporary (timeouts, dropped connections) are retried with a growing wait between attempts.
+# Selenium errors aren't retried, they are mostly missing elements that are still missing 10 seconds later. The waits
+# for all sources in a run add up to at most max_retry_wait_seconds, after that errors fail straight away.
+# After failure_threshold failures in a row the source's circuit is opened and the source is skipped, it is only
+# tried again (a probe) once the probe interval has passed. The probe interval doubles each time a probe fails.
+# A success closes the circuit again.
+
+health_table = 'source_health'
+results_file = os.path.join(log_folder, 'Webscraping Results.csv')
+transient_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+retries = 2
+retry_wait_seconds = 10
+max_retry_wait_seconds = 60
+failure_threshold = 5
+probe_interval_hours = 6
+max_probe_interval_hours = 48
+# number of recent latencies kept for each source to calculate the percentiles
+num_latencies = 50
+
+
+class SourceFailure(Exception):
+    """Raised when a source returns no data where data is expected, i.e. an API response that isn't ok"""
+
+
+class SourceHealth:
+    def __init__(self, conn, time_checked: datetime = None):
+        """
+        :param conn: database connection
+        :param time_checked: time of the run, used for the results log so the results of a run are grouped together
+        """
+        self.conn = conn
+        self.time_checked = time_checked or datetime.utcnow()
+        self.health = self.load_health()
+        self.results = []
+        self.retry_wait_seconds = 0
+
+    def load_health(self) -> dict:
+        try:
+            df = pd.read_sql_table(health_table, self.conn)
+        except ValueError:
+            # table doesn't exist yet
+            return {}
+        df['latencies'] = df['latencies'].apply(lambda x: json.loads(x) if isinstance(x, str) else [])
+        df = df.replace({np.nan: None, pd.NaT: None})
+        return df.set_index('source').to_dict(orient='index')
+
+    def source_health(self, source: str) -> dict:
+        if source not in self.health.keys():
+            self.health[source] = {'status': 'closed', 'failure_streak': 0, 'last_success': None,
+                                   'last_failure': None, 'next_probe': None, 'last_error': None, 'latencies': []}
+        return self.health[source]
+
+    def allow(self, source: str, now: datetime = None) -> bool:
+        """
+        Returns False if the source's circuit is open and it isn't time to probe the source yet.
+        """
+        h = self.source_health(source)
+        if h['status'] != 'open':
+            return True
+        now = now or datetime.utcnow()
+        if h['next_probe'] is None or now >= pd.Timestamp(h['next_probe']).to_pydatetime():
+            logger.info(f"Probing {source}, it has failed {h['failure_streak']} times in a row")
+            return True
+        logger.info(f"Skipping {source} until {h['next_probe']}, it has failed {h['failure_streak']} times in a row")
+        return False
+
+    def call(self, source: str, func: Callable, none_is_failure: bool = False):
+        """
+        Runs the function that gets the data from a source, retrying temporary errors, and records the result.
+
+        :param source: name of the source
+        :param func: function that returns the data from the source
+        :param none_is_failure: if True a function returning None is recorded as a failure
+        :return: the data returned by the function, the last error is raised if every attempt failed
+        """
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                result = func()
+                if result is None and none_is_failure:
+                    raise SourceFailure(f"No data returned for {source}")
+                self.record(source, True, time.perf_counter() - start)
+                return result
+            except transient_errors as e:
+                wait_seconds = retry_wait_seconds * 2 ** attempt
+                if attempt < retries and self.retry_wait_seconds + wait_seconds <= max_retry_wait_seconds:
+                    self.retry_wait_seconds += wait_seconds
+                    logger.warning(f"{source} attempt {attempt + 1} failed, retrying in {wait_seconds} seconds - {e}")
+                    time.sleep(wait_seconds)
+                    continue
+                self.record(source, False, time.perf_counter() - start, e)
+                raise
+            except Exception as e:
+                self.record(source, False, time.perf_counter() - start, e)
+                raise
+
+    def record(self, source: str, success: bool, seconds: float, error: Exception = None):
+        now = datetime.utcnow()
+        h = self.source_health(source)
+        h['latencies'] = (h['latencies'] + [round(seconds, 3)])[-num_latencies:]
+        self.results.append({'source': source, 'time_checked': self.time_checked, 'result': int(success)})
+        if success:
+            if h['status'] == 'open':
+                logger.info(f"{source} is working again after {h['failure_streak']} failures")
+            h.update({'status': 'closed', 'failure_streak': 0, 'last_success': now, 'next_probe': None})
+            return
+        h['failure_streak'] += 1
+        h['last_failure'] = now
+        h['last_error'] = str(error)[:500]
+        if h['failure_streak'] >= failure_threshold:
+            hours = min(probe_interval_hours * 2 ** (h['failure_streak'] - failure_threshold),
+                        max_probe_interval_hours)
+            if h['status'] != 'open':
+                logger.warning(f"{source} has failed {h['failure_streak']} times in a row, skipping it for {hours} hours")
+            h.update({'status': 'open', 'next_probe': now + timedelta(hours=hours)})
+
+    def summary(self) -> pd.DataFrame:
+        df = pd.DataFrame.from_dict(self.health, orient='index').rename_axis('source').reset_index()
+        df['latency_p50'] = df['latencies'].apply(lambda x: np.percentile(x, 50) if len(x) > 0 else np.nan)
+        df['latency_p95'] = df['latencies'].apply(lambda x: np.percentile(x, 95) if len(x) > 0 else np.nan)
+        df['latencies'] = df['latencies'].apply(json.dumps)
+        return df
+
+    def save(self):
+        if len(self.results) > 0:
+            df_results = pd.DataFrame(self.results)
+            df_results.to_csv(results_file, mode='a', header=not os.path.exists(results_file), index=False,
+                              encoding='utf-8-sig')
+        if len(self.health) == 0:
+            return
+        try:
+            with transaction(self.conn):
+                self.summary().to_sql(health_table, self.conn, if_exists='replace', index=False, dtype={
+                    'last_success': sql_types.DateTime,
+                    'last_failure': sql_types.DateTime,
+                    'next_probe': sql_types.DateTime
+                })
+        except Exception as e:
+            logger.error(e, exc_info=sys.exc_info())
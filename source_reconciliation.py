@@ -0,0 +1,67 @@
+import pandas as pd
+from name_normalization import name_keys
+
+# special characters removed from tickers before comparing them, i.e. BRK.A and BRKA are the same symbol
+special_chars = r"(\.|'|\*)"
+
+
+def normalize_symbols(s: pd.Series) -> pd.Series:
+    return s.str.replace(special_chars, "", regex=True)
+
+
+class SourceReconciler:
+    """
+    Combines the data from several sources covering the same exchanges.
+    Sources are added tier by tier in order of precedence. Every source in a tier is kept, a source in a later tier
+    only adds rows where none of the earlier tiers has a row with the same key.
+    The keys already added are kept in sets so each source is only compared against the index, not the combined data.
+
+    Keys can be 'symbol' (ticker without special characters) or 'name' (normalized company name and exchange).
+    A row is a duplicate if any of the keys matches. Missing keys (i.e. no ticker) never match.
+    """
+    key_types = ['symbol', 'name']
+
+    def __init__(self, tiers: list, keys: list = None):
+        self.tiers = tiers
+        self.keys = keys if keys is not None else ['symbol']
+        assert all(k in self.key_types for k in self.keys), f"Keys must be in {', '.join(self.key_types)}"
+        self.index = {k: set() for k in self.keys}
+        self.frames = []
+
+    @staticmethod
+    def key_values(df: pd.DataFrame, key: str) -> pd.Series:
+        if key == 'symbol':
+            return normalize_symbols(df['ticker'])
+        keys = name_keys(df['company_name'])
+        return (keys + '|' + df['exchange'].fillna('').astype(str)).where(keys.notna())
+
+    def new_rows(self, df: pd.DataFrame) -> pd.Series:
+        """
+        Returns a boolean series that is True for the rows with keys that aren't in the index yet.
+        """
+        is_new = pd.Series(True, index=df.index)
+        for k in self.keys:
+            is_new &= ~self.key_values(df, k).isin(self.index[k])
+        return is_new
+
+    def insert(self, df: pd.DataFrame):
+        for k in self.keys:
+            self.index[k].update(self.key_values(df, k).dropna().tolist())
+        self.frames.append(df)
+
+    def combine(self, frames: dict) -> pd.DataFrame:
+        """
+        Combines the data from each source in order of precedence.
+
+        :param frames: dict with the source name as key and the source's dataframe as the value
+        :return: dataframe with the rows kept from every source
+        """
+        for tier in self.tiers:
+            # sources in the same tier are only compared with earlier tiers, not with each other
+            tier_frames = [frames[src] for src in tier if src in frames.keys()]
+            tier_frames = [df.loc[self.new_rows(df)] for df in tier_frames]
+            for df in tier_frames:
+                self.insert(df)
+        if len(self.frames) == 0:
+            return pd.DataFrame()
+        return pd.concat(self.frames, ignore_index=True, sort=False)
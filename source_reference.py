@@ -1,19 +1,18 @@
 import json
+import copy
 import pandas as pd
 import configparser
 from pg_connection import pg_connection, sql_types
 from logging_ipo_dates import logger
 import sys
 
-config = configparser.ConfigParser()
-config.read('api_key.ini')
-
 website_sources = {
     'NYSE': {
         'source_type': 'website',
         'exchange': 'NYSE',
         'rank': 1,
         'location': 'New York',
+        'refresh': 'intraday',
         'url': 'https://www.nyse.com/ipo-center/filings',
         'table_num': 0,
         'table_elem': 'table',
@@ -37,6 +36,7 @@ website_sources = {
             'shares_offered',
             'price_range'
         ],
+        'column_types': {'ticker': 'str', 'ipo_date': 'date', 'shares_offered': 'int', 'deal_size': 'float'},
         'column_names_as_row': False,
         'file': 'NYSE',
         'db_table_raw': 'source_nyse_raw',
@@ -47,6 +47,7 @@ website_sources = {
         'exchange': 'NYSE',
         'rank': 1,
         'location': 'New York',
+        'refresh': 'daily',
         'url': 'https://www.nyse.com/ipo-center/filings',
         'table_num': 3,
         'table_elem': 'table',
@@ -69,6 +70,7 @@ website_sources = {
             'shares_offered',
             'status'
         ],
+        'column_types': {'ticker': 'str', 'postponement_date': 'date', 'shares_offered': 'int', 'deal_size': 'float'},
         'column_names_as_row': False,
         'file': 'NYSE Withdrawn',
         'db_table_raw': 'source_nyse_withdrawn_raw',
@@ -79,6 +81,7 @@ website_sources = {
         'exchange': 'NASDAQ',
         'rank': 2,
         'location': 'New York',
+        'refresh': 'intraday',
         'url': 'https://www.nasdaq.com/market-activity/ipos?tab=upcoming',
         'table_num': 2,
         'table_elem': 'tbody',
@@ -101,6 +104,7 @@ website_sources = {
             'ipo_date',
             'deal_size'
         ],
+        'column_types': {'ticker': 'str', 'ipo_date': 'date', 'shares_offered': 'int', 'deal_size': 'float'},
         'column_names_as_row': False,
         'file': 'Nasdaq',
         'db_table_raw': 'source_nasdaq_raw',
@@ -111,6 +115,7 @@ website_sources = {
         'exchange': 'NASDAQ',
         'rank': 2,
         'location': 'New York',
+        'refresh': 'intraday',
         'url': 'https://www.nasdaq.com/market-activity/ipos?tab=upcoming',
         'table_num': 4,
         'table_elem': 'tbody',
@@ -134,6 +139,7 @@ website_sources = {
             'deal_size',
             'status'
         ],
+        'column_types': {'ticker': 'str', 'ipo_date': 'date', 'shares_offered': 'int', 'deal_size': 'float'},
         'column_names_as_row': False,
         'file': 'Nasdaq Priced',
         'db_table_raw': 'source_nasdaq_priced_raw',
@@ -144,6 +150,7 @@ website_sources = {
         'exchange': 'NASDAQ',
         'rank': 2,
         'location': 'New York',
+        'refresh': 'daily',
         'url': 'https://www.nasdaq.com/market-activity/ipos?tab=upcoming',
         'table_num': 8,
         'table_elem': 'tbody',
@@ -166,6 +173,8 @@ website_sources = {
             'deal_size',
             'cancellation_date'
         ],
+        'column_types': {'ticker': 'str', 'announcement_date': 'date', 'cancellation_date': 'date', 'shares_offered': 'int',
+                         'deal_size': 'float'},
         'column_names_as_row': False,
         'file': 'Nasdaq Withdrawn',
         'db_table_raw': 'source_nasdaq_withdrawn_raw',
@@ -176,6 +185,7 @@ website_sources = {
         'exchange': 'Japan Exchange Group',
         'rank': 3,
         'location': 'Tokyo',
+        'refresh': 'daily',
         'url': 'https://www.jpx.co.jp/english/listing/stocks/new/',
         'table_num': 0,
         'table_elem': 'table',
@@ -395,6 +405,8 @@ website_sources = {
             'industry',
             'underwriters'
         ],
+        'column_types': {'ticker': 'str', 'ipo_date': 'date', 'shares_outstanding': 'int', 'par_value': 'int',
+                         'price': 'int'},
         'column_names_as_row': False,
         'file': 'KRX',
         'db_table_raw': 'source_krx_raw',
@@ -430,6 +442,7 @@ website_sources = {
             'price',
             'note'
         ],
+        'column_types': {'ticker': 'str'},
         'column_names_as_row': False,
         'file': 'TWSE',
         'db_table_raw': 'source_twse_raw',
@@ -463,6 +476,7 @@ website_sources = {
             'listing_type',
             'observations'
         ],
+        'column_types': {'shares_offered': 'float', 'deal_size': 'float', 'volume': 'float'},
         'column_names_as_row': False,
         'file': 'BME',
         'db_table_raw': 'source_bme_raw',
@@ -603,6 +617,7 @@ website_sources = {
         'exchange': 'NYSE and Nasdaq',
         # 'rank': None
         'location': 'New York',
+        'refresh': 'intraday',
         'url': 'https://www.iposcoop.com/ipo-calendar/',
         'table_num': 0,
         'table_elem': 'table',
@@ -748,10 +763,11 @@ other_sources = {
         'source_type': 'API',
         'exchange': 'NYSE and Nasdaq',
         'location': 'New York',
+        'refresh': 'intraday',
         'endpoint': 'https://www.alphavantage.co/query',
         'parameters': {
-            'function': 'IPO_CALENDAR',
-            'apikey': config.get('AV', 'key')
+            # apikey is added from api_key.ini by with_api_keys
+            'function': 'IPO_CALENDAR'
         },
         'rename_columns': {
             'symbol': 'ticker',
@@ -768,6 +784,7 @@ other_sources = {
         'source_type': 'API',
         'exchange': 'Spotlight',
         'location': 'Stockholm',
+        'refresh': 'daily',
         'endpoint': 'http://api.spotlightstockmarket.com/v1/listing',
         'rename_columns': {
             'Id': 'num',
@@ -794,6 +811,7 @@ other_sources = {
         'source_type': 'special_case_website',
         'exchange': 'Japan Exchange Group',
         'location': 'Tokyo',
+        'refresh': 'daily',
         'url': 'http://www.tokyoipo.com/top/iposche/index.php?j_e=E',
         'file': 'TokyoIPO',
         'db_table_raw': 'source_tkipo_raw',
@@ -803,6 +821,7 @@ other_sources = {
         'source_type': 'ftp',
         'exchange': 'TSX and TSX Venture',
         'location': 'Toronto',
+        'refresh': 'daily',
         'url': 'tmxdatalinx.com',
         'file': 'TMX',
         'db_table_raw': 'source_tmx_raw',
@@ -1164,6 +1183,58 @@ unused_sources = {
 }
 
 
+# How often each source is scraped, sources without 'refresh' use the standard tier.
+# Intervals are in minutes, trading_hours are the local hours (in the source's location) on weekdays when the
+# min_interval is used, outside those hours the off_hours_interval is used. Each time a source is scraped and the
+# data hasn't changed the interval is doubled, up to the max_interval.
+refresh_tiers = {
+    'intraday': {
+        'min_interval': 60,
+        'trading_hours': ('06:00', '20:00'),
+        'off_hours_interval': 360,
+        'max_interval': 360
+    },
+    'standard': {
+        'min_interval': 180,
+        'trading_hours': ('07:00', '19:00'),
+        'off_hours_interval': 720,
+        'max_interval': 1440
+    },
+    'daily': {
+        'min_interval': 1440,
+        'trading_hours': None,
+        'off_hours_interval': 1440,
+        'max_interval': 4320
+    }
+}
+
+# sources covering several cities (i.e. Euronext) use the time zone of the first city in their location
+location_time_zones = {
+    'New York': 'America/New_York',
+    'Toronto': 'America/Toronto',
+    'London': 'Europe/London',
+    'Amsterdam': 'Europe/Amsterdam',
+    'Frankfurt': 'Europe/Berlin',
+    'Madrid': 'Europe/Madrid',
+    'Milan': 'Europe/Rome',
+    'Copenhagen': 'Europe/Copenhagen',
+    'Stockholm': 'Europe/Stockholm',
+    'Sweden': 'Europe/Stockholm',
+    'Nordic': 'Europe/Stockholm',
+    'Mumbai': 'Asia/Kolkata',
+    'Jakarta': 'Asia/Jakarta',
+    'Kuala Lumpur': 'Asia/Kuala_Lumpur',
+    'Singapore': 'Asia/Singapore',
+    'Hong Kong': 'Asia/Hong_Kong',
+    'Shanghai': 'Asia/Shanghai',
+    'Shenzhen': 'Asia/Shanghai',
+    'Taipei': 'Asia/Taipei',
+    'Seoul': 'Asia/Seoul',
+    'Tokyo': 'Asia/Tokyo',
+    'Sydney': 'Australia/Sydney'
+}
+
+
 def return_sources(source_type: str = 'all') -> dict:
     """
     Returns a dictionary sources specified by the source_type.
@@ -1182,13 +1253,29 @@ def return_sources(source_type: str = 'all') -> dict:
         return dict(**website_sources, **other_sources)
 
 
+def with_api_keys(sources: dict) -> dict:
+    """
+    Returns a copy of the sources with the API keys from api_key.ini added to their parameters.
+    The keys are read here rather than on import so the source details can be used without api_key.ini.
+
+    :param sources: dictionary of sources
+    :return: dictionary of sources with the API keys
+    """
+    config = configparser.ConfigParser()
+    config.read('api_key.ini')
+    sources = copy.deepcopy(sources)
+    if 'AlphaVantage' in sources.keys():
+        sources['AlphaVantage']['parameters']['apikey'] = config.get('AV', 'key')
+    return sources
+
+
 def create_json_file(file_name: str = 'sources', source_type: str = 'all'):
     with open(file_name + '.json', 'w') as f:
-        json.dump(return_sources(source_type), f)
+        json.dump(with_api_keys(return_sources(source_type)), f)
 
 
 def create_source_ref(file_name: str = 'sources'):
-    ex_dict = return_sources(source_type='all')
+    ex_dict = with_api_keys(return_sources(source_type='all'))
     df = pd.DataFrame(ex_dict).transpose()
     if file_name != '':
         df.to_csv(file_name + '.csv', index_label='source')
@@ -1203,7 +1290,7 @@ def create_source_ref(file_name: str = 'sources'):
                 icell = row['cell_elem']
                 if type(icell) == list:
                     df.loc[i, 'cell_elem'] = ', '.join(icell)
-            dict_cols = ['table_attrs', 'header_attrs', 'parameters', 'rename_columns']
+            dict_cols = ['table_attrs', 'header_attrs', 'parameters', 'rename_columns', 'column_types']
             dtype_mapping = {dc: sql_types.JSON for dc in dict_cols}
             df.to_sql('ref_sources', conn, if_exists='replace', index_label='source_name', dtype=dtype_mapping)
         except Exception as e:
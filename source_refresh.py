@@ -0,0 +1,91 @@
+import sys
+from datetime import datetime, timedelta, time
+from typing import Optional
+from zoneinfo import ZoneInfo
+import pandas as pd
+from sqlalchemy import types as sql_types
+from pg_connection import transaction
+from logging_ipo_dates import logger
+from excel_export import frame_digest
+from source_reference import refresh_tiers, location_time_zones
+
+# Decides which sources are due to be scraped using the refresh tiers in source_reference.
+# The time each source was last checked, a digest of the data and the number of checks in a row where the data
+# didn't change are kept in the source_refresh_state table.
+
+state_table = 'source_refresh_state'
+# runs start at a random time within a couple of minutes, so a source is due a little before its interval is up
+grace_minutes = 15
+
+
+def in_trading_hours(trading_hours: Optional[tuple], location: str, now: datetime) -> bool:
+    if trading_hours is None:
+        return False
+    tz = location_time_zones.get(location) or location_time_zones.get(location.split(',')[0].strip())
+    if tz is None:
+        logger.warning(f"No time zone for {location}, using UTC for its trading hours")
+    local_now = now.astimezone(ZoneInfo(tz)) if tz else now
+    start, end = [time.fromisoformat(t) for t in trading_hours]
+    return local_now.weekday() < 5 and start <= local_now.time() <= end
+
+
+class SourceRefresh:
+    def __init__(self, conn, force: bool = False):
+        """
+        :param conn: database connection
+        :param force: if True every source is due, i.e. for a backfill
+        """
+        self.conn = conn
+        self.force = force
+        self.state = self.load_state()
+
+    def load_state(self) -> dict:
+        try:
+            df = pd.read_sql_table(state_table, self.conn)
+        except ValueError:
+            # table doesn't exist yet
+            return {}
+        df['last_checked'] = pd.to_datetime(df['last_checked'], utc=True)
+        return df.set_index('source').to_dict(orient='index')
+
+    def interval(self, source: str, details: dict, now: datetime) -> timedelta:
+        tier = refresh_tiers.get(details.get('refresh', 'standard'), refresh_tiers['standard'])
+        if in_trading_hours(tier['trading_hours'], details.get('location', ''), now):
+            minutes = tier['min_interval']
+        else:
+            minutes = tier['off_hours_interval']
+        unchanged = int(self.state.get(source, {}).get('unchanged_count', 0))
+        minutes = max(min(minutes * 2 ** unchanged, tier['max_interval']), minutes)
+        return timedelta(minutes=minutes)
+
+    def is_due(self, source: str, details: dict, now: datetime = None) -> bool:
+        if self.force or source not in self.state.keys():
+            return True
+        now = now or datetime.now(ZoneInfo('UTC'))
+        last_checked = self.state[source]['last_checked']
+        if pd.isna(last_checked):
+            return True
+        next_check = last_checked + self.interval(source, details, now) - timedelta(minutes=grace_minutes)
+        return now >= next_check
+
+    def record(self, source: str, df: pd.DataFrame, now: datetime = None):
+        """
+        Records that a source was checked, if the data is the same as the last check the source will be checked less
+        often until it changes.
+        """
+        now = now or datetime.now(ZoneInfo('UTC'))
+        digest = frame_digest(df.drop(columns=['time_checked'], errors='ignore'))
+        previous = self.state.get(source, {})
+        unchanged = int(previous.get('unchanged_count', 0)) + 1 if previous.get('digest') == digest else 0
+        self.state[source] = {'last_checked': now, 'digest': digest, 'unchanged_count': unchanged}
+
+    def save(self):
+        if len(self.state) == 0:
+            return
+        df = pd.DataFrame.from_dict(self.state, orient='index').rename_axis('source').reset_index()
+        try:
+            with transaction(self.conn):
+                df.to_sql(state_table, self.conn, if_exists='replace', index=False,
+                          dtype={'last_checked': sql_types.DateTime(timezone=True)})
+        except Exception as e:
+            logger.error(e, exc_info=sys.exc_info())
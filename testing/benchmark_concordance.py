@@ -0,0 +1,117 @@
+"""
+End to end benchmark for entity mapping using the Concordance API stand-in in testing/concordance_stub.py.
+Runs create_csv -> submit_tasks -> process_tasks (which saves the decisions with formatting_and_saving) for synthetic
+unmapped company names and reports the time for each step.
+
+The flow needs Postgres (the cache and entity_mapping use upserts), so the benchmark needs a scratch database.
+all_ipos, entity_mapping, entity_resolution_cache, concordance_pending_tasks and concordance_tasks are REPLACED in
+that database.
+
+Run from the project folder, i.e.
+python -m testing.benchmark_concordance --database-url postgresql+psycopg2://user:pw@localhost:5432/scratch --names 100 5000
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+from time import perf_counter
+import pandas as pd
+from sqlalchemy import create_engine, text, types as sql_types
+import pg_connection
+import entity_mapping
+from entity_mapping import EntityMatchBulk, mapping_cols, pending_table, tasks_table
+from entity_cache import cache_table, create_cache_table
+from create_db_tables import create_mapping_key
+from name_normalization import name_keys
+from testing.concordance_stub import ConcordanceStub
+
+words = ['Alpha', 'Blue', 'Capital', 'Digital', 'Energy', 'Global', 'Green', 'Health', 'Micro', 'Nova', 'Ocean',
+         'Pacific', 'Quantum', 'Solar', 'Tech', 'Vertex']
+suffixes = ['Inc.', 'Ltd', 'Limited', 'SA', 'Holdings, Inc.', 'Corp', 'Acquisition Corp']
+exchanges = ['NYSE', 'NASDAQ', 'Tokyo Stock Exchange', 'Hong Kong Stock Exchange', 'ASX']
+
+
+def seed_tables(conn, num_names: int, seed: int = 0):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    df = pd.DataFrame({
+        'company_name': [f"{' '.join(rng.sample(words, 2))} {i} {rng.choice(suffixes)}" for i in range(num_names)],
+        'ticker': [f"T{i}" for i in range(num_names)],
+        'exchange': [rng.choice(exchanges) for _ in range(num_names)],
+        'time_added': [now - timedelta(minutes=i) for i in range(num_names)]
+    })
+    df['name_key'] = name_keys(df['company_name'])
+    with pg_connection.transaction(conn):
+        for tbl in [cache_table, pending_table, tasks_table, 'entity_mapping']:
+            conn.execute(text(f"DROP TABLE IF EXISTS {tbl}"))
+        df.to_sql('all_ipos', conn, if_exists='replace', index=False, dtype={'time_added': sql_types.DateTime})
+        pd.DataFrame(columns=mapping_cols).to_sql('entity_mapping', conn, index=False, dtype={
+            c: sql_types.BIGINT if c == 'iconum' else sql_types.FLOAT if c.endswith('score') else sql_types.Text
+            for c in mapping_cols})
+        create_cache_table(conn)
+    # the one time set up of a database, the runs don't create the unique index or the cache table
+    create_mapping_key(conn)
+
+
+def run_benchmark(database_url: str, sizes: list, stub_args: dict, max_task_size: int) -> pd.DataFrame:
+    # every pg_connection() in entity mapping uses the scratch database
+    pg_connection.engines['ipo_monitoring'] = create_engine(database_url, pool_pre_ping=True)
+    entity_mapping.max_task_size = max_task_size
+    results = []
+    for size in sizes:
+        conn = pg_connection.pg_connection()
+        try:
+            seed_tables(conn, size)
+        finally:
+            conn.close()
+        with ConcordanceStub(**stub_args) as stub:
+            em = EntityMatchBulk(url=stub.url, authorization=('user', 'key'))
+            timings = {'names': size}
+            start = perf_counter()
+            em.create_csv(recheck_all=True)
+            timings['create_csv'] = perf_counter() - start
+            start = perf_counter()
+            eids = em.submit_tasks()
+            timings['submit_tasks'] = perf_counter() - start
+            start = perf_counter()
+            em.process_tasks(eids)
+            timings['process_tasks'] = perf_counter() - start
+            timings['total'] = timings['create_csv'] + timings['submit_tasks'] + timings['process_tasks']
+            timings['tasks'] = len(eids)
+            timings['requests'] = sum(stub.requests.values())
+            timings['errors'] = stub.errors
+        conn = pg_connection.pg_connection()
+        try:
+            timings['rows_saved'] = conn.execute(text("SELECT COUNT(*) FROM entity_mapping")).scalar()
+        finally:
+            conn.close()
+        timings['names_per_second'] = size / timings['total']
+        results.append(timings)
+    return pd.DataFrame(results).round(3)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark entity mapping against the Concordance API stand-in')
+    parser.add_argument('--database-url', required=True, help='SQLAlchemy URL of a scratch Postgres database')
+    parser.add_argument('--names', type=int, nargs='+', default=[100, 1000, 10000], help='number of unmapped names')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every API response')
+    parser.add_argument('--task-seconds', type=float, default=2, help='seconds before each task is finished')
+    parser.add_argument('--task-seconds-per-name', type=float, default=0.001,
+                        help='seconds added to each task for every name in it')
+    parser.add_argument('--failure-rate', type=float, default=0, help='share of API requests that fail')
+    parser.add_argument('--rate-limit-rate', type=float, default=0, help='share of submissions that get a 429')
+    parser.add_argument('--max-task-size', type=int, default=entity_mapping.max_task_size,
+                        help='maximum number of names in each task')
+    parser.add_argument('--output', help='optional csv file for the results')
+    args = parser.parse_args()
+    df_results = run_benchmark(args.database_url, args.names, {
+        'latency': args.latency,
+        'task_seconds': args.task_seconds,
+        'task_seconds_per_name': args.task_seconds_per_name,
+        'failure_rate': args.failure_rate,
+        'rate_limit_rate': args.rate_limit_rate,
+        'retry_after': 1
+    }, args.max_task_size)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(df_results)
+    if args.output:
+        df_results.to_csv(args.output, index=False)
@@ -0,0 +1,51 @@
+"""
+Benchmark for converting between iconums and entity IDs, comparing the vectorized functions in entity_codec with
+the functions in EntityMatchBulk applied to each value with Series.map (how formatting_and_saving converted them).
+
+Run from the project folder, i.e. python -m testing.benchmark_entity_codec --sizes 1000 100000 1000000
+"""
+import argparse
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from entity_codec import max_iconum, iconums_to_entity_ids, entity_ids_to_iconums
+from entity_mapping import EntityMatchBulk
+
+
+def measure(results: list, size: int, step: str, func):
+    start = perf_counter()
+    value = func()
+    results.append({'size': size, 'step': step, 'seconds': round(perf_counter() - start, 4)})
+    return value
+
+
+def run_benchmark(sizes: list) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    results = []
+    for size in sizes:
+        iconums = pd.Series(rng.integers(0, max_iconum + 1, size=size))
+        ids_scalar = measure(results, size, 'iconum to entity ID (map)',
+                             lambda: iconums.map(EntityMatchBulk.iconum_to_entity_id))
+        ids_vector = measure(results, size, 'iconum to entity ID (vectorized)', lambda: iconums_to_entity_ids(iconums))
+        assert ids_scalar.tolist() == ids_vector.tolist()
+        measure(results, size, 'entity ID to iconum (map)',
+                lambda: ids_vector.map(EntityMatchBulk.entity_id_to_iconum, na_action='ignore'))
+        measure(results, size, 'entity ID to iconum (vectorized)', lambda: entity_ids_to_iconums(ids_vector))
+    df = pd.DataFrame(results)
+    df['method'] = df['step'].str.extract(r'\((\w+)\)')
+    df['conversion'] = df['step'].str.replace(r'\s\(\w+\)', '', regex=True)
+    df = df.pivot_table(index=['size', 'conversion'], columns='method', values='seconds').reset_index()
+    df['speedup'] = (df['map'] / df['vectorized']).round(1)
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the vectorized iconum and entity ID conversion')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000], help='number of values')
+    parser.add_argument('--output', help='optional csv file for the results')
+    args = parser.parse_args()
+    df_results = run_benchmark(args.sizes)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(df_results)
+    if args.output:
+        df_results.to_csv(args.output, index=False)
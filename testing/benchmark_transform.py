@@ -0,0 +1,220 @@
+"""
+Manual benchmark for DataTransformation using synthetic raw tables. It is not a test, unittest only discovers
+test*.py modules so it isn't run with the tests. testing/test_sql_transformation uses the same raw tables.
+
+Raw tables are generated with the columns each source has in source_reference, every listing is repeated across
+the history depth the same way the raw tables grow when a source is scraped every day.
+Columns with types declared in source_reference are stored with those types, the same as the scraped raw tables.
+Time and peak memory are reported for loading the raw tables, each exchange method, formatting_all and save_all_db.
+
+By default the tables are in an in-memory SQLite database, which is quick to set up but doesn't have the column
+types or performance of Postgres, and save_all_db isn't timed because it uses Postgres DDL.
+--database-url runs it against a scratch Postgres database instead, the raw tables, exchange tables and all_ipos are
+REPLACED in that database (the data_transformation_sql views would stop the raw tables being replaced).
+The script exits with an error if any step fails.
+
+Run from the project folder, i.e. python -m testing.benchmark_transform --depths 1 10 100
+"""
+import argparse
+import random
+import string
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from time import perf_counter
+import pandas as pd
+from sqlalchemy import create_engine
+from pg_connection import apply_column_types, column_sql_types, sql_types
+from source_reference import return_sources, unused_sources
+from data_transformation_db import DataTransformation
+
+# sources without columns in source_reference (API sources and sources with their own scraping code)
+# these are the columns the exchange methods use
+extra_columns = {
+    'AlphaVantage': ['ticker', 'company_name', 'exchange', 'assetType', 'ipo_date', 'price_range_low',
+                     'price_range_high', 'currency'],
+    'TokyoIPO': ['ticker', 'company_name', 'ipo_date', 'price', 'price_range', 'price_range_expected_date',
+                 'price_expected_date'],
+    'TMX': ['list_symbol', 'company_name', 'effective_date', 'details', 'file', 'identification', 'entry_date',
+            'modification_date', 'change_type', 'security_description'],
+    'ASX': ['listing_info', 'company_name', 'ipo_date', 'exchange'],
+    'SpotlightAPI': ['num', 'subscription_date_start', 'subscription_date_end', 'ipo_date', 'company_name',
+                     'listing_type'],
+    'IPOHub': ['company_name', 'exchange', 'listing_type', 'subscription_period', 'price', 'market_cap', 'deal_size',
+               'status', 'ipo_date', 'price_range', 'currency']
+}
+words = ['Alpha', 'Blue', 'Capital', 'Digital', 'Energy', 'Global', 'Green', 'Health', 'Micro', 'Nova', 'Ocean',
+         'Pacific', 'Quantum', 'Solar', 'Tech', 'Vertex']
+suffixes = ['Inc.', 'Ltd', 'Limited', 'SA', 'Holdings, Inc.', 'Corp', 'Group (Cayman)', 'Acquisition Corp Units',
+            'ETF Trust', '**']
+
+
+def rand_ticker(rng: random.Random, length: int = 4) -> str:
+    return ''.join(rng.choices(string.ascii_uppercase, k=length))
+
+
+def rand_date(rng: random.Random, fmt: str = '%Y-%m-%d') -> str:
+    return (datetime.today() + timedelta(days=rng.randint(-365, 90))).strftime(fmt)
+
+
+def rand_number(rng: random.Random) -> str:
+    return f"{rng.randint(1000, 50000000):,}"
+
+
+def rand_price(rng: random.Random) -> str:
+    return f"{rng.uniform(1, 100):.2f}"
+
+
+# values in the formats the exchange methods parse
+source_values = {
+    ('IPOScoop', 'ipo_date'): lambda rng: rng.choice([rand_date(rng, '%m/%d/%Y') + ' Priced', 'Week of 5/10',
+                                                      rand_date(rng, '%m/%d/%Y')]),
+    ('IPOScoop', 'shares_offered_mm'): lambda rng: f"{rng.uniform(1, 50):.1f}",
+    ('IPOScoop', 'price_range_low'): lambda rng: rng.choice([10, 15, 20]),
+    ('IPOScoop', 'price_range_high'): lambda rng: rng.choice([10, 17, 22]),
+    ('AlphaVantage', 'price_range_low'): lambda rng: rng.choice([0, 10, 15]),
+    ('AlphaVantage', 'price_range_high'): lambda rng: rng.choice([0, 10, 17]),
+    ('AlphaVantage', 'exchange'): lambda rng: rng.choice(['NYSE', 'NASDAQ', '"""NYSE American"""']),
+    ('Nasdaq', 'price'): lambda rng: rng.choice([rand_price(rng), '10.00 - 12.00']),
+    ('JPX', 'market_segment'): lambda rng: rng.choice(['Prime', 'Standard', 'Growth']),
+    ('East Money', 'ipo_date'): lambda rng: rand_date(rng, '%m-%d'),
+    ('Shanghai', 'new_share_name'): lambda rng: rng.choice(words) + str(rng.randint(600000, 699999)),
+    ('Euronext', 'location'): lambda rng: rng.choice(['Paris', 'Amsterdam', 'Oslo', 'Milan']),
+    ('AAStocks', 'ticker'): lambda rng: f"{rng.randint(1, 9999):05d}.HK",
+    ('AAStocks', 'price'): lambda rng: rng.choice([rand_price(rng), '10.00-12.00']),
+    ('Frankfurt', 'summary'): lambda rng: f"(DE000{rand_ticker(rng, 6)}){rng.choice(words)} AG Sector",
+    ('Frankfurt', 'market_segment'): lambda rng: rng.choice(['Prime Standard (IPO)', 'Scale (Transfer)']),
+    ('Frankfurt', 'sector'): lambda rng: 'Sector:\n\t\t\t' + rng.choice(words),
+    ('Frankfurt', 'sub_price_and_deal_size'): lambda rng: f"Volume: € {rand_price(rng)} / € {rand_number(rng)}",
+    ('Frankfurt', 'first_price_and_market_cap'): lambda rng: f"First Price Quotation: € {rand_price(rng)} / "
+                                                             f"€ {rand_number(rng)}",
+    ('KRX', 'price'): rand_number,
+    ('KRX', 'par_value'): rand_number,
+    ('BME', 'volume'): rand_number,
+    ('BME', 'listing_type'): lambda rng: rng.choice(['IPO', 'Integration']),
+    ('SGX', 'price'): lambda rng: 'SGD ' + rand_price(rng),
+    ('BM', 'price'): lambda rng: 'RM ' + rand_price(rng),
+    ('BIT', 'ipo_date'): lambda rng: rand_date(rng, '%d/%m/%Y'),
+    ('BIT', 'market_segment'): lambda rng: rng.choice(['MTA', 'AIM Italia', '*']),
+    ('BIT', 'listing_type'): lambda rng: rng.choice(['IPO', 'Transition from AIM']),
+    ('Euronext', 'ipo_date'): lambda rng: rand_date(rng, '%d/%m/%Y'),
+    ('TMX', 'file'): lambda rng: rand_date(rng, '%Y%m%d') + '_tmx.csv',
+    ('TMX', 'identification'): lambda rng: str(rng.randint(1, 100000)),
+    ('TMX', 'change_type'): lambda rng: rng.choice(['New Listing', 'Name Change']),
+    ('TMX', 'security_description'): lambda rng: rng.choice(['Common Shares', 'Warrants']),
+    ('TokyoIPO', 'price_range'): lambda rng: '1,000 - 1,200',
+    # saved with a date type without being converted first, SQLite needs date values rather than strings
+    ('TMX', 'effective_date'): lambda rng: pd.to_datetime(rand_date(rng)).date(),
+    ('TMX', 'entry_date'): lambda rng: pd.to_datetime(rand_date(rng)).date(),
+    ('TMX', 'modification_date'): lambda rng: pd.to_datetime(rand_date(rng)).date(),
+    ('ASX', 'ipo_date'): lambda rng: pd.to_datetime(rand_date(rng)).date(),
+}
+
+
+def column_value(rng: random.Random, source: str, col: str):
+    if (source, col) in source_values.keys():
+        return source_values[(source, col)](rng)
+    if col == 'company_name':
+        return f"{rng.choice(words)} {rng.choice(words)} {rng.choice(suffixes)}"
+    if col in ('ticker', 'list_symbol', 'isin'):
+        return rand_ticker(rng)
+    if 'date' in col:
+        return rand_date(rng)
+    if any(n in col for n in ('shares', 'deal_size', 'volume', 'capital', 'market_cap', 'lot_size')):
+        return rand_number(rng)
+    if 'price' in col or 'ratio' in col or col in ('percent_change', 'entry_fee'):
+        return rand_price(rng)
+    return rng.choice(words)
+
+
+def synthetic_raw_table(source: str, columns: list, listings: int, depth: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Creates a raw table for a source with the given number of listings repeated over the history depth.
+    Each repeat is a new scrape of the listing, the previous row is marked as removed when the new row is added.
+    """
+    rng = random.Random(f"{source}{seed}")
+    df = pd.DataFrame([{c: column_value(rng, source, c) for c in columns} for _ in range(listings)])
+    start = datetime.utcnow() - timedelta(days=depth)
+    history = []
+    for d in range(depth):
+        df_d = df.copy()
+        df_d['time_added'] = start + timedelta(days=d)
+        df_d['time_removed'] = start + timedelta(days=d + 1) if d < depth - 1 else pd.NaT
+        history.append(df_d)
+    return pd.concat(history, ignore_index=True)
+
+
+def create_raw_tables(conn, sources: dict, listings: int, depth: int) -> int:
+    rows = 0
+    for method, src_names in DataTransformation.transform_sources.items():
+        for src in src_names:
+            columns = sources[src].get('columns') or extra_columns[src]
+            df = synthetic_raw_table(src, columns, listings, depth)
+            # declared column types are stored natively, the same as website_scraping.update_table
+            column_types = sources[src].get('column_types', {})
+            df = apply_column_types(df, column_types)
+            df.to_sql(sources[src]['db_table_raw'], conn, if_exists='replace', index=False, dtype={
+                'time_added': sql_types.DateTime,
+                'time_removed': sql_types.DateTime,
+                **column_sql_types(column_types)
+            })
+            rows += len(df)
+    return rows
+
+
+def measure(results: list, depth: int, step: str, func):
+    tracemalloc.start()
+    start = perf_counter()
+    error = None
+    try:
+        value = func()
+    except Exception as e:
+        value = None
+        error = repr(e)
+    seconds = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results.append({'depth': depth, 'step': step, 'seconds': round(seconds, 4), 'peak_mb': round(peak / 2 ** 20, 2),
+                    'error': error})
+    return value
+
+
+def run_benchmark(depths: list, listings: int, database_url: str = None) -> pd.DataFrame:
+    # only the sources read by the exchange methods, some unused sources are still transformed
+    src_names = {src for src_list in DataTransformation.transform_sources.values() for src in src_list}
+    sources = {k: v for k, v in {**unused_sources, **return_sources()}.items() if k in src_names}
+    engine = create_engine(database_url if database_url else 'sqlite://')
+    results = []
+    for depth in depths:
+        conn = engine.connect()
+        with conn.begin():
+            rows = create_raw_tables(conn, sources, listings, depth)
+        print(f"depth {depth}x: {rows} raw rows")
+        dt = measure(results, depth, 'load raw tables', lambda: DataTransformation(conn=conn, sources=sources))
+        if dt is None:
+            conn.close()
+            continue
+        for method in DataTransformation.transform_sources.keys():
+            measure(results, depth, method, getattr(dt, method))
+        measure(results, depth, 'formatting_all', dt.formatting_all)
+        if database_url:
+            measure(results, depth, 'save_all_db', dt.save_all_db)
+        conn.close()
+    engine.dispose()
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the transformation stage with synthetic raw tables')
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 10, 100], help='history depths to run')
+    parser.add_argument('--listings', type=int, default=100, help='listings per source')
+    parser.add_argument('--output', help='optional csv file for the results')
+    parser.add_argument('--database-url', help='SQLAlchemy URL of a scratch Postgres database, SQLite if not given')
+    args = parser.parse_args()
+    df_results = run_benchmark(args.depths, args.listings, args.database_url)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(df_results)
+    if args.output:
+        df_results.to_csv(args.output, index=False)
+    if df_results['error'].notna().any():
+        sys.exit(f"{df_results['error'].notna().sum()} steps failed")
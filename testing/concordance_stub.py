@@ -0,0 +1,229 @@
+"""
+Local stand-in for the Concordance API, so EntityMatchBulk can be tested and benchmarked without FactSet credentials.
+It implements the entity-task, entity-task-status and entity-decisions endpoints used by entity_mapping.
+
+Each response is delayed by latency seconds and a task is IN_PROGRESS until task_seconds (plus task_seconds_per_name
+for each name) have passed since it was submitted. Failures can be injected: failure_rate is the share of requests
+that get a 500 error and rate_limit_rate is the share of task submissions that get a 429 with a Retry-After header.
+Decisions are made up but the same name always gets the same decision.
+
+Run on its own with python -m testing.concordance_stub --port 8089, or use ConcordanceStub in a test:
+
+    with ConcordanceStub(task_seconds=0.5) as stub:
+        em = EntityMatchBulk(url=stub.url, authorization=('user', 'key'))
+"""
+import io
+import csv
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from email import message_from_bytes
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from entity_codec import max_iconum, encode_iconums
+
+entity_types = {'PUB': 'Public Company', 'PVT': 'Private Company', 'HOL': 'Holding Company', 'SUB': 'Subsidiary'}
+countries = {'US': 'United States', 'GB': 'United Kingdom', 'JP': 'Japan', 'HK': 'Hong Kong', 'AU': 'Australia'}
+
+
+def name_hash(name: str) -> int:
+    return int(hashlib.md5(name.encode('utf8')).hexdigest(), 16)
+
+
+class ConcordanceStub:
+    def __init__(self, port: int = 0, latency: float = 0.0, task_seconds: float = 1.0,
+                 task_seconds_per_name: float = 0.0, failure_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float = 1.0, map_rate: float = 0.8, seed: int = 0):
+        """
+        :param port: port to listen on, 0 for any free port
+        :param latency: seconds added to every response
+        :param task_seconds: seconds before a task is finished
+        :param task_seconds_per_name: seconds added to task_seconds for each name in the task
+        :param failure_rate: share of requests that return a 500 error
+        :param rate_limit_rate: share of task submissions that return a 429 error
+        :param retry_after: value of the Retry-After header of 429 responses
+        :param map_rate: share of names that are mapped
+        :param seed: seed for the failures
+        """
+        self.latency = latency
+        self.task_seconds = task_seconds
+        self.task_seconds_per_name = task_seconds_per_name
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.map_rate = map_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.requests = {'entity-task': 0, 'entity-task-status': 0, 'entity-decisions': 0}
+        self.errors = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='concordance-stub', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def create_task(self, rows: list, task_name: str, client_id_col: str = 'client_id',
+                    name_col: str = 'company_name') -> str:
+        """
+        Adds a task for a list of rows (dictionaries with the client ID and name columns).
+
+        :return: the task ID
+        """
+        with self.lock:
+            task_id = str(len(self.tasks) + 1)
+            self.tasks[task_id] = {'name': task_name, 'submitted': time.monotonic(),
+                                   'decisions': [self.decision(task_id, i, row[client_id_col], row[name_col])
+                                                 for i, row in enumerate(rows)]}
+        return task_id
+
+    def decision(self, task_id: str, row_index: int, client_id: str, name: str) -> dict:
+        h = name_hash(name or '')
+        decision = {'taskId': task_id, 'rowIndex': row_index, 'clientId': client_id, 'clientName': name,
+                    'nameMatchString': name, 'mapStatus': 'UNMAPPED', 'entityName': None, 'entityId': None,
+                    'similarityScore': None, 'confidenceScore': None, 'countryCode': None, 'countryName': None,
+                    'entityTypeCode': None, 'entityTypeDescription': None}
+        if (h % 1000) / 1000 < self.map_rate:
+            country = list(countries.keys())[h % len(countries)]
+            entity_type = list(entity_types.keys())[h % len(entity_types)]
+            decision.update({
+                'mapStatus': 'MAPPED',
+                'entityName': name.upper(),
+                'entityId': str(encode_iconums([h % (max_iconum + 1)])[0]),
+                'similarityScore': round(0.6 + (h >> 10) % 400 / 1000, 3),
+                'confidenceScore': round(0.6 + (h >> 20) % 400 / 1000, 3),
+                'countryCode': country,
+                'countryName': countries[country],
+                'entityTypeCode': entity_type,
+                'entityTypeDescription': entity_types[entity_type]
+            })
+        return decision
+
+    def task_status(self, task_id: str) -> dict:
+        task = self.tasks[task_id]
+        num_names = len(task['decisions'])
+        duration = self.task_seconds + self.task_seconds_per_name * num_names
+        elapsed = time.monotonic() - task['submitted']
+        if elapsed < duration:
+            return {'taskId': task_id, 'taskName': task['name'], 'status': 'IN_PROGRESS'}
+        num_mapped = sum(d['mapStatus'] == 'MAPPED' for d in task['decisions'])
+        return {'taskId': task_id, 'taskName': task['name'], 'status': 'SUCCESS', 'processDuration': duration,
+                'decisionRate': num_mapped / num_names if num_names > 0 else 0}
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, data: dict, headers: dict = None):
+                body = json.dumps(data).encode('utf8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json;charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def start_request(self, endpoint: str) -> bool:
+                # adds the latency and returns False if the request should fail
+                time.sleep(stub.latency)
+                with stub.lock:
+                    stub.requests[endpoint] += 1
+                    fail = stub.random.random() < stub.failure_rate
+                    limited = endpoint == 'entity-task' and stub.random.random() < stub.rate_limit_rate
+                    if fail or limited:
+                        stub.errors += 1
+                if limited:
+                    self.send_json(429, {'errors': [{'title': 'Too Many Requests'}]},
+                                   headers={'Retry-After': str(stub.retry_after)})
+                elif fail:
+                    self.send_json(500, {'errors': [{'title': 'Internal Server Error'}]})
+                return not (fail or limited)
+
+            def do_POST(self):
+                endpoint = urlparse(self.path).path.rstrip('/').split('/')[-1]
+                if endpoint != 'entity-task':
+                    return self.send_json(404, {'errors': [{'title': 'Not Found'}]})
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if not self.start_request(endpoint):
+                    return
+                # multipart form with the task fields and the input file
+                msg = message_from_bytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body,
+                                         policy=HTTP)
+                fields, rows = {}, None
+                for part in msg.iter_parts():
+                    name = part.get_param('name', header='content-disposition')
+                    if part.get_filename() is not None:
+                        text = part.get_payload(decode=True).decode('utf-8-sig')
+                        rows = list(csv.DictReader(io.StringIO(text)))
+                    else:
+                        fields[name] = part.get_payload(decode=True).decode('utf8')
+                if rows is None:
+                    return self.send_json(400, {'errors': [{'title': 'Bad Request - inputFile is required'}]})
+                task_id = stub.create_task(rows, fields.get('taskName'), fields.get('clientIdColumn', 'client_id'),
+                                           fields.get('nameColumn', 'company_name'))
+                self.send_json(200, {'data': {'taskId': task_id, 'taskName': fields.get('taskName')}})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                endpoint = url.path.rstrip('/').split('/')[-1]
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if endpoint not in ['entity-task-status', 'entity-decisions']:
+                    return self.send_json(404, {'errors': [{'title': 'Not Found'}]})
+                if not self.start_request(endpoint):
+                    return
+                task_id = params.get('taskId')
+                if task_id not in stub.tasks.keys():
+                    return self.send_json(404, {'errors': [{'title': f'Task {task_id} not found'}]})
+                if endpoint == 'entity-task-status':
+                    return self.send_json(200, {'data': [stub.task_status(task_id)]})
+                if stub.task_status(task_id)['status'] != 'SUCCESS':
+                    return self.send_json(400, {'errors': [{'title': f'Task {task_id} has not finished'}]})
+                decisions = stub.tasks[task_id]['decisions']
+                offset = int(params.get('offset', 0))
+                limit = int(params.get('limit', len(decisions)))
+                self.send_json(200, {'data': decisions[offset:offset + limit],
+                                     'meta': {'pagination': {'total': len(decisions), 'offset': offset,
+                                                             'limit': limit}}})
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Concordance API')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every response')
+    parser.add_argument('--task-seconds', type=float, default=5, help='seconds before a task is finished')
+    parser.add_argument('--failure-rate', type=float, default=0, help='share of requests that return a 500 error')
+    parser.add_argument('--rate-limit-rate', type=float, default=0, help='share of submissions that return a 429')
+    args = parser.parse_args()
+    server = ConcordanceStub(port=args.port, latency=args.latency, task_seconds=args.task_seconds,
+                             failure_rate=args.failure_rate, rate_limit_rate=args.rate_limit_rate)
+    print(f"Concordance stand-in running at {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,62 @@
+import time
+import unittest
+from entity_mapping import EntityMatchBulk
+from entity_codec import entity_ids_to_iconums
+from testing.concordance_stub import ConcordanceStub
+
+
+def client_rows(n: int) -> list:
+    return [{'client_id': f"Company {i} Inc_TICK{i}_NYSE", 'company_name': f"Company {i} Inc"} for i in range(n)]
+
+
+class ConcordanceStubTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = ConcordanceStub(task_seconds=0).start()
+        self.em = EntityMatchBulk(url=self.stub.url, authorization=('user', 'key'))
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_decisions_are_paged(self):
+        eid = self.stub.create_task(client_rows(25), 'paging')
+        pages = list(self.em.iter_entity_decisions(eid, limit=10))
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+        self.assertEqual(self.stub.requests['entity-decisions'], 3)
+        self.assertEqual(sum((p['rowIndex'].tolist() for p in pages), []), list(range(25)))
+
+    def test_decisions_continue_from_offset(self):
+        eid = self.stub.create_task(client_rows(25), 'offset')
+        df = self.em.get_entity_decisions(eid)
+        pages = list(self.em.iter_entity_decisions(eid, offset=20, limit=10))
+        self.assertEqual(len(df), 25)
+        self.assertEqual(pages[0]['clientId'].tolist(), df['clientId'].tolist()[20:])
+
+    def test_mapped_decisions_have_valid_entity_ids(self):
+        eid = self.stub.create_task(client_rows(100), 'mapped')
+        df = self.em.get_entity_decisions(eid)
+        df = df.loc[df['mapStatus'] == 'MAPPED']
+        self.assertGreater(len(df), 0)
+        self.assertFalse(entity_ids_to_iconums(df['entityId']).isna().any())
+
+    def test_task_status(self):
+        self.stub.task_seconds = 0.3
+        eid = self.stub.create_task(client_rows(5), 'status')
+        self.assertEqual(self.em.get_task_status(eid)['status'], 'IN_PROGRESS')
+        time.sleep(0.4)
+        task = self.em.get_task_status(eid)
+        self.assertEqual(task['status'], 'SUCCESS')
+        self.assertGreater(task['decisionRate'], 0)
+
+    def test_failures(self):
+        eid = self.stub.create_task(client_rows(5), 'failures')
+        self.stub.failure_rate = 1
+        with self.assertRaises(AssertionError):
+            self.em.get_task_status(eid)
+        with self.assertRaises(AssertionError):
+            self.em.get_entity_decisions(eid)
+        self.assertEqual(self.stub.errors, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from pg_connection import apply_column_types
+from source_reference import return_sources
+from data_transformation_db import DataTransformation
+
+
+class FormatNumericColsTest(unittest.TestCase):
+
+    def test_commas_are_removed(self):
+        df = pd.DataFrame({'volume': ['1,000', '25,500,000'], 'shares_offered': ['2,000', '3,000']})
+        df = DataTransformation.format_numeric_cols(df, ['volume', 'shares_offered'], float, errors='raise')
+        self.assertEqual(df['volume'].tolist(), [1000.0, 25500000.0])
+        self.assertEqual(df['shares_offered'].astype(int).tolist(), [2000, 3000])
+
+    def test_numeric_columns_are_kept(self):
+        df = pd.DataFrame({'shares_offered': [1000, 2000]})
+        df = DataTransformation.format_numeric_cols(df, ['shares_offered'], int)
+        self.assertEqual(df['shares_offered'].tolist(), [1000, 2000])
+
+    def test_values_that_are_not_numbers(self):
+        df = pd.DataFrame({'price': ['1,200', 'TBA']})
+        df = DataTransformation.format_numeric_cols(df, ['price'], int)
+        self.assertEqual(df['price'].tolist(), ['1200', 'TBA'])
+
+    def test_missing_columns_are_ignored(self):
+        df = pd.DataFrame({'price': ['10']})
+        df = DataTransformation.format_numeric_cols(df, ['par_value'], int)
+        self.assertEqual(df.columns.tolist(), ['price'])
+
+
+class BMETest(unittest.TestCase):
+
+    def setUp(self):
+        # DataTransformation creates the Results folder in the working directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.conn = create_engine('sqlite://').connect()
+        self.sources = {'BME': return_sources()['BME']}
+
+    def tearDown(self):
+        self.conn.close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_blank_numbers(self):
+        df = pd.DataFrame({'ipo_date': ['2024-05-01', '2024-06-01'], 'isin': ['ES01', 'ES02'],
+                           'company_name': ['Foo SA', 'Bar SA'], 'shares_offered': ['1,000', ''],
+                           'deal_size': ['10,000', ''], 'volume': ['20,000', np.nan], 'listing_type': ['IPO', 'IPO'],
+                           'time_added': pd.Timestamp('2024-05-01'), 'time_removed': pd.NaT})
+        df = apply_column_types(df, self.sources['BME']['column_types'])
+        df.to_sql(self.sources['BME']['db_table_raw'], self.conn, index=False)
+        dt = DataTransformation(conn=self.conn, sources=self.sources)
+        dt.bme()
+        df_all = dt.df_all.set_index('ticker')
+        self.assertEqual(df_all.loc['ES01', 'shares_offered'], 1000)
+        self.assertEqual(df_all.loc['ES01', 'price'], 20)
+        self.assertTrue(pd.isna(df_all.loc['ES02', 'shares_offered']))
+        self.assertTrue(pd.isna(df_all.loc['ES02', 'price']))
+
+
+if __name__ == '__main__':
+    unittest.main()
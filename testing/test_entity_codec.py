@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+import pandas as pd
+from entity_codec import chars, max_iconum, encode_iconums, decode_entity_ids, iconums_to_entity_ids, \
+    entity_ids_to_iconums
+from entity_mapping import EntityMatchBulk
+
+rng = np.random.default_rng(20211)
+num_samples = 10000
+
+
+def random_iconums(n: int = num_samples) -> np.ndarray:
+    # the edges of the range and random values in between
+    return np.concatenate(([0, 1, 30, 31, max_iconum - 1, max_iconum], rng.integers(0, max_iconum + 1, size=n)))
+
+
+def random_entity_ids(n: int = num_samples) -> np.ndarray:
+    digits = rng.integers(0, len(chars), size=(n, 6))
+    return np.array([''.join(chars[d] for d in row) + '-E' for row in digits])
+
+
+class EntityCodecTest(unittest.TestCase):
+
+    def test_iconum_round_trip(self):
+        iconums = random_iconums()
+        np.testing.assert_array_equal(decode_entity_ids(encode_iconums(iconums)), iconums)
+
+    def test_entity_id_round_trip(self):
+        entity_ids = random_entity_ids()
+        np.testing.assert_array_equal(encode_iconums(decode_entity_ids(entity_ids)), entity_ids)
+
+    def test_matches_scalar_version(self):
+        iconums = random_iconums(1000)
+        entity_ids = encode_iconums(iconums)
+        self.assertEqual(entity_ids.tolist(), [EntityMatchBulk.iconum_to_entity_id(int(i)) for i in iconums])
+        self.assertEqual(decode_entity_ids(entity_ids).tolist(),
+                         [EntityMatchBulk.entity_id_to_iconum(e) for e in entity_ids])
+
+    def test_entity_ids_are_ordered_like_iconums(self):
+        iconums = np.sort(random_iconums(1000))
+        entity_ids = encode_iconums(iconums)
+        self.assertEqual(entity_ids.tolist(), sorted(entity_ids.tolist()))
+
+    def test_invalid_entity_ids(self):
+        s = entity_ids_to_iconums(pd.Series(['000001-E', None, np.nan, 'AAAAAA-E', '0001', 'ZZZZZZ'], index=list('abcdef')))
+        self.assertEqual(s.index.tolist(), list('abcdef'))
+        self.assertEqual(str(s.dtype), 'Int64')
+        self.assertEqual(s['a'], 1)
+        self.assertTrue(s[['b', 'c', 'd', 'e']].isna().all())
+        self.assertEqual(s['f'], max_iconum)
+
+    def test_invalid_iconums(self):
+        s = iconums_to_entity_ids(pd.Series([31, None, -1, max_iconum + 1, 2.5, 7.0]))
+        self.assertEqual(s[0], '000010-E')
+        self.assertTrue(s[[1, 2, 3, 4]].isna().all())
+        self.assertEqual(s[5], '000007-E')
+
+    def test_series_round_trip(self):
+        entity_ids = pd.Series(random_entity_ids(1000))
+        self.assertEqual(iconums_to_entity_ids(entity_ids_to_iconums(entity_ids)).tolist(), entity_ids.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from file_management import delete_old_partitions
+
+
+class DeleteOldPartitionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.today = datetime.utcnow().date()
+        for source in ['source_nyse_raw', 'all_ipos']:
+            for days in [0, 10, 400]:
+                run_date = (self.today - timedelta(days=days)).isoformat()
+                partition = os.path.join(self.tmp.name, f"source={source}", f"run_date={run_date}")
+                os.makedirs(partition)
+                open(os.path.join(partition, 'run.parquet'), 'w').close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_dates(self, source: str) -> list:
+        return sorted(os.listdir(os.path.join(self.tmp.name, f"source={source}")))
+
+    def test_old_partitions_are_deleted(self):
+        deleted = delete_old_partitions(self.tmp.name, num_days=365)
+        self.assertEqual(len(deleted), 2)
+        expected = [f"run_date={(self.today - timedelta(days=d)).isoformat()}" for d in [10, 0]]
+        self.assertEqual(self.run_dates('source_nyse_raw'), expected)
+        self.assertEqual(self.run_dates('all_ipos'), expected)
+
+    def test_test_mode_keeps_partitions(self):
+        deleted = delete_old_partitions(self.tmp.name, num_days=5, test=True)
+        self.assertEqual(len(deleted), 4)
+        self.assertEqual(len(self.run_dates('all_ipos')), 3)
+
+    def test_missing_folder(self):
+        self.assertEqual(delete_old_partitions(os.path.join(self.tmp.name, 'missing')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
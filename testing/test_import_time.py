@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+# Imports each entry point in a new process, the way a scheduled run starts, and checks how long the import takes
+# and that heavy dependencies aren't imported until a stage runs.
+
+package_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+import_budget_seconds = 1.0
+heavy_modules = ['pandas', 'numpy', 'sqlalchemy', 'selenium', 'bs4', 'win32com', 'confuse', 'xlsxwriter']
+
+
+def import_in_new_process(module: str) -> dict:
+    code = f"""
+import sys, json, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': [m for m in {heavy_modules!r} if m in sys.modules]}}))
+"""
+    res = subprocess.run([sys.executable, '-c', code], cwd=package_folder, capture_output=True, text=True, check=True)
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    def check_module(self, module: str):
+        result = import_in_new_process(module)
+        self.assertEqual(result['modules'], [], f"{module} imports {', '.join(result['modules'])}")
+        self.assertLess(result['seconds'], import_budget_seconds,
+                        f"{module} took {result['seconds']:.2f} seconds to import")
+
+    def test_logging_ipo_dates(self):
+        self.check_module('logging_ipo_dates')
+
+    def test_email_report(self):
+        self.check_module('email_report')
+
+    def test_file_management(self):
+        self.check_module('file_management')
+
+    def test_pipeline(self):
+        self.check_module('pipeline')
+
+    def test_main(self):
+        self.check_module('main')
+
+    def test_create_db_tables_no_connection(self):
+        # connections are only opened when a function runs, this would fail without a db if it connected on import
+        res = subprocess.run([sys.executable, '-c', 'import create_db_tables, remove_db_dupes'], cwd=package_folder,
+                             capture_output=True, text=True)
+        self.assertEqual(res.returncode, 0, res.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import pandas as pd
+from name_matching import NameMatcher, numbers
+
+
+def known_names(names: list) -> pd.DataFrame:
+    return pd.DataFrame({'company_name': names, 'entityname': names, 'iconum': range(1, len(names) + 1),
+                         'entity_id': [f"{i:06d}-E" for i in range(1, len(names) + 1)]})
+
+
+class NumbersTest(unittest.TestCase):
+
+    def test_roman_numerals(self):
+        for word in ['ii', 'iii', 'iv', 'vi', 'ix', 'xi', 'xiv', 'xl', 'xc', 'lxxx', 'cc']:
+            self.assertEqual(numbers(f"acme acquisition corp {word}"), frozenset([word]), word)
+
+    def test_single_letters_are_not_numbers(self):
+        for word in ['i', 'v', 'x', 'l', 'c', 'm']:
+            self.assertEqual(numbers(f"{word} acme corp"), frozenset(), word)
+
+    def test_malformed_numerals_are_not_numbers(self):
+        for word in ['vix', 'iiii', 'vv', 'ic', 'civil', 'lxiv1', 'ivy', 'xii2']:
+            self.assertEqual(numbers(f"acme {word} corp"), frozenset(), word)
+
+    def test_digits(self):
+        self.assertEqual(numbers('acme 2x long 2024 etf'), frozenset(['2024']))
+
+
+class NameMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = NameMatcher(known_names(['Acme Acquisition Corp II', 'Vix Volatility Holdings Inc']))
+
+    def test_different_numerals_are_not_matched(self):
+        df = self.matcher.match(pd.Series(['Acme Acquisition Corp III', 'Acme Acquisition Corp II Units']))
+        self.assertEqual(df.index.tolist(), [1])
+
+    def test_words_like_numerals_are_matched(self):
+        df = self.matcher.match(pd.Series(['Vix Volatility Holdings Inc.', 'Vix Volatility Holdings Ltd']))
+        self.assertEqual(df['iconum'].tolist(), [2, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import pandas as pd
+from name_normalization import asset_types, remove_asset_types, name_keys
+
+# names in the formats AlphaVantage, the exchanges and PEO-PIPE use
+names = ['Churchill Capital Corp IX Units', 'Churchill Capital Corp IX Class A Ordinary Shares',
+         'Churchill Capital Corp IX Warrants', 'Ares Acquisition Corp II Unit', 'Ares Acquisition Corp II Rights',
+         'Inflection Point Acquisition Corp Warrants to purchase Class A Common Stock', 'Roundhill Ether ETF Trust',
+         'Defiance Daily Target 2X Long ETF', 'Birkenstock Holding plc Ordinary Shares',
+         'Lotus Technology Inc. American Depositary Shares', 'Brookfield Renewable Subordinate Voting Shares',
+         'Kenvue Inc. Common Stock', 'Global Unit Holdings Inc. Common Shares', 'ETFMG Sit Ultra Short ETF',
+         'Nippon Steel Corporation', 'SOCIETE GENERALE SA', 'Novo Nordisk A/S', 'Arm Holdings plc Limited',
+         'Zhongchao (Cayman) Ltd.', 'Smith, Jones & Co., Inc', 'Primech Holdings Ltd']
+
+
+def baseline_asset_types(s: pd.Series) -> pd.Series:
+    # the clean-up in data_transformation_db before name_normalization
+    for att in asset_types:
+        s = s.str.replace(att, '', case=False, regex=False)
+    return s
+
+
+def baseline_name_keys(s: pd.Series) -> pd.Series:
+    # the formatted company name in rpd_creation before name_normalization
+    s = s.str.lower()
+    s = s.str.replace(r"([\.\,\(\)\\\/])", "", regex=True)
+    s = s.str.replace(r"(\slimited$|\sltd|\ssa$|\sa/s$|\sinc$)", "", regex=True, case=False)
+    return s.str.strip()
+
+
+class NameNormalizationTest(unittest.TestCase):
+
+    def test_asset_types_match_baseline(self):
+        s = pd.Series(names)
+        self.assertEqual(remove_asset_types(s).tolist(), baseline_asset_types(s).tolist())
+
+    def test_asset_types_are_removed_in_order(self):
+        s = pd.Series(['Roundhill Ether ETF Trust', 'Ares Acquisition Corp II Rights',
+                       'Inflection Point Acquisition Corp Warrants to purchase Class A Common Stock'])
+        # ' Warrants to purchase ' takes the space before 'Class A', so only ' Common Stock' is removed after it
+        self.assertEqual(remove_asset_types(s).tolist(),
+                         ['Roundhill Ether', 'Ares Acquisition Corp II', 'Inflection Point Acquisition CorpClass A'])
+
+    def test_missing_names(self):
+        s = pd.Series(['Kenvue Inc. Common Stock', None], dtype=object)
+        self.assertEqual(remove_asset_types(s).isna().tolist(), [False, True])
+        self.assertEqual(name_keys(s).isna().tolist(), [False, True])
+
+    def test_name_keys_match_baseline(self):
+        s = pd.Series(names)
+        self.assertEqual(name_keys(s).tolist(), baseline_name_keys(s).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
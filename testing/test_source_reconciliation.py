@@ -0,0 +1,93 @@
+import unittest
+import numpy as np
+import pandas as pd
+from source_reconciliation import SourceReconciler
+from data_transformation_db import DataTransformation
+
+special_chars = r"(\.|'|\*)"
+
+
+def us_frames() -> dict:
+    def frame(source: str, tickers: list) -> pd.DataFrame:
+        return pd.DataFrame({'source': source, 'ticker': tickers,
+                             'company_name': [f"{source} {i}" for i in range(len(tickers))],
+                             'exchange': 'NYSE' if source == 'NYSE' else 'Nasdaq'})
+    return {
+        'Nasdaq': frame('Nasdaq', ['AAA', 'BBB.U', "CC'C", np.nan]),
+        'NYSE': frame('NYSE', ['DDD', 'AAA', np.nan]),
+        'IPOScoop': frame('IPOScoop', ['AAA', 'BBBU', 'EEE', 'FFF', 'FFF', np.nan]),
+        'AlphaVantage': frame('AlphaVantage', ['AAA', 'EEE', 'CCC*', 'GGG', 'HH.H', np.nan])
+    }
+
+
+def baseline_us(frames: dict) -> pd.DataFrame:
+    # the merges in DataTransformation.us before SourceReconciler
+    df = pd.concat([frames['Nasdaq'], frames['NYSE']], ignore_index=True, sort=False)
+    df['formatted symbol'] = df['ticker'].str.replace(special_chars, "", regex=True)
+
+    def add_only_new(data_frame: pd.DataFrame):
+        data_frame['formatted symbol'] = data_frame['ticker'].str.replace(special_chars, "", regex=True)
+        data_frame = pd.merge(data_frame, df, how='outer', on='formatted symbol', suffixes=('', '_drop'),
+                              indicator=True)
+        data_frame = data_frame.loc[data_frame['_merge'] == 'left_only']
+        drop_cols = [c for c in data_frame.columns if '_drop' in c]
+        drop_cols.append('_merge')
+        data_frame.drop(columns=drop_cols, inplace=True)
+        return data_frame
+
+    # df is read when add_only_new is called, so AlphaVantage is compared with the IPOScoop rows added before it
+    df_is = add_only_new(frames['IPOScoop'].copy())
+    df = pd.concat([df, df_is], ignore_index=True, sort=False)
+    df_av = add_only_new(frames['AlphaVantage'].copy())
+    df = pd.concat([df, df_av], ignore_index=True, sort=False)
+    return df
+
+
+def kept(df: pd.DataFrame) -> list:
+    return sorted(zip(df['source'], df['company_name']))
+
+
+class SourceReconcilerTest(unittest.TestCase):
+
+    def setUp(self):
+        precedence = DataTransformation.source_precedence['us']
+        self.sr = SourceReconciler(precedence['tiers'], precedence['keys'])
+
+    def test_us_matches_baseline(self):
+        frames = us_frames()
+        df = self.sr.combine(frames)
+        df_baseline = baseline_us(us_frames())
+        # the baseline merge also matched missing tickers with each other, those rows are compared separately
+        self.assertEqual(kept(df.loc[df['ticker'].notna()]),
+                         kept(df_baseline.loc[df_baseline['ticker'].notna()]))
+
+    def test_alphavantage_is_compared_with_iposcoop(self):
+        df = self.sr.combine(us_frames())
+        av = df.loc[df['source'] == 'AlphaVantage', 'ticker'].dropna().tolist()
+        self.assertEqual(av, ['GGG', 'HH.H'])
+
+    def test_missing_tickers_are_kept(self):
+        df = self.sr.combine(us_frames())
+        self.assertEqual(df.loc[df['ticker'].isna(), 'source'].tolist(),
+                         ['Nasdaq', 'NYSE', 'IPOScoop', 'AlphaVantage'])
+
+    def test_sources_in_the_same_tier_are_not_compared(self):
+        df = self.sr.combine(us_frames())
+        self.assertEqual(df.loc[df['ticker'] == 'AAA', 'source'].tolist(), ['Nasdaq', 'NYSE'])
+
+    def test_duplicates_within_a_source_are_kept(self):
+        df = self.sr.combine(us_frames())
+        self.assertEqual(df.loc[df['ticker'] == 'FFF', 'source'].tolist(), ['IPOScoop', 'IPOScoop'])
+
+    def test_name_keys(self):
+        sr = SourceReconciler([['a'], ['b']], ['name'])
+        df_a = pd.DataFrame({'company_name': ['Foo Inc.', np.nan], 'exchange': ['NYSE', 'NYSE'], 'ticker': np.nan})
+        df_b = pd.DataFrame({'company_name': ['FOO, Inc', 'Foo Inc.', np.nan], 'exchange': ['NYSE', 'Nasdaq', 'NYSE'],
+                             'ticker': np.nan})
+        df = sr.combine({'a': df_a, 'b': df_b})
+        self.assertEqual(len(df), 4)
+        self.assertEqual(df['exchange'].tolist(), ['NYSE', 'NYSE', 'Nasdaq', 'NYSE'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,8 +12,13 @@ from selenium.webdriver.firefox.options import Options
 import pandas as pd
 import numpy as np
 import requests
-from pg_connection import pg_connection, sql_types
+from sqlalchemy import text
+from pg_connection import pg_connection, sql_types, transaction, replace_table_contents, apply_column_types, \
+    column_sql_types
 from collections import defaultdict
+from snapshot_archive import archive_frame
+from source_refresh import SourceRefresh
+from source_health import SourceHealth
 
 
 class WebDriver:
@@ -24,6 +29,10 @@ class WebDriver:
         self.driver = webdriver.Firefox(options=opts)
         self.sleep_time = 5
         self.time_checked = datetime.utcnow()
+        self.load_sources(sources)
+        self.conn = pg_connection()
+
+    def load_sources(self, sources=None):
         if sources:
             self.sources = sources
         else:
@@ -31,8 +40,17 @@ class WebDriver:
             if os.path.exists(sources_file):
                 with open(sources_file, 'r') as f:
                     self.sources = json.load(f)
-            self.website_sources = {k: v for k, v in self.sources.items() if v['source_type'] == 'website'}
-        self.conn = pg_connection()
+        self.website_sources = {k: v for k, v in self.sources.items() if v['source_type'] == 'website'}
+
+    def start_run(self):
+        """
+        Gets a driver that is kept open between runs ready for the next run,
+        i.e. reloads sources.json and gets a new db connection.
+        """
+        self.time_checked = datetime.utcnow()
+        self.load_sources()
+        if self.conn.closed:
+            self.conn = pg_connection()
 
     @staticmethod
     def random_wait(max_wait_sec: int = 120):
@@ -115,187 +133,188 @@ class WebDriver:
             df['time_checked'] = self.time_checked
             return df
 
-    def special_cases(self):
+    def special_cases(self, refresh: Optional[SourceRefresh] = None, health: Optional[SourceHealth] = None):
 
         def asx():
-            try:
-                url = self.sources['ASX'].get('url')
-                self.driver.get(url)
-                soup = self.return_soup()
-                listing_info = [co.text.strip() for co in soup.find_all('h6', attrs={'class': 'gtm-accordion'})]
-                df = pd.DataFrame(listing_info)
-                df.columns = ['listing_info']
-                df['company_name'] = df['listing_info'].str.extract(r'^([a-zA-Z0-9\s,\.&\(\)\-]*)\s\-')
-                df['ipo_date'] = df['listing_info'].str.extract(r'\s*-\s*(\d{1,2}\s\w*\s\d{2,4})')
-                df['ipo_date'] = pd.to_datetime(df['ipo_date'], errors='coerce')
-                df['exchange'] = 'Australian Stock Exchange'
-                df['time_checked'] = self.time_checked
-                return df
-            except Exception as e:
-                logger.error(f"ERROR for ASX")
-                logger.error(e, exc_info=sys.exc_info())
+            url = self.sources['ASX'].get('url')
+            self.driver.get(url)
+            soup = self.return_soup()
+            listing_info = [co.text.strip() for co in soup.find_all('h6', attrs={'class': 'gtm-accordion'})]
+            df = pd.DataFrame(listing_info)
+            df.columns = ['listing_info']
+            df['company_name'] = df['listing_info'].str.extract(r'^([a-zA-Z0-9\s,\.&\(\)\-]*)\s\-')
+            df['ipo_date'] = df['listing_info'].str.extract(r'\s*-\s*(\d{1,2}\s\w*\s\d{2,4})')
+            df['ipo_date'] = pd.to_datetime(df['ipo_date'], errors='coerce')
+            df['exchange'] = 'Australian Stock Exchange'
+            df['time_checked'] = self.time_checked
+            return df
 
         def tkipo():
-            try:
-                url = self.sources['TokyoIPO'].get('url')
-                self.driver.get(url)
-                soup = self.return_soup()
-                table = soup.find('table', attrs={'class': 'iposchedulelist'})
-                table_data = []
-                row = []
-                for r in table.find_all('tr'):
-                    for cell in r.find_all('td'):
-                        cell_text = cell.text.strip()
-                        if '\n\n▶\xa0Stock/Chart' in cell_text:
-                            table_data.append(row)
-                            row = [cell_text.replace('\n\n▶\xa0Stock/Chart', '')]
-                        else:
-                            row.append(cell_text)
-                table_data.append(row)
-                df = pd.DataFrame(table_data)
-                df.columns = ['company_name', 'ipo_date', 'ticker', 'shares_outstanding', 'blank_0', 'price_range',
-                              'price', 'bookbuilding_period', 'opening_price', 'percent_change', 'underwriters',
-                              'business_description', 'blank_1']
-                df.replace('', np.nan, inplace=True)
-                df.dropna(how='all', inplace=True)
-                df.drop(columns=['blank_0', 'business_description', 'blank_1'],  inplace=True, errors='ignore')
-                df['company_name'] = df['company_name'].str.strip()
-                df['price_range_expected_date'] = df['price_range'].str.extract(r'^(\d{0,2}\/\d{0,2})$')
-                df['price_expected_date'] = df['price'].str.extract(r'^(\d{0,2}\/\d{0,2})$')
-                df['price'] = pd.to_numeric(df['price'].str.replace(',', ''), errors='coerce')
-                # date is provided as mm/dd, adding current year to make the date formatted as mm/dd/yyyy
-                df['ipo_date'] = df['ipo_date'] + f"/{datetime.now().year}"
-                df['ipo_date'] = pd.to_datetime(df['ipo_date'], errors='coerce')
-                # TODO: Check end of year/beginning of year to see how to update the year, maybe use diff?
-                # df['ipo_date_diff'] = df['ipo_date'].diff()
-                # df.loc[abs(df['ipo_date_diff']) >= timedelta(days=60)]
-                df['exchange'] = 'Japan Stock Exchange' + ' - ' + df['ticker'].str.extract(r'\((\w*)\)')
-                df['ticker'] = df['ticker'].str.replace(r'(\(\w*\))', '', regex=True)
-                df['time_checked'] = self.time_checked
-                return df
-            except Exception as e:
-                logger.error(f"ERROR for TokyoIPO")
-                logger.error(e, exc_info=sys.exc_info())
+            url = self.sources['TokyoIPO'].get('url')
+            self.driver.get(url)
+            soup = self.return_soup()
+            table = soup.find('table', attrs={'class': 'iposchedulelist'})
+            table_data = []
+            row = []
+            for r in table.find_all('tr'):
+                for cell in r.find_all('td'):
+                    cell_text = cell.text.strip()
+                    if '\n\n▶\xa0Stock/Chart' in cell_text:
+                        table_data.append(row)
+                        row = [cell_text.replace('\n\n▶\xa0Stock/Chart', '')]
+                    else:
+                        row.append(cell_text)
+            table_data.append(row)
+            df = pd.DataFrame(table_data)
+            df.columns = ['company_name', 'ipo_date', 'ticker', 'shares_outstanding', 'blank_0', 'price_range',
+                          'price', 'bookbuilding_period', 'opening_price', 'percent_change', 'underwriters',
+                          'business_description', 'blank_1']
+            df.replace('', np.nan, inplace=True)
+            df.dropna(how='all', inplace=True)
+            df.drop(columns=['blank_0', 'business_description', 'blank_1'],  inplace=True, errors='ignore')
+            df['company_name'] = df['company_name'].str.strip()
+            df['price_range_expected_date'] = df['price_range'].str.extract(r'^(\d{0,2}\/\d{0,2})$')
+            df['price_expected_date'] = df['price'].str.extract(r'^(\d{0,2}\/\d{0,2})$')
+            df['price'] = pd.to_numeric(df['price'].str.replace(',', ''), errors='coerce')
+            # date is provided as mm/dd, adding current year to make the date formatted as mm/dd/yyyy
+            df['ipo_date'] = df['ipo_date'] + f"/{datetime.now().year}"
+            df['ipo_date'] = pd.to_datetime(df['ipo_date'], errors='coerce')
+            # TODO: Check end of year/beginning of year to see how to update the year, maybe use diff?
+            # df['ipo_date_diff'] = df['ipo_date'].diff()
+            # df.loc[abs(df['ipo_date_diff']) >= timedelta(days=60)]
+            df['exchange'] = 'Japan Stock Exchange' + ' - ' + df['ticker'].str.extract(r'\((\w*)\)')
+            df['ticker'] = df['ticker'].str.replace(r'(\(\w*\))', '', regex=True)
+            df['time_checked'] = self.time_checked
+            return df
 
         def av_api():
-            try:
-                parameters = self.sources['AlphaVantage'].get('parameters')
-                endpoint = self.sources['AlphaVantage'].get('endpoint')
-                r = requests.get(endpoint, params=parameters, verify=False)
-                if r.ok:
-                    cal = [row.replace('\r', '').split(',') for row in r.text.split('\n')]
-                    df = pd.DataFrame(cal)
-                    df.columns = df.loc[0]
-                    df = df.drop(0).reset_index(drop=True)
-                    df = df.dropna()
-                    if len(df) > 0:
-                        df.loc[df['name'].str.contains(r' Warrant'), 'assetType'] = 'Warrants'
-                        df.loc[df['name'].str.contains(r' Right'), 'assetType'] = 'Rights'
-                        df.loc[df['name'].str.contains(r' Unit'), 'assetType'] = 'Units'
-                        df['assetType'].fillna('Shares', inplace=True)
-                        for c in ['priceRangeLow', 'priceRangeHigh']:
-                            df[c] = pd.to_numeric(df[c], errors='coerce')
-                        df['time_checked'] = self.time_checked
-                        df.sort_values(by=['ipoDate', 'name'], inplace=True)
-                        df.rename(columns={
-                            'symbol': 'ticker',
-                            'name': 'company_name',
-                            'ipoDate': 'ipo_date',
-                            'priceRangeLow': 'price_range_low',
-                            'priceRangeHigh': 'price_range_high'}, inplace=True)
-                        return df
-            except Exception as e:
-                logger.error(f"ERROR for AlphaVantage")
-                logger.error(e, exc_info=sys.exc_info())
-
-        def spotlight_api():
-            try:
-                endpoint = self.sources['SpotlightAPI'].get('endpoint')
-                res = requests.get(endpoint)
-                if res.ok:
-                    rj = json.loads(res.text)
-                    df = pd.json_normalize(rj)
-                    # this api returns all IPOs so cutting it down to only IPOs since 2020
-                    df = df.loc[df['ListingDate'] >= '2020-01-01']
-                    # dropping additional documents columns, keeping 'Documents'
-                    df.drop(columns=['ExternalDocuments', 'CompanyDocuments'], inplace=True)
-                    # Documents is a list (it comes from json) which will throw an error when I try to drop duplicates
-                    # TypeError: unhashable type: 'list'
-                    # converting Documents to string to avoid that error
-                    df['Documents'] = df['Documents'].astype(str)
-                    df.rename(columns={
-                        'Id': 'num',
-                        'DateFrom': 'subscription_date_start',
-                        'DateTo': 'subscription_date_end',
-                        'ListingDate': 'ipo_date',
-                        'CompanyName': 'company_name',
-                        'EmissionDescriptionEnglish': 'listing_type'}, inplace=True)
+            parameters = self.sources['AlphaVantage'].get('parameters')
+            endpoint = self.sources['AlphaVantage'].get('endpoint')
+            r = requests.get(endpoint, params=parameters, verify=False)
+            if r.ok:
+                cal = [row.replace('\r', '').split(',') for row in r.text.split('\n')]
+                df = pd.DataFrame(cal)
+                df.columns = df.loc[0]
+                df = df.drop(0).reset_index(drop=True)
+                df = df.dropna()
+                if len(df) > 0:
+                    df.loc[df['name'].str.contains(r' Warrant'), 'assetType'] = 'Warrants'
+                    df.loc[df['name'].str.contains(r' Right'), 'assetType'] = 'Rights'
+                    df.loc[df['name'].str.contains(r' Unit'), 'assetType'] = 'Units'
+                    df['assetType'].fillna('Shares', inplace=True)
+                    for c in ['priceRangeLow', 'priceRangeHigh']:
+                        df[c] = pd.to_numeric(df[c], errors='coerce')
                     df['time_checked'] = self.time_checked
+                    df.sort_values(by=['ipoDate', 'name'], inplace=True)
+                    df.rename(columns={
+                        'symbol': 'ticker',
+                        'name': 'company_name',
+                        'ipoDate': 'ipo_date',
+                        'priceRangeLow': 'price_range_low',
+                        'priceRangeHigh': 'price_range_high'}, inplace=True)
                     return df
-            except Exception as e:
-                logger.error(f"ERROR for SpotlightAPI")
-                logger.error(e, exc_info=sys.exc_info())
+
+        def spotlight_api():
+            endpoint = self.sources['SpotlightAPI'].get('endpoint')
+            res = requests.get(endpoint)
+            if res.ok:
+                rj = json.loads(res.text)
+                df = pd.json_normalize(rj)
+                # this api returns all IPOs so cutting it down to only IPOs since 2020
+                df = df.loc[df['ListingDate'] >= '2020-01-01']
+                # dropping additional documents columns, keeping 'Documents'
+                df.drop(columns=['ExternalDocuments', 'CompanyDocuments'], inplace=True)
+                # Documents is a list (it comes from json) which will throw an error when I try to drop duplicates
+                # TypeError: unhashable type: 'list'
+                # converting Documents to string to avoid that error
+                df['Documents'] = df['Documents'].astype(str)
+                df.rename(columns={
+                    'Id': 'num',
+                    'DateFrom': 'subscription_date_start',
+                    'DateTo': 'subscription_date_end',
+                    'ListingDate': 'ipo_date',
+                    'CompanyName': 'company_name',
+                    'EmissionDescriptionEnglish': 'listing_type'}, inplace=True)
+                df['time_checked'] = self.time_checked
+                return df
 
         def ipohub():
-            try:
-                url = self.sources['IPOHub'].get('url')
-                self.driver.get(url)
-                soup = self.return_soup()
-                ipo_data = defaultdict(list)
-                for ipo in soup.find_all('a', attrs={'class': 'info-card'}):
-                    opts = {}
-                    for opt in ipo.find_all('div', attrs={'class': 'info-card__option'}):
-                        opt_items = opt.find_all('span')
-                        opts[opt_items[0].text.strip()] = opt_items[1].text.strip()
+            url = self.sources['IPOHub'].get('url')
+            self.driver.get(url)
+            soup = self.return_soup()
+            ipo_data = defaultdict(list)
+            for ipo in soup.find_all('a', attrs={'class': 'info-card'}):
+                opts = {}
+                for opt in ipo.find_all('div', attrs={'class': 'info-card__option'}):
+                    opt_items = opt.find_all('span')
+                    opts[opt_items[0].text.strip()] = opt_items[1].text.strip()
 
-                    card_items = {
-                        'company_name': ipo.find('div', attrs={'class': 'info-card__title'}).text.strip(),
-                        'exchange': ipo.find('div', attrs={'class': 'info-card__company-country'}).text.strip(),
-                        'listing_type': ipo.find('span', attrs={'class': 'info-card__tag-item'}).text.strip(),
-                        'subscription_period': opts.get('Subscr. period'),
-                        'price': opts.get('Price per share'),
-                        'market_cap': opts.get('Pre-money valuation'),
-                        'deal_size': opts.get('Target to raise'),
-                        'status': opts.get('Offer status'),
-                        'ipo_date': opts.get('First trading date'),
-                    }
-                    for k, v in card_items.items():
-                        ipo_data[k].append(v)
+                card_items = {
+                    'company_name': ipo.find('div', attrs={'class': 'info-card__title'}).text.strip(),
+                    'exchange': ipo.find('div', attrs={'class': 'info-card__company-country'}).text.strip(),
+                    'listing_type': ipo.find('span', attrs={'class': 'info-card__tag-item'}).text.strip(),
+                    'subscription_period': opts.get('Subscr. period'),
+                    'price': opts.get('Price per share'),
+                    'market_cap': opts.get('Pre-money valuation'),
+                    'deal_size': opts.get('Target to raise'),
+                    'status': opts.get('Offer status'),
+                    'ipo_date': opts.get('First trading date'),
+                }
+                for k, v in card_items.items():
+                    ipo_data[k].append(v)
 
-                df = pd.DataFrame(ipo_data)
-                df['ipo_date'] = pd.to_datetime(df['ipo_date'], errors='coerce')
-                # the website will provide only a year if they expect the IPO to list some time during the year
-                # that is gets interpreted as Jan. 1 of that year when converting to datetime
-                # any ipo_date earlier than today (i.e. Jan 1 this year) should not be considered as an actual date
-                df.loc[df['ipo_date'] <= datetime.utcnow(), 'ipo_date'] = pd.NaT
-                df.loc[df['price'].str.contains('-', na=False), 'price_range'] = df['price']
-                df['currency'] = df['price'].str.extract(r"\s(\w{3})")
-                df['price'] = pd.to_numeric(df['price'].str.replace(r"(\s\w{3})", '', regex=True), errors='coerce')
-                df['time_checked'] = self.time_checked
-                return df
-            except Exception as e:
-                logger.error(f"ERROR for IPOHub")
-                logger.error(e, exc_info=sys.exc_info())
+            df = pd.DataFrame(ipo_data)
+            df['ipo_date'] = pd.to_datetime(df['ipo_date'], errors='coerce')
+            # the website will provide only a year if they expect the IPO to list some time during the year
+            # that is gets interpreted as Jan. 1 of that year when converting to datetime
+            # any ipo_date earlier than today (i.e. Jan 1 this year) should not be considered as an actual date
+            df.loc[df['ipo_date'] <= datetime.utcnow(), 'ipo_date'] = pd.NaT
+            df.loc[df['price'].str.contains('-', na=False), 'price_range'] = df['price']
+            df['currency'] = df['price'].str.extract(r"\s(\w{3})")
+            df['price'] = pd.to_numeric(df['price'].str.replace(r"(\s\w{3})", '', regex=True), errors='coerce')
+            df['time_checked'] = self.time_checked
+            return df
 
         special_case_dict = {
-            'ASX': asx(),
-            'TokyoIPO': tkipo(),
-            'AlphaVantage': av_api(),
-            'SpotlightAPI': spotlight_api(),
-            'IPOHub': ipohub()
+            'ASX': asx,
+            'TokyoIPO': tkipo,
+            'AlphaVantage': av_api,
+            'SpotlightAPI': spotlight_api,
+            'IPOHub': ipohub
         }
 
-        for src, df in special_case_dict.items():
+        health = health or SourceHealth(self.conn, self.time_checked)
+        for src, func in special_case_dict.items():
+            if refresh is not None and not refresh.is_due(src, self.sources[src]):
+                continue
+            if not health.allow(src):
+                continue
             try:
+                df = health.call(src, func, none_is_failure=True)
                 if df is not None:
-                    self.update_table(df, self.sources[src].get('db_table_raw'))
+                    self.update_table(df, self.sources[src].get('db_table_raw'), self.sources[src].get('column_types'))
+                    if refresh is not None:
+                        refresh.record(src, df)
             except Exception as e:
+                logger.error(f"ERROR for {src}")
                 logger.error(e, exc_info=sys.exc_info())
 
-    def update_table(self, df_new: pd.DataFrame, source_table: str):
-        df = df_new.copy()
+    def update_table(self, df_new: pd.DataFrame, source_table: str, column_types: dict = None):
+        """
+        Adds new rows to the source's raw table and sets time_removed for rows no longer on the source.
+
+        :param df_new: data frame from the source
+        :param source_table: raw table for the source
+        :param column_types: optional dictionary of column names and types declared in source_reference,
+            these columns are stored as numbers or dates instead of text
+        :return: None
+        """
+        column_types = column_types or {}
+        df = apply_column_types(df_new.copy(), column_types)
         try:
             df_s = pd.read_sql_table(source_table, self.conn, parse_dates=['time_added', 'time_removed'])
+            # rows saved before the column types were declared are still text
+            df_s = apply_column_types(df_s, column_types)
             merge_cols = [c for c in df.columns if c not in ('time_checked', 'time_added', 'time_removed')]
             df_m = pd.merge(left=df_s, right=df, how='outer', on=merge_cols, suffixes=('', '_drop'), indicator=True)
             df_m['time_added'].fillna(df_m['time_checked'], inplace=True)
@@ -309,10 +328,20 @@ class WebDriver:
             df_m = df.rename(columns={'time_checked': 'time_added'})
             df_m['time_removed'] = pd.NaT
         df_m.sort_values(by='time_added', inplace=True)
-        df_m.to_sql(source_table, self.conn, if_exists='replace', index=False, dtype={
+        dtype = {
             'time_added': sql_types.DateTime,
-            'time_removed': sql_types.DateTime
-        })
+            'time_removed': sql_types.DateTime,
+            **column_sql_types({c: t for c, t in column_types.items() if c in df_m.columns})
+        }
+        try:
+            # replacing the rows rather than the table so the SQL views in data_transformation_sql are kept
+            replace_table_contents(df_m, source_table, self.conn, dtype=dtype)
+        except Exception as e:
+            logger.warning(f"Unable to replace rows in {source_table}, recreating the table - {e}")
+            with transaction(self.conn):
+                self.conn.execute(text(f"DROP TABLE IF EXISTS {source_table} CASCADE"))
+                df_m.to_sql(source_table, self.conn, if_exists='replace', index=False, dtype=dtype)
+        archive_frame(df, source_table, self.time_checked)
         # logger.info(f"Table {source_table} updated")
 
     def close_down(self):
@@ -320,23 +349,48 @@ class WebDriver:
         self.conn.close()
 
 
-def main():
-    wd = WebDriver()
+def main(wd: Optional[WebDriver] = None, force: bool = False):
+    """
+    Gathers data from each website source that is due to be checked (see refresh_tiers in source_reference).
+
+    :param wd: optional WebDriver kept open between runs, if None a new driver is opened and closed at the end
+    :param force: if True every source is checked
+    :return: None
+    """
+    keep_driver = wd is not None
+    if keep_driver:
+        wd.start_run()
+    else:
+        wd = WebDriver()
     wd.random_wait()
-    logger.info("Gathering data from sources")
-    for k, v in wd.website_sources.items():
-        try:
+    refresh = SourceRefresh(wd.conn, force=force)
+    health = SourceHealth(wd.conn, wd.time_checked)
+    due = [k for k, v in wd.website_sources.items() if refresh.is_due(k, v) and health.allow(k)]
+    logger.info(f"Gathering data from {len(due)} of {len(wd.website_sources)} sources")
+    for k in due:
+        v = wd.website_sources[k]
+
+        def fetch():
             wd.load_url(v.get('url'), sleep_after=True)
-            df = wd.parse_table(**v)
+            return wd.parse_table(**v)
+
+        try:
+            df = health.call(k, fetch)
             if df is not None:
-                wd.update_table(df, v.get('db_table_raw'))
+                wd.update_table(df, v.get('db_table_raw'), v.get('column_types'))
+                refresh.record(k, df)
         except Exception as e:
             logger.error(f"ERROR for {k}")
             logger.error(e, exc_info=sys.exc_info())
             error_screenshot_file = f"{k} Error {wd.time_checked.isoformat()}.png"
             wd.driver.save_screenshot(os.path.join(log_folder, 'Screenshots', error_screenshot_file))
-    wd.special_cases()
-    wd.close_down()
+    wd.special_cases(refresh, health)
+    refresh.save()
+    health.save()
+    if keep_driver:
+        wd.conn.close()
+    else:
+        wd.close_down()
 
 
 if __name__ == '__main__':
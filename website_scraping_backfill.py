@@ -6,6 +6,7 @@ from selenium import webdriver
 from selenium.webdriver.firefox.options import Options
 # from selenium.webdriver.support import expected_conditions as EC
 import pandas as pd
+from excel_export import save_excel
 
 
 class BackFill:
@@ -76,8 +77,7 @@ class BackFill:
         if self.cols:
             df.columns = self.cols
         backfill_file = os.path.join(backfill_folder, f"{self.source} Backfill {self.time_stamp}.xlsx")
-        df.to_excel(backfill_file, sheet_name=f"Backfill {self.source}"[:30], index=False, encoding='utf-8-sig',
-                    freeze_panes=(1, 0))
+        save_excel(df, backfill_file, sheet_name=f"Backfill {self.source}"[:30], freeze_panes=(1, 0))
 
 
 def main():
@@ -1,18 +1,24 @@
 from pg_connection import pg_connection
+from name_normalization import update_name_keys
 import pandas as pd
 from datetime import datetime, timedelta
-import confuse
 import requests
 import json
 import time
 import os
 import sys
 from io import StringIO
+from functools import lru_cache
 from logging_ipo_dates import logger
 
 
-config = confuse.Configuration('wf_api', __name__)
-config.set_file('config.yaml')
+@lru_cache(maxsize=None)
+def get_config():
+    # loaded the first time it's needed instead of when the module is imported
+    import confuse
+    config = confuse.Configuration('wf_api', __name__)
+    config.set_file('config.yaml')
+    return config
 
 
 def get_upcoming_ipos() -> pd.DataFrame:
@@ -30,8 +36,8 @@ def get_upcoming_ipos() -> pd.DataFrame:
     ,ipo.notes
     --,ipo.time_added
 FROM all_ipos ipo
-LEFT JOIN entity_mapping em ON ipo.company_name = em.company_name
-LEFT JOIN peo_pipe pp ON ipo.company_name = pp.company_name OR em.iconum = pp.iconum
+LEFT JOIN entity_mapping em ON ipo.name_key = em.name_key
+LEFT JOIN peo_pipe pp ON ipo.name_key = pp.name_key OR em.iconum = pp.iconum
 WHERE 
     ipo.ipo_date >= CURRENT_DATE
     AND (
@@ -39,6 +45,9 @@ WHERE
         OR (pp.price != ipo.price OR pp.price IS NULL)
     )"""
     try:
+        # entity_mapping has one row for each name key (see entity_mapping.save_entity_mapping)
+        for tbl in ['all_ipos', 'entity_mapping', 'peo_pipe']:
+            update_name_keys(conn, tbl)
         df = pd.read_sql_query(query, conn, parse_dates=['ipo_date'])
         logger.info(f"{len(df)} upcoming IPOs returned from query")
         # columns must look EXACTLY like they do when downloading bulk upload template!
@@ -83,9 +92,9 @@ class GenesysAPI:
         else:
             self.base_url = 'https://genesys-stg.factset.com'
         if self.content_set == 'loans':
-            self.token = self.authenticate(api_key=config['api']['genesys']['loans_key'].get())
+            self.token = self.authenticate(api_key=get_config()['api']['genesys']['loans_key'].get())
         elif self.content_set in ('peopipe', 'peo-pipe', 'peo_pipe'):
-            self.token = self.authenticate(api_key=config['api']['genesys']['peopipe_key'].get())
+            self.token = self.authenticate(api_key=get_config()['api']['genesys']['peopipe_key'].get())
         else:
             raise ValueError(f"Unknown content set, no API key available for {content_set}")
         self.headers = {'accept': 'application/json', 'Content-Type': 'application/json', 'Authorization': f'Bearer {self.token}'}
@@ -304,7 +313,7 @@ class GenesysAPI:
 
 
 def main():
-    wf_id = config['workflow']['id'].get()  # 15490
+    wf_id = get_config()['workflow']['id'].get()  # 15490
     gs = GenesysAPI(content_set='peopipe', user_id=21160, environment='prod')
     df = get_upcoming_ipos()
     wf_upload_file = os.path.join(os.getcwd(), 'temp_ipo_monitoring_upload.csv')